@@ -0,0 +1,49 @@
+"""Rolling sleep averages over the last days.
+
+The app keeps per-day totals in daily_sleep_summary and the totals of each
+rolling window in rolling_sleep_stats, both updated by deltas on every
+write. Functions here are the pure parts: wake windows between consecutive
+records and averages of window totals.
+"""
+from collections import Counter, defaultdict
+
+WINDOWS = (7, 30)
+
+
+def wake_windows(rows, previous_wake=None):
+    """Wake windows per day for rows of (sleep_time, wake_time, day) sorted by sleep time.
+
+    Times are UTC epoch seconds, so a window across a clock change is the
+    time that really passed. A window is the time between a wake-up and
+    the next sleep and belongs to the day of that next sleep, like in
+    stats.aggregate. Overlapping records (no time awake between them) do
+    not count.
+    """
+    windows = defaultdict(Counter)
+    for sleep_time, wake_time, day in rows:
+        if previous_wake is not None:
+            seconds = sleep_time - previous_wake
+            if seconds > 0:
+                windows[day]['wake_window_count'] += 1
+                windows[day]['wake_window_seconds'] += seconds
+        previous_wake = wake_time
+    return windows
+
+
+def averages(totals, days, tracked_days):
+    """Per-day averages of a window's totals.
+
+    tracked_days is the number of days of the window since the first
+    record, so a window longer than the history is not diluted.
+    """
+    divisor = max(tracked_days, 1)
+    window_count = totals['wake_window_count']
+    rating_count = totals['rating_count']
+    return {
+        'days': days,
+        'tracked_days': tracked_days,
+        'avg_total_sleep_seconds': int((totals['nap_seconds'] + totals['night_seconds']) / divisor),
+        'avg_nap_count': round(totals['nap_count'] / divisor, 2),
+        'avg_wake_window_seconds': None if window_count == 0 else int(totals['wake_window_seconds'] / window_count),
+        'avg_sleep_rating': None if rating_count == 0 else round(totals['rating_sum'] / rating_count, 2),
+    }
@@ -1,146 +1,1881 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, jsonify, Response, stream_with_context, abort, has_request_context, has_app_context, make_response, g, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, func, inspect, case, select, bindparam, create_engine, delete, update, literal, text, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.types import TypeDecorator
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-import pytz
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.local import LocalProxy
+from page_cache import LRUCache
+from tenants import TenantEngines, is_valid_tenant_id
+from events import EventBroker, format_sse
+from metrics import Registry
+from jobs import JobQueue, retry_delay
+from assets import AssetManifest, accepted_encoding, compress, is_compressible
+import click
+import hashlib
+import heapq
+import json
+import io
 import os
+import queue
+import sqlite3
+import threading
+import time
+import analytics
+import export
+import importer
+import sync
+import migrate_db
+import prediction
+import search
+import timezones
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
+def load_config(app):
+    """Set the configuration defaults, read from environment variables"""
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///sleep_tracker.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///sleep_tracker.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Profil SQLite dla wielu workerów: WAL pozwala czytać podczas zapisu,
+    # busy_timeout każe czekać na blokadę zamiast od razu zwracać "database is locked"
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -20000)),  # ujemne = KiB
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'temp_store': 'MEMORY',
+    }
+    # Liczba dni, dla których trzymamy wyrenderowaną stronę główną
+    app.config['PAGE_CACHE_SIZE'] = int(os.getenv('PAGE_CACHE_SIZE', 256))
+    # Osobna pula połączeń tylko do odczytu dla żądań GET (poza trybem wielu rodzin)
+    app.config['SQLITE_READ_ONLY_POOL'] = os.getenv('SQLITE_READ_ONLY_POOL', 'False').lower() == 'true'
+    # Co ile sekund strumień SSE wysyła heartbeat i sprawdza stan drzemki w bazie
+    app.config['SSE_HEARTBEAT_SECONDS'] = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+    # Tryb wielu rodzin: każda rodzina (tenant) ma własny plik bazy danych
+    app.config['TENANT_MODE'] = os.getenv('TENANT_MODE', 'False').lower() == 'true'
+    app.config['TENANT_DB_DIR'] = os.getenv('TENANT_DB_DIR', os.path.join(app.instance_path, 'tenants'))
+    app.config['TENANT_ENGINE_CACHE_SIZE'] = int(os.getenv('TENANT_ENGINE_CACHE_SIZE', 32))
+    app.config['TENANT_ENGINE_IDLE_SECONDS'] = int(os.getenv('TENANT_ENGINE_IDLE_SECONDS', 600))
+    # Rodziny, których bazy powstają przy pierwszym użyciu (np. TENANTS=kowalscy,nowakowie); kolejne
+    # dodaje flask init-db --tenant. Nieznana rodzina w żądaniu dostaje 404 zamiast nowego pliku bazy
+    app.config['TENANTS'] = [name.strip() for name in os.getenv('TENANTS', '').split(',') if name.strip()]
+    # Żądania dłuższe niż tyle ms są logowane razem z zapytaniami SQL (0 = wyłączone)
+    app.config['SLOW_REQUEST_MS'] = float(os.getenv('SLOW_REQUEST_MS', 0))
+    # Ile zapytań SQL zapamiętać na żądanie na potrzeby logu wolnych żądań
+    app.config['SLOW_REQUEST_MAX_STATEMENTS'] = int(os.getenv('SLOW_REQUEST_MAX_STATEMENTS', 50))
+    # Skompilowane szablony Jinja zapisywane na dysku, współdzielone przez procesy (pusty = wyłączone)
+    app.config['JINJA_CACHE_DIR'] = os.getenv('JINJA_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+    # Wyłącz we wdrożeniach, gdzie schemat przygotowuje jednorazowo `flask init-db`
+    app.config['INIT_DB_ON_STARTUP'] = os.getenv('INIT_DB_ON_STARTUP', 'True').lower() == 'true'
+    # Limity /api/sync: zdarzeń w jednym żądaniu i zmienionych wpisów w jednej odpowiedzi
+    app.config['SYNC_MAX_EVENTS'] = int(os.getenv('SYNC_MAX_EVENTS', 500))
+    app.config['SYNC_PAGE_SIZE'] = int(os.getenv('SYNC_PAGE_SIZE', 500))
+    # Co zrobić z wpisem nakładającym się na istniejący: reject (odrzuć), merge (połącz), flag (zapisz i oznacz)
+    app.config['OVERLAP_POLICY'] = os.getenv('OVERLAP_POLICY', 'reject')
+    # Archiwum starych wpisów: miesięczne pliki kolumnowe, osobny katalog dla każdej rodziny
+    app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    # Wpisy starsze niż tyle dni `flask archive-records` przenosi do archiwum (całymi miesiącami)
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', 730))
+    # Prognoza następnej drzemki: z ilu ostatnich dni uczy się model i po ilu dniach obserwacja traci połowę wagi
+    app.config['NAP_MODEL_HISTORY_DAYS'] = int(os.getenv('NAP_MODEL_HISTORY_DAYS', 60))
+    app.config['NAP_MODEL_HALF_LIFE_DAYS'] = float(os.getenv('NAP_MODEL_HALF_LIFE_DAYS', prediction.HALF_LIFE_DAYS))
+    # Async API (asgi.py): połączenia aiosqlite na bazę, czas oczekiwania na wolne połączenie
+    # i wątki dla stron Flask podłączonych jako WSGI (każdy otwarty strumień SSE zajmuje jeden)
+    app.config['ASYNC_POOL_SIZE'] = int(os.getenv('ASYNC_POOL_SIZE', 8))
+    app.config['ASYNC_POOL_TIMEOUT'] = float(os.getenv('ASYNC_POOL_TIMEOUT', 60))
+    app.config['ASYNC_WSGI_THREADS'] = int(os.getenv('ASYNC_WSGI_THREADS', 32))
+    # Pliki statyczne pod nazwami z hashem treści, buforowane przez przeglądarkę bez ponownego sprawdzania
+    app.config['STATIC_FINGERPRINTS'] = os.getenv('STATIC_FINGERPRINTS', 'True').lower() == 'true'
+    app.config['STATIC_MAX_AGE'] = int(os.getenv('STATIC_MAX_AGE', 365 * 24 * 3600))
+    # Kompresja odpowiedzi HTML/JSON (brotli lub gzip); mniejsze odpowiedzi wysyłamy bez kompresji
+    app.config['COMPRESS_RESPONSES'] = os.getenv('COMPRESS_RESPONSES', 'True').lower() == 'true'
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+    app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+    # Zadania w tle (okna aktywności, model drzemek) po zapisie wpisu: wątki, liczba prób i odstęp ponowień
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_RETRY_SECONDS'] = float(os.getenv('JOB_RETRY_SECONDS', 1))
+    app.config['JOB_RETRY_MAX_SECONDS'] = float(os.getenv('JOB_RETRY_MAX_SECONDS', 300))
+    # Po tylu sekundach pobrane, ale niezakończone zadanie (np. proces padł w trakcie) wraca do kolejki
+    app.config['JOB_LEASE_SECONDS'] = float(os.getenv('JOB_LEASE_SECONDS', 300))
+    # Wyszukiwanie w notatkach: wyników na stronę
+    app.config['SEARCH_PAGE_SIZE'] = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+    # Strefa czasowa nowych baz (rodzin); istniejąca baza pamięta swoją w app_settings (flask set-time-zone)
+    app.config['TIME_ZONE'] = os.getenv('TIME_ZONE', timezones.DEFAULT_ZONE)
 
-# Initialize extensions
-db = SQLAlchemy(app)
+# Widoki, haki żądań i polecenia CLI - create_app rejestruje je na każdej aplikacji
+bp = Blueprint('main', __name__, cli_group=None)
 
-# Dodaj strefę czasową dla Polski
-local_tz = pytz.timezone('Europe/Warsaw')
+def _current_app():
+    """App of the current context, or the module's WSGI app outside any (pool threads, asgi.py)"""
+    return current_app._get_current_object() if has_app_context() else app
 
-# Funkcja zwracająca aktualny czas w strefie czasowej warszawskiej
-def get_current_warsaw_time():
-    # Zamiast używać datetime.now(pytz.UTC), użyjmy datetime.utcnow()
-    # i jawnie ustawmy strefę czasową UTC
-    utc_now = datetime.utcnow().replace(tzinfo=pytz.UTC)
-    
-    # Konwertuj do strefy czasowej warszawskiej
-    warsaw_time = utc_now.astimezone(local_tz)
-    
-    return warsaw_time
+def _state():
+    return _current_app().extensions['sleep_tracker']
+
+def _is_memory_database(uri):
+    return uri.startswith('sqlite') and (uri.rstrip('/') in ('sqlite:', 'sqlite:/') or ':memory:' in uri)
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to every new SQLite connection"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    set_sqlite_pragmas(dbapi_connection, read_only=isinstance(dbapi_connection, ReadOnlyConnection))
+
+class ReadOnlyConnection(sqlite3.Connection):
+    """sqlite3 connection of the read-only engine (mode=ro), so pragmas can tell it apart"""
+
+def set_sqlite_pragmas(dbapi_connection, read_only=False):
+    """Run SQLITE_PRAGMAS on a DB-API connection (sqlite3 or the aiosqlite adapter)"""
+    # Połączenia otwierane są także poza kontekstem aplikacji (pula aiosqlite w asgi.py)
+    config_app = _current_app()
+    cursor = dbapi_connection.cursor()
+    for name, value in config_app.config['SQLITE_PRAGMAS'].items():
+        # Tryb WAL jest zapisany w pliku bazy - połączenie tylko do odczytu i tak nie może go zmienić
+        if value is None or (read_only and name == 'journal_mode'):
+            continue
+        try:
+            cursor.execute(f"PRAGMA {name}={value}")
+        except sqlite3.OperationalError as e:
+            config_app.logger.warning(f"Cannot set PRAGMA {name}: {str(e)}")
+    cursor.close()
+
+# Metryki w formacie Prometheusa, udostępniane pod /metrics
+metrics_registry = Registry()
+REQUEST_SECONDS = metrics_registry.histogram(
+    'sleep_tracker_request_duration_seconds', 'Request handling time by route', ('route', 'method')
+)
+REQUESTS_TOTAL = metrics_registry.counter(
+    'sleep_tracker_requests_total', 'Handled requests by route and status', ('route', 'method', 'status')
+)
+SQL_STATEMENTS_TOTAL = metrics_registry.counter(
+    'sleep_tracker_sql_statements_total', 'Executed SQL statements by route', ('route',)
+)
+REQUEST_SQL_STATEMENTS = metrics_registry.histogram(
+    'sleep_tracker_request_sql_statements', 'SQL statements per request by route', ('route',),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500)
+)
+REQUEST_SQL_SECONDS = metrics_registry.histogram(
+    'sleep_tracker_request_sql_seconds', 'Time spent in SQL per request by route', ('route',)
+)
+SQL_WRITE_SECONDS = metrics_registry.histogram(
+    'sleep_tracker_sql_write_seconds',
+    'Duration of write statements, including waiting for the SQLite write lock (busy_timeout)', ('route',)
+)
+DB_LOCKED_TOTAL = metrics_registry.counter(
+    'sleep_tracker_db_locked_total', 'Statements that failed with "database is locked"', ('route',)
+)
+DB_CONFLICTS_TOTAL = metrics_registry.counter(
+    'sleep_tracker_db_conflicts_total', 'Concurrent updates rejected with 409 for the client to retry', ('route',)
+)
+TEMPLATE_SECONDS = metrics_registry.histogram(
+    'sleep_tracker_template_render_seconds', 'Template rendering time', ('template',)
+)
+JOBS_PENDING = metrics_registry.gauge(
+    'sleep_tracker_jobs_pending', 'Queued background jobs in the last processed database', ('kind',)
+)
+JOBS_TOTAL = metrics_registry.counter(
+    'sleep_tracker_jobs_total', 'Background job runs by outcome (done, retry, failed)', ('kind', 'outcome')
+)
+JOB_SECONDS = metrics_registry.histogram(
+    'sleep_tracker_job_duration_seconds', 'Time spent running a background job', ('kind',)
+)
+JOB_LATENCY_SECONDS = metrics_registry.histogram(
+    'sleep_tracker_job_latency_seconds', 'Time from queueing a background job to its completion', ('kind',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+_WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+def _metrics_route():
+    """Route label of the current request, '-' outside requests (CLI, background threads)"""
+    if not has_request_context():
+        return '-'
+    # Etykieta bez nazwy blueprintu ("main.index" -> "index"), jak trasy w asgi.py
+    return request.endpoint.rpartition('.')[2] if request.endpoint else 'unknown'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    """Count the statement and its time for the current request"""
+    elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+    route = _metrics_route()
+    SQL_STATEMENTS_TOTAL.inc(route)
+    if statement.lstrip()[:7].upper().startswith(_WRITE_PREFIXES):
+        SQL_WRITE_SECONDS.observe(elapsed, route)
+    if not has_request_context() or 'request_started' not in g:
+        return
+    g.sql_count += 1
+    g.sql_seconds += elapsed
+    if g.sql_statements is not None and len(g.sql_statements) < current_app.config['SLOW_REQUEST_MAX_STATEMENTS']:
+        g.sql_statements.append((elapsed, statement))
+
+@event.listens_for(Engine, 'handle_error')
+def _record_statement_error(context):
+    """Drop the timer of a failed statement and count lock errors"""
+    if context.connection is not None and context.connection.info.get('statement_started'):
+        context.connection.info['statement_started'].pop()
+    if 'database is locked' in str(context.original_exception):
+        DB_LOCKED_TOTAL.inc(_metrics_route())
+
+def _start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+def _record_template(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - started.pop(), template.name or '-')
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    g.sql_statements = [] if current_app.config['SLOW_REQUEST_MS'] > 0 else None
+
+@bp.after_app_request
+def record_request_metrics(response):
+    """Record latency and SQL usage of the request, log it when slow"""
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = _metrics_route()
+    REQUEST_SECONDS.observe(elapsed, route, request.method)
+    REQUESTS_TOTAL.inc(route, request.method, str(response.status_code))
+    REQUEST_SQL_STATEMENTS.observe(g.sql_count, route)
+    REQUEST_SQL_SECONDS.observe(g.sql_seconds, route)
+
+    slow_ms = current_app.config['SLOW_REQUEST_MS']
+    if slow_ms > 0 and elapsed * 1000 >= slow_ms:
+        lines = [
+            f"Slow request {request.method} {request.full_path.rstrip('?')} ({route}): "
+            f"{elapsed * 1000:.1f} ms, {g.sql_count} SQL statements in {g.sql_seconds * 1000:.1f} ms"
+        ]
+        for statement_seconds, statement in g.sql_statements:
+            lines.append(f"  {statement_seconds * 1000:8.2f} ms  {' '.join(statement.split())}")
+        if g.sql_count > len(g.sql_statements):
+            lines.append(f"  ... {g.sql_count - len(g.sql_statements)} more")
+        current_app.logger.warning('\n'.join(lines))
+    return response
+
+@bp.app_url_defaults
+def fingerprint_static_url(endpoint, values):
+    """Point url_for('static', filename=...) to the fingerprinted file name"""
+    static_assets = _state().static_assets
+    if endpoint == 'static' and static_assets is not None and 'filename' in values:
+        values['filename'] = static_assets.url_name(values['filename'])
+
+def serve_static(filename):
+    """Serve a fingerprinted asset from memory as immutable, other names from the static folder"""
+    static_assets = _state().static_assets
+    asset = static_assets.lookup(filename) if static_assets is not None else None
+    if asset is None:
+        return current_app.send_static_file(filename)
+    encoding, body = asset.body(request.headers.get('Accept-Encoding'))
+    response = Response(body, mimetype=asset.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset.digest if encoding is None else f"{asset.digest}-{encoding}")
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['STATIC_MAX_AGE']
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@bp.after_app_request
+def compress_response(response):
+    """Compress HTML and JSON responses with the best encoding the client accepts"""
+    if (not current_app.config['COMPRESS_RESPONSES'] or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    # Skompresowana treść nie jest identyczna bajt w bajt - ETag staje się słaby,
+    # a If-None-Match i tak porównuje słabo, więc 304 działa dalej
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    data = response.get_data()
+    if response.status_code == 304 or len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(compress(data, encoding, current_app.config['COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def get_read_only_engine():
+    """Return the engine for read-only GET requests, or None when disabled"""
+    if not current_app.config['SQLITE_READ_ONLY_POOL']:
+        return None
+    state = _state()
+    if state.read_only_engine is None:
+        path = db.engine.url.database
+        if db.engine.url.get_backend_name() != 'sqlite' or not path or path == ':memory:':
+            return None
+        state.read_only_engine = create_engine(
+            f"sqlite:///file:{path}?mode=ro&uri=true",
+            connect_args={'factory': ReadOnlyConnection},
+            **current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        )
+    return state.read_only_engine
+
+def current_tenant():
+    """Return the tenant id of the current request or CLI command, None outside tenant mode"""
+    if not has_app_context() or not current_app.config['TENANT_MODE']:
+        return None
+    return g.get('tenant_id')
+
+def prepare_schema(engine, log=None):
+    """Migrate an existing SQLite database, create missing tables and record the schema version"""
+    log = log or _current_app().logger.info
+    path = engine.url.database
+    versioned = engine.url.get_backend_name() == 'sqlite' and path and path != ':memory:'
+    # Migracje przed create_all - inaczej create_all utworzyłby puste tabele, które migracja ma wypełnić
+    if versioned and os.path.exists(path):
+        if migrate_db.migrate_database(path, log=log) == migrate_db.LATEST_VERSION:
+            # Aktualny schemat - nowe tabele zawsze dochodzą razem z migracją
+            return
+    db.metadata.create_all(engine)
+    # Nowa baza dostaje strefę z konfiguracji - od niej zależą dni przypisania wpisów
+    with engine.begin() as connection:
+        connection.execute(sqlite_insert(AppSetting.__table__).values(
+            key='time_zone', value=_current_app().config['TIME_ZONE']
+        ).on_conflict_do_nothing())
+    if versioned:
+        # Nowa baza przechodzi wszystkie migracje na pustych tabelach z create_all - są idempotentne,
+        # więc tylko sprawdzają schemat i zapisują jego wersję
+        migrate_db.migrate_database(path, log=log)
+
+def tenant_database_path(tenant_id):
+    return os.path.join(_current_app().config['TENANT_DB_DIR'], f"{tenant_id}.db")
+
+def tenant_exists(tenant_id):
+    """Check that a tenant has a database or is registered in TENANTS (its database is created on first use)"""
+    return (
+        tenant_id in _current_app().config['TENANTS'] or tenant_id in tenant_engines
+        or os.path.exists(tenant_database_path(tenant_id))
+    )
+
+def _open_tenant_engine(tenant_id):
+    """Open a tenant's database, creating or migrating its schema on first use"""
+    config_app = _current_app()
+    os.makedirs(config_app.config['TENANT_DB_DIR'], exist_ok=True)
+    path = tenant_database_path(tenant_id)
+    engine = create_engine(f"sqlite:///{path}", **config_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    prepare_schema(engine, log=config_app.logger.debug)
+    upgrade_archive(tenant_id, timezones.get_zone(read_time_zone(engine)))
+    return engine
+
+# Silniki baz rodzin aplikacji z bieżącego kontekstu (tworzone w create_app)
+tenant_engines = LocalProxy(lambda: _state().tenant_engines)
+
+class RoutingSession(Session):
+    """Session sending queries to the tenant's database, and GET/HEAD requests
+    to the read-only pool when it is enabled"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        # Async API (asgi.py) podaje połączenie aiosqlite, na którym działa cała obsługa żądania
+        connection = g.get('db_connection') if has_app_context() else None
+        if connection is not None:
+            return connection
+        tenant_id = current_tenant()
+        if tenant_id is not None:
+            return tenant_engines.get(tenant_id)
+        if has_request_context() and request.method in ('GET', 'HEAD') and not self._flushing:
+            engine = get_read_only_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+# Initialize extensions (bound to the app in create_app)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Strefa czasowa rodziny (None poza trybem wielu rodzin), czytana z jej bazy raz na proces
+_time_zones = LocalProxy(lambda: _state().time_zones)
+
+def current_time_zone():
+    """ZoneInfo of the current family's time zone"""
+    tenant_id = current_tenant()
+    name = _time_zones.get(tenant_id)
+    if name is None:
+        if not has_app_context():
+            return timezones.get_zone(_current_app().config['TIME_ZONE'])
+        engine = tenant_engines.get(tenant_id) if tenant_id is not None else db.engine
+        name = _time_zones[tenant_id] = read_time_zone(engine)
+    return timezones.get_zone(name)
+
+def get_current_local_time():
+    """Current time in the family's time zone, as an aware datetime"""
+    return timezones.now(current_time_zone())
+
+class LocalTime(TypeDecorator):
+    """Naive local time in Python, integer UTC epoch seconds in the database.
+
+    Values are converted in the current family's time zone, so a stored
+    instant does not depend on it, and range conditions compare integers.
+    Fractions of a second are dropped.
+    """
+    impl = db.Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return timezones.to_epoch(value, current_time_zone())
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else timezones.from_epoch(value, current_time_zone())
+
+# Sen trwający do 4h włącznie to drzemka, dłuższy to sen nocny
+NAP_MAX_DURATION = timedelta(hours=4)
+_NAP_MAX_SECONDS = NAP_MAX_DURATION.total_seconds()
+
+def classify_sleep(sleep_time, wake_time, zone=None):
+    """Return (duration_seconds, is_nap, day) for a sleep interval in local time.
+
+    Naps belong to the day they start on, night sleep to the day it ends on.
+    The duration is real elapsed time, so the night clocks change is an
+    hour shorter or longer than the wall clock shows.
+    """
+    return classify_duration(sleep_time, wake_time, timezones.seconds_between(sleep_time, wake_time, zone or current_time_zone()))
+
+def classify_duration(sleep_time, wake_time, duration):
+    """classify_sleep for an already known duration in seconds (e.g. from UTC epoch seconds)"""
+    is_nap = duration <= _NAP_MAX_SECONDS
+    day = sleep_time.date() if is_nap else wake_time.date()
+    return duration, is_nap, day
+
+def is_standard_note(notes):
+    """Check whether notes are empty or an automatic label ("Sen nocny", "Drzemka nr N")"""
+    notes = (notes or '').strip()
+    return not notes or notes == "Sen nocny" or notes.startswith("Drzemka nr")
 
 class SleepRecord(db.Model):
     """Model for sleep records"""
     __tablename__ = 'sleep_records'
+    __table_args__ = (
+        db.Index('ix_sleep_records_day_sleep_time', 'day', 'sleep_time'),
+        db.Index('ix_sleep_records_wake_time', 'wake_time'),
+        # Wyszukiwanie nakładających się wpisów (patrz find_overlaps)
+        db.Index('ix_sleep_records_sleep_time', 'sleep_time'),
+        db.Index('ix_sleep_records_duration_seconds', 'duration_seconds'),
+        # Usunięte i zarchiwizowane id nie wracają do nowych wpisów
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    sleep_time = db.Column(db.DateTime, nullable=False)
-    wake_time = db.Column(db.DateTime, nullable=False)
+    # Sekundy UTC w bazie, czas lokalny rodziny w Pythonie (patrz LocalTime)
+    sleep_time = db.Column(LocalTime, nullable=False)
+    wake_time = db.Column(LocalTime, nullable=False)
     notes = db.Column(db.String(200))
     sleep_rating = db.Column(db.Integer, nullable=True)  # Rating from 1-5 stars
     is_rated = db.Column(db.Boolean, default=False)  # Flag to track if sleep has been rated
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Pola wyliczane z sleep_time/wake_time przy każdym zapisie (patrz classify_sleep)
+    duration_seconds = db.Column(db.Integer, nullable=False, default=0)
+    is_nap = db.Column(db.Boolean, nullable=False, default=True)
+    day = db.Column(db.Date, nullable=False)  # Dzień lokalny, do którego przypisujemy wpis
+
+    # Numer drzemki w ciągu dnia - wyliczany przy odczycie (patrz records_for_day)
+    nap_number = None
 
     @property
     def sleep_duration(self):
         """Calculate sleep duration in hours"""
-        duration = self.wake_time - self.sleep_time
-        return round(duration.total_seconds() / 3600, 2)
+        return round(timezones.seconds_between(self.sleep_time, self.wake_time, current_time_zone()) / 3600, 2)
+
+    @property
+    def label(self):
+        """Notes to display, with automatic labels derived from the record's position in its day"""
+        if not is_standard_note(self.notes):
+            return self.notes
+        if not self.is_nap:
+            return "Sen nocny"
+        if self.nap_number is None:
+            return "Drzemka"
+        return f"Drzemka nr {self.nap_number}"
+
+    def update_derived_fields(self):
+        """Recompute duration, nap flag and attribution day from the times"""
+        self.duration_seconds, self.is_nap, self.day = classify_sleep(self.sleep_time, self.wake_time)
+
+@event.listens_for(SleepRecord, 'before_insert')
+@event.listens_for(SleepRecord, 'before_update')
+def _sync_derived_fields(mapper, connection, record):
+    record.update_derived_fields()
+
+# Indeks pełnotekstowy notatek (search.py) powstaje i znika razem z tabelą wpisów
+@event.listens_for(SleepRecord.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    for statement in search.CREATE_STATEMENTS:
+        connection.exec_driver_sql(statement)
+
+@event.listens_for(SleepRecord.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kw):
+    for statement in search.DROP_STATEMENTS:
+        connection.exec_driver_sql(statement)
+
+class DailySleepSummary(db.Model):
+    """Per-day totals of sleep records, maintained incrementally on every write"""
+    __tablename__ = 'daily_sleep_summary'
+
+    day = db.Column(db.Date, primary_key=True)
+    nap_count = db.Column(db.Integer, nullable=False, default=0)
+    nap_seconds = db.Column(db.Integer, nullable=False, default=0)
+    night_count = db.Column(db.Integer, nullable=False, default=0)
+    night_seconds = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)  # Ocenione noce
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    # Okna aktywności kończące się zaśnięciem w tym dniu (patrz analytics.wake_windows)
+    wake_window_count = db.Column(db.Integer, nullable=False, default=0)
+    wake_window_seconds = db.Column(db.Integer, nullable=False, default=0)
+
+SUMMARY_FIELDS = (
+    'nap_count', 'nap_seconds', 'night_count', 'night_seconds', 'rating_count', 'rating_sum',
+    'wake_window_count', 'wake_window_seconds',
+)
+
+class RollingSleepStats(db.Model):
+    """Totals of daily_sleep_summary over the last window_days days, updated with every delta"""
+    __tablename__ = 'rolling_sleep_stats'
+
+    window_days = db.Column(db.Integer, primary_key=True)
+    end_day = db.Column(db.Date, nullable=False)  # Ostatni dzień okna
+    nap_count = db.Column(db.Integer, nullable=False, default=0)
+    nap_seconds = db.Column(db.Integer, nullable=False, default=0)
+    night_count = db.Column(db.Integer, nullable=False, default=0)
+    night_seconds = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    wake_window_count = db.Column(db.Integer, nullable=False, default=0)
+    wake_window_seconds = db.Column(db.Integer, nullable=False, default=0)
+
+def summary_contribution(is_nap, duration_seconds, sleep_rating):
+    """Return the amounts a single record adds to its day's summary"""
+    if is_nap:
+        return {'nap_count': 1, 'nap_seconds': duration_seconds}
+    contribution = {'night_count': 1, 'night_seconds': duration_seconds}
+    if sleep_rating is not None:
+        contribution['rating_count'] = 1
+        contribution['rating_sum'] = sleep_rating
+    return contribution
+
+def _committed_value(record, key):
+    """Return the attribute value as it is currently stored in the database"""
+    history = inspect(record).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(record, key)
+
+SUMMARY_INPUTS = ('sleep_time', 'wake_time', 'sleep_rating')
+
+_summary_table = DailySleepSummary.__table__
+# Atomowa aktualizacja (kolumna = kolumna + delta), żeby równoległe zapisy się nie nadpisywały
+_summary_update = _summary_table.update().where(_summary_table.c.day == bindparam('b_day')).values(
+    {field: _summary_table.c[field] + bindparam('d_' + field) for field in SUMMARY_FIELDS}
+)
+# Usuwa dni, w których nie został żaden wpis ani okno aktywności - okna odejmuje
+# dopiero zadanie wake_windows, więc do tego czasu wiersz zostaje
+_summary_delete_empty = _summary_table.delete().where(
+    _summary_table.c.day == bindparam('b_day'),
+    _summary_table.c.nap_count == 0,
+    _summary_table.c.night_count == 0,
+    _summary_table.c.wake_window_count == 0
+)
+
+def apply_summary_deltas(connection, deltas, chunk_size=500):
+    """Add per-day deltas to daily_sleep_summary and the rolling windows in the current transaction"""
+    rows = {
+        day: {field: delta.get(field, 0) for field in SUMMARY_FIELDS}
+        for day, delta in deltas.items() if any(delta.values())
+    }
+    if not rows:
+        return
+    _write_summary_deltas(connection, rows, chunk_size)
+    # Po zapisie podsumowań - transakcja ma już blokadę zapisu, więc stan okien czytamy aktualny
+    update_rolling_stats(connection, rows)
+
+_SUMMARY_UPSERT_SQL = (
+    f"INSERT INTO daily_sleep_summary (day, {', '.join(SUMMARY_FIELDS)}) "
+    f"VALUES ({', '.join('?' * (len(SUMMARY_FIELDS) + 1))}) ON CONFLICT(day) DO UPDATE SET "
+    + ', '.join(f"{field} = {field} + excluded.{field}" for field in SUMMARY_FIELDS)
+)
+_SUMMARY_DELETE_EMPTY_SQL = (
+    "DELETE FROM daily_sleep_summary "
+    "WHERE day = ? AND nap_count = 0 AND night_count = 0 AND wake_window_count = 0"
+)
+
+def _write_summary_deltas(connection, rows, chunk_size):
+    days = list(rows)
+    if connection.dialect.name == 'sqlite':
+        # INSERT ... ON CONFLICT DO UPDATE - równoległe zapisy nie tworzą dwa razy tego samego dnia.
+        # Gotowy SQL przez sterownik, bo przy imporcie dni są tysiące, a kompilacja parametrów
+        # w SQLAlchemy kosztowała tu więcej niż samo zapytanie
+        connection.exec_driver_sql(_SUMMARY_UPSERT_SQL, [
+            (day.isoformat(),) + tuple(rows[day][field] for field in SUMMARY_FIELDS) for day in days
+        ])
+        connection.exec_driver_sql(_SUMMARY_DELETE_EMPTY_SQL, [(day.isoformat(),) for day in days])
+        return
+
+    existing = set()
+    for i in range(0, len(days), chunk_size):
+        existing.update(connection.execute(
+            select(_summary_table.c.day).where(_summary_table.c.day.in_(days[i:i + chunk_size]))
+        ).scalars())
+
+    # Wszystkie dni naraz przez executemany, zamiast osobnych zapytań dla każdego dnia
+    updates = [
+        dict({'d_' + field: value for field, value in rows[day].items()}, b_day=day)
+        for day in days if day in existing
+    ]
+    inserts = [dict(rows[day], day=day) for day in days if day not in existing]
+    if updates:
+        connection.execute(_summary_update, updates)
+        connection.execute(_summary_delete_empty, [{'b_day': row['b_day']} for row in updates])
+    if inserts:
+        connection.execute(_summary_table.insert(), inserts)
+
+_rolling_table = RollingSleepStats.__table__
+_rolling_replace = _rolling_table.insert().prefix_with('OR REPLACE')
+
+def _summary_totals(connection, first, last):
+    """Sums of daily_sleep_summary fields over days first..last"""
+    totals = connection.execute(
+        select(*[func.coalesce(func.sum(_summary_table.c[field]), 0) for field in SUMMARY_FIELDS])
+        .where(_summary_table.c.day >= first, _summary_table.c.day <= last)
+    ).one()
+    return dict(zip(SUMMARY_FIELDS, totals))
+
+def _slide_window(connection, state, days, today, deltas):
+    """Totals of the window of `days` days ending today.
+
+    Starts from the stored state (window ending state.end_day) and only
+    reads the summaries of days that left or entered the window. deltas
+    are changes already written to daily_sleep_summary but not to state.
+    """
+    first = today - timedelta(days=days - 1)
+    if state is None or not 0 <= (today - state.end_day).days < days:
+        return _summary_totals(connection, first, today)
+    end = state.end_day
+    totals = {field: getattr(state, field) for field in SUMMARY_FIELDS}
+    if end < today:
+        leaving = _summary_totals(connection, end - timedelta(days=days - 1), first - timedelta(days=1))
+        entering = _summary_totals(connection, end + timedelta(days=1), today)
+        for field in SUMMARY_FIELDS:
+            totals[field] += entering[field] - leaving[field]
+    for day, delta in deltas.items():
+        # Dni wychodzące z okna odjęliśmy już ze zmianą, a stan ma je jeszcze sprzed zmiany
+        if end - timedelta(days=days - 1) <= day <= end:
+            for field in SUMMARY_FIELDS:
+                totals[field] += delta[field]
+    return totals
+
+def update_rolling_stats(connection, deltas, today=None):
+    """Bring the stored rolling windows to today and add the deltas of days inside them"""
+    today = today or get_current_local_time().date()
+    states = {row.window_days: row for row in connection.execute(select(_rolling_table))}
+    connection.execute(_rolling_replace, [
+        dict(_slide_window(connection, states.get(days), days, today, deltas), window_days=days, end_day=today)
+        for days in analytics.WINDOWS
+    ])
+
+def _tracked_days(days, today):
+    """Days of the window since the first record (0 without records)"""
+    first_day = db.session.query(func.min(DailySleepSummary.day)).scalar()
+    if first_day is None:
+        return 0
+    return max(0, min(days, (today - first_day).days + 1))
+
+def rolling_sleep_stats(today):
+    """Rolling averages for every window ending today, read from the incremental state"""
+    connection = db.session.connection()
+    states = {row.window_days: row for row in connection.execute(select(_rolling_table))}
+    return [
+        analytics.averages(_slide_window(connection, states.get(days), days, today, {}), days, _tracked_days(days, today))
+        for days in analytics.WINDOWS
+    ]
+
+def recompute_rolling_stats(today):
+    """Rolling averages computed from sleep_records alone, to verify the incremental state"""
+    first = today - timedelta(days=max(analytics.WINDOWS) - 1)
+    start = db.session.query(func.min(SleepRecord.sleep_time)).filter(
+        SleepRecord.day >= first, SleepRecord.day <= today
+    ).scalar()
+    per_day = defaultdict(Counter)
+    if start is not None:
+        previous_wake = db.session.execute(
+            select(_epoch_wake_time).where(SleepRecord.sleep_time < start)
+            .order_by(SleepRecord.sleep_time.desc(), SleepRecord.id.desc()).limit(1)
+        ).scalar()
+        rows = db.session.execute(
+            db.select(_epoch_sleep_time, _epoch_wake_time, SleepRecord.day,
+                      SleepRecord.is_nap, SleepRecord.duration_seconds, SleepRecord.sleep_rating)
+            .where(SleepRecord.sleep_time >= start)
+            .order_by(SleepRecord.sleep_time, SleepRecord.id)
+        ).all()
+        per_day = analytics.wake_windows([row[:3] for row in rows], previous_wake)
+        for row in rows:
+            per_day[row.day].update(summary_contribution(row.is_nap, row.duration_seconds, row.sleep_rating))
+
+    windows = []
+    for days in analytics.WINDOWS:
+        totals = dict.fromkeys(SUMMARY_FIELDS, 0)
+        for offset in range(days):
+            for field, value in per_day.get(today - timedelta(days=offset), {}).items():
+                totals[field] += value
+        windows.append(analytics.averages(totals, days, _tracked_days(days, today)))
+    return windows
+
+@event.listens_for(db.session, 'before_flush')
+def _update_daily_summary(session, flush_context, instances):
+    deltas = defaultdict(Counter)
+
+    def add(day, contribution, sign):
+        deltas[day]  # dzień zmieniony także wtedy, gdy zmieniły się tylko notatki
+        for field, value in contribution.items():
+            deltas[day][field] += sign * value
+
+    for record in session.new:
+        if isinstance(record, SleepRecord):
+            record.update_derived_fields()
+            add(record.day, summary_contribution(record.is_nap, record.duration_seconds, record.sleep_rating), 1)
+
+    for record in session.dirty:
+        if isinstance(record, SleepRecord) and session.is_modified(record):
+            # Zapamiętaj stary wkład przed przeliczeniem pól (np. przeniesienie wpisu na inny dzień)
+            old = [_committed_value(record, key) for key in SUMMARY_INPUTS]
+            old_duration, old_is_nap, old_day = classify_sleep(old[0], old[1])
+            add(old_day, summary_contribution(old_is_nap, old_duration, old[2]), -1)
+            record.update_derived_fields()
+            add(record.day, summary_contribution(record.is_nap, record.duration_seconds, record.sleep_rating), 1)
+
+    for record in session.deleted:
+        if isinstance(record, SleepRecord):
+            old = [_committed_value(record, key) for key in SUMMARY_INPUTS]
+            old_duration, old_is_nap, old_day = classify_sleep(old[0], old[1])
+            add(old_day, summary_contribution(old_is_nap, old_duration, old[2]), -1)
+
+    # Zapisywane po flushu razem ze zmianami okien aktywności (_update_wake_windows)
+    session.info['summary_deltas'] = deltas
+    if deltas:
+        mark_days_changed(session, deltas)
+
+def mark_days_changed(session, days):
+    """Remember days whose cached pages must be dropped once the session commits"""
+    session.info.setdefault('changed_days', set()).update(days)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_days(session):
+    days = session.info.pop('changed_days', None)
+    if days:
+        invalidate_days(days)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_days(session):
+    session.info.pop('changed_days', None)
+    session.info.pop('summary_deltas', None)
+    session.info.pop('nap_model_stale', None)
+    session.info.pop('nap_windows', None)
+    session.info.pop('jobs_queued', None)
+
+class ActiveNap(db.Model):
+    """Nap that has been started but not stopped yet, shared by all devices"""
+    __tablename__ = 'active_naps'
+
+    id = db.Column(db.Integer, primary_key=True)
+    start_time = db.Column(LocalTime, nullable=False)  # Jak czasy w sleep_records
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SyncKey(db.Model):
+    """Idempotency key of a client event applied by /api/sync"""
+    __tablename__ = 'sync_keys'
+
+    key = db.Column(db.String(sync.MAX_KEY_LENGTH), primary_key=True)
+    result = db.Column(db.Text, nullable=False)  # JSON zwracany przy ponownym wysłaniu zdarzenia
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RecordChange(db.Model):
+    """Latest change of each sleep record; ids are the /api/sync cursor"""
+    __tablename__ = 'record_changes'
+    __table_args__ = {'sqlite_autoincrement': True}  # Kursor nie może się cofnąć
+
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(db.Integer, nullable=False, unique=True)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+# OR REPLACE usuwa poprzednią zmianę wpisu i nadaje nowy, większy id
+_record_change_insert = RecordChange.__table__.insert().prefix_with('OR REPLACE')
+
+class AppSetting(db.Model):
+    """Setting of a family's database, e.g. its time zone"""
+    __tablename__ = 'app_settings'
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+
+def read_time_zone(engine):
+    """Time zone name stored in a database, TIME_ZONE when it has none"""
+    try:
+        with engine.connect() as connection:
+            name = connection.execute(select(AppSetting.value).where(AppSetting.key == 'time_zone')).scalar()
+    except DatabaseError:
+        # Baza sprzed migracji do czasów UTC - dotąd zawsze strefa domyślna
+        name = None
+    return name or _current_app().config['TIME_ZONE']
+
+class DerivedJob(db.Model):
+    """Recomputation queued in the transaction of a write, run later by job_queue"""
+    __tablename__ = 'derived_jobs'
+    # Jedno zadanie danego rodzaju na klucz (np. dzień) - kolejne zapisy tylko je rozszerzają
+    __table_args__ = (db.UniqueConstraint('kind', 'key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.Float, nullable=False)  # Czas uniksowy, od kiedy można uruchomić (ponowienia)
+    enqueued_at = db.Column(db.Float, nullable=False)
+    last_error = db.Column(db.Text)
+
+_jobs_table = DerivedJob.__table__
+
+def _merge_time_range(old, new):
+    return {
+        'low': min(old['low'], new['low'], key=datetime.fromisoformat),
+        'high': max(old['high'], new['high'], key=datetime.fromisoformat),
+    }
+
+# Jak połączyć ładunek czekającego zadania z nowym zapisem tego samego rodzaju i klucza
+JOB_MERGERS = {
+    'wake_windows': _merge_time_range,
+    'nap_model': lambda old, new: {},
+}
+
+def queue_job(session, kind, key, payload):
+    """Queue a job in the session's transaction, merging it into a waiting job with the same kind and key"""
+    connection = session.connection()
+    existing = connection.execute(
+        select(_jobs_table.c.payload).where(_jobs_table.c.kind == kind, _jobs_table.c.key == key)
+    ).scalar()
+    if existing is not None:
+        payload = JOB_MERGERS[kind](json.loads(existing), payload)
+    now = time.time()
+    upsert = sqlite_insert(_jobs_table).values(
+        kind=kind, key=key, payload=json.dumps(payload), attempts=0, run_after=now, enqueued_at=now
+    )
+    # Zadanie czekające na ponowienie po błędzie dostaje nowe dane i uruchamia się od razu
+    connection.execute(upsert.on_conflict_do_update(
+        index_elements=[_jobs_table.c.kind, _jobs_table.c.key],
+        set_={'payload': upsert.excluded.payload, 'attempts': 0, 'run_after': upsert.excluded.run_after}
+    ))
+    session.info['jobs_queued'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _start_queued_jobs(session):
+    if session.info.pop('jobs_queued', False):
+        job_queue.submit(current_tenant())
+
+_records_table = SleepRecord.__table__
+# Surowe sekundy UTC - okna aktywności liczymy bez przeliczania na czas lokalny i z powrotem
+_epoch_sleep_time = type_coerce(_records_table.c.sleep_time, db.Integer).label('sleep_time')
+_epoch_wake_time = type_coerce(_records_table.c.wake_time, db.Integer).label('wake_time')
+
+def window_rows(connection, low, high):
+    """Records around sleep times low..high as (previous, rows, following).
+
+    rows sleep in low..high, previous and following are the nearest
+    records before and after them (or None); archived records count too.
+    All are (sleep_time, wake_time, day, id) with times as UTC epoch
+    seconds, rows sorted by sleep time.
+    """
+    columns = (_epoch_sleep_time, _epoch_wake_time, _records_table.c.day, _records_table.c.id)
+    order = (_records_table.c.sleep_time, _records_table.c.id)
+    previous = connection.execute(
+        select(*columns).where(_records_table.c.sleep_time < low)
+        .order_by(_records_table.c.sleep_time.desc(), _records_table.c.id.desc()).limit(1)
+    ).first()
+    rows = [tuple(row) for row in connection.execute(
+        select(*columns).where(_records_table.c.sleep_time >= low, _records_table.c.sleep_time <= high).order_by(*order)
+    )]
+    following = connection.execute(select(*columns).where(_records_table.c.sleep_time > high).order_by(*order).limit(1)).first()
+    neighbours = [tuple(row) for row in (previous, following) if row is not None]
+
+    zone = current_time_zone()
+    low, high = timezones.to_epoch(low, zone), timezones.to_epoch(high, zone)
+    if os.path.isdir(archive_dir()):
+        # Sąsiedzi mogą być już w archiwum (np. wpis dopisany do zarchiwizowanego okresu)
+        import archive
+        archived_previous, archived_rows, archived_following = archive.window_rows(archive_dir(), low, high)
+        neighbours += [row for row in (archived_previous, archived_following) if row is not None]
+        rows = sorted(rows + archived_rows, key=_window_key)
+
+    previous = max((row for row in neighbours if row[0] < low), key=_window_key, default=None)
+    following = min((row for row in neighbours if row[0] > high), key=_window_key, default=None)
+    return previous, rows, following
+
+def _window_key(row):
+    return row[0], row[3]
+
+def wake_window_deltas(connection, low, high, replaced_ids=(), old_rows=(), window=None):
+    """Per-day change of wake windows after records with sleep times in low..high changed.
+
+    Only windows owned by those records and by the first record after them
+    can change. The database already holds the new state; the old one is
+    rebuilt from it by dropping replaced_ids and adding old_rows, the
+    window_rows tuples of changed records from before.
+    window is the result of window_rows if the caller already has it.
+    """
+    previous, rows, following = window or window_rows(connection, low, high)
+
+    def windows(rows):
+        rows = sorted(rows, key=_window_key) + ([following] if following else [])
+        return analytics.wake_windows((row[:3] for row in rows), previous and previous[1])
+
+    after = windows(rows)
+    before = windows([row for row in rows if row[3] not in replaced_ids] + list(old_rows))
+    deltas = defaultdict(Counter)
+    for day in before.keys() | after.keys():
+        for field in ('wake_window_count', 'wake_window_seconds'):
+            deltas[day][field] = after.get(day, {}).get(field, 0) - before.get(day, {}).get(field, 0)
+    return deltas
+
+@event.listens_for(db.session, 'after_flush')
+def _update_wake_windows(session, flush_context):
+    """Write the flush's summary deltas and queue recomputing wake windows around moved records"""
+    deltas = session.info.pop('summary_deltas', None)
+    if deltas:
+        apply_summary_deltas(session.connection(), deltas)
+
+    # Po flushu historia atrybutów wciąż zawiera wartości sprzed zmiany
+    times, days = [], set()
+    new_records = [record for record in session.new if isinstance(record, SleepRecord)]
+    for record in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(record, SleepRecord):
+            continue
+        state = inspect(record)
+        if record in session.dirty and not any(state.attrs[key].history.has_changes() for key in ('sleep_time', 'wake_time')):
+            continue
+        if record not in session.new:
+            sleep_time, wake_time = _committed_value(record, 'sleep_time'), _committed_value(record, 'wake_time')
+            days.add(classify_sleep(sleep_time, wake_time)[2])
+            times.append(sleep_time)
+        if record not in session.deleted:
+            days.add(record.day)
+            times.append(record.sleep_time)
+    if times:
+        # Okna aktywności i model drzemek przelicza kolejka zadań po zatwierdzeniu zapisu
+        payload = {'low': min(times).isoformat(), 'high': max(times).isoformat()}
+        for day in days:
+            queue_job(session, 'wake_windows', day.isoformat(), payload)
+        window = window_rows(session.connection(), times[0], times[0]) if len(times) == 1 and new_records else None
+        if window is not None and len(window[1]) == 1 and window[2] is None:
+            # Dopisany najnowszy wpis - model drzemek dostaje tylko jedno nowe okno, bez uczenia od nowa
+            previous = window[0]
+            if previous is not None and new_records[0].is_nap:
+                wake_time = timezones.from_epoch(previous[1], current_time_zone())
+                session.info.setdefault('nap_windows', []).append((wake_time, new_records[0].sleep_time))
+        else:
+            # Zmiana lub usunięcie starszego wpisu przesuwa okna w środku historii - model uczy się od nowa
+            queue_job(session, 'nap_model', 'next_nap', {})
+            session.info['nap_model_stale'] = True
+
+@event.listens_for(db.session, 'after_flush')
+def _log_record_changes(session, flush_context):
+    """Number every inserted, updated or deleted sleep record for /api/sync"""
+    changes = [
+        {'record_id': record.id, 'deleted': False}
+        for record in list(session.new) + list(session.dirty)
+        if isinstance(record, SleepRecord) and (record in session.new or session.is_modified(record))
+    ]
+    changes += [{'record_id': record.id, 'deleted': True} for record in session.deleted if isinstance(record, SleepRecord)]
+    if changes:
+        session.connection().execute(_record_change_insert, changes)
+
+def _expected_summary_query():
+    """Aggregate daily_sleep_summary rows straight from sleep_records, wake windows as zeros"""
+    night_rated = (~SleepRecord.is_nap) & SleepRecord.sleep_rating.isnot(None)
+    return db.session.query(
+        SleepRecord.day,
+        func.sum(case((SleepRecord.is_nap, 1), else_=0)),
+        func.sum(case((SleepRecord.is_nap, SleepRecord.duration_seconds), else_=0)),
+        func.sum(case((SleepRecord.is_nap, 0), else_=1)),
+        func.sum(case((SleepRecord.is_nap, 0), else_=SleepRecord.duration_seconds)),
+        func.sum(case((night_rated, 1), else_=0)),
+        func.sum(case((night_rated, SleepRecord.sleep_rating), else_=0)),
+        literal(0),
+        literal(0),
+    ).group_by(SleepRecord.day)
+
+def expected_wake_windows():
+    """Wake windows per day computed from all live and archived records"""
+    rows = db.session.execute(db.select(_epoch_sleep_time, _epoch_wake_time, SleepRecord.day, SleepRecord.id)).all()
+    rows += [row for month in archived_months() for row in month.window_rows()]
+    rows.sort(key=lambda row: (row[0], row[3]))
+    return analytics.wake_windows(row[:3] for row in rows)
+
+def rebuild_daily_summary():
+    """Recreate daily_sleep_summary from sleep_records and the archive, returns the number of days"""
+    table = DailySleepSummary.__table__
+    deltas = archived_summary()
+    for day, windows in expected_wake_windows().items():
+        deltas[day].update(windows)
+    db.session.execute(table.delete())
+    # Okna kroczące liczone są od nowa z odbudowanych podsumowań
+    db.session.execute(_rolling_table.delete())
+    db.session.execute(table.insert().from_select(('day',) + SUMMARY_FIELDS, _expected_summary_query()))
+    apply_summary_deltas(db.session.connection(), deltas)
+    db.session.commit()
+    return DailySleepSummary.query.count()
+
+def verify_daily_summary():
+    """Return days whose stored summary differs from sleep_records and the archive"""
+    expected = {row[0]: tuple(row[1:]) for row in _expected_summary_query()}
+    deltas = archived_summary()
+    for day, windows in expected_wake_windows().items():
+        deltas[day].update(windows)
+    for day, delta in deltas.items():
+        live = expected.get(day, (0,) * len(SUMMARY_FIELDS))
+        expected[day] = tuple(value + delta[field] for value, field in zip(live, SUMMARY_FIELDS))
+    stored = {
+        row.day: tuple(getattr(row, field) for field in SUMMARY_FIELDS)
+        for row in DailySleepSummary.query
+    }
+    return sorted(day for day in expected.keys() | stored.keys() if expected.get(day) != stored.get(day))
+
+_settings_upsert = sqlite_insert(AppSetting.__table__)
+_settings_upsert = _settings_upsert.on_conflict_do_update(
+    index_elements=['key'], set_={'value': _settings_upsert.excluded.value}
+)
+
+def set_time_zone(name, batch_size=5000):
+    """Store the family's time zone and move its records to their local days in it.
+
+    Stored instants do not change, only the attribution days and with them
+    the daily summaries; archived months keep their days. Returns the
+    number of records moved to another day.
+    """
+    # Pliki archiwum w starym formacie trzymają czas lokalny - trzeba je przeliczyć jeszcze w starej strefie
+    upgrade_archive(current_tenant(), current_time_zone())
+    zone = timezones.get_zone(name)
+    table = SleepRecord.__table__
+    # Surowe sekundy UTC - bez przeliczania na starą strefę
+    rows = db.session.execute(select(
+        table.c.id, type_coerce(table.c.sleep_time, db.Integer), type_coerce(table.c.wake_time, db.Integer),
+        table.c.is_nap, table.c.day
+    )).all()
+    moved = []
+    for record_id, sleep_time, wake_time, is_nap, day in rows:
+        local_day = timezones.local_day(sleep_time if is_nap else wake_time, zone)
+        if local_day != day:
+            moved.append({'b_id': record_id, 'day': local_day})
+    move = table.update().where(table.c.id == bindparam('b_id')).values(day=bindparam('day'))
+    for start in range(0, len(moved), batch_size):
+        batch = moved[start:start + batch_size]
+        db.session.execute(move, batch)
+        # Klienci /api/sync pobiorą wpisy z nowym dniem
+        db.session.execute(_record_change_insert, [{'record_id': row['b_id'], 'deleted': False} for row in batch])
+    db.session.execute(_settings_upsert, {'key': 'time_zone', 'value': name})
+    db.session.commit()
+    _time_zones[current_tenant()] = name
+    rebuild_daily_summary()
+    return len(moved)
+
+class OverlapError(ValueError):
+    """Record overlaps existing records and the overlap policy is 'reject'"""
+
+    def __init__(self, overlapping):
+        self.overlapping = overlapping
+        times = ', '.join(
+            f"{other.sleep_time.strftime('%d.%m %H:%M')}-{other.wake_time.strftime('%H:%M')}" for other in overlapping
+        )
+        super().__init__(f"Wpis nakłada się na istniejący wpis ({times}).")
+
+def find_overlaps(sleep_time, wake_time, exclude_ids=()):
+    """Records overlapping [sleep_time, wake_time), found with index range scans only.
+
+    A record overlapping the interval starts before wake_time and, as no
+    record is longer than the longest one, after sleep_time minus that
+    duration - so only that window of the sleep_time index is read.
+    """
+    longest = db.session.query(func.max(SleepRecord.duration_seconds)).scalar()
+    if longest is None:
+        return []
+    query = SleepRecord.query.filter(
+        SleepRecord.sleep_time < wake_time,
+        # duration_seconds jest zaokrąglone w dół; przesunięcie w czasie rzeczywistym, nie na zegarze
+        SleepRecord.sleep_time >= timezones.shift(sleep_time, -(longest + 1), current_time_zone()),
+        SleepRecord.wake_time > sleep_time
+    )
+    exclude_ids = [record_id for record_id in exclude_ids if record_id is not None]
+    if exclude_ids:
+        query = query.filter(SleepRecord.id.notin_(exclude_ids))
+    return query.order_by(SleepRecord.sleep_time).all()
+
+def resolve_overlaps(record, policy=None):
+    """Apply the overlap policy to a new or edited record before it is committed.
+
+    Returns the record to keep: `record` itself, or with the 'merge'
+    policy the existing record it was merged into. Raises OverlapError
+    with the 'reject' policy and ArchivedRangeError for archived days.
+    """
+    policy = policy or current_app.config['OVERLAP_POLICY']
+    # Archiwum nie bierze udziału w wyszukiwaniu nakładających się wpisów - ten okres jest tylko do odczytu
+    check_not_archived(record.sleep_time, record.wake_time, archived_range())
+    # Bez autoflush - edytowany wpis nie może znaleźć samego siebie z nowymi czasami
+    with db.session.no_autoflush:
+        overlapping = find_overlaps(record.sleep_time, record.wake_time, [record.id])
+        if not overlapping:
+            return record
+        if policy == 'reject':
+            raise OverlapError(overlapping)
+        if policy == 'flag':
+            current_app.logger.warning(
+                f"Record {record.sleep_time}-{record.wake_time} overlaps records {[other.id for other in overlapping]}"
+            )
+            return record
+
+        # merge: jeden wpis obejmujący wszystkie nakładające się, także pośrednio
+        members = [record] + overlapping
+        while True:
+            sleep_time = min(member.sleep_time for member in members)
+            wake_time = max(member.wake_time for member in members)
+            more = find_overlaps(sleep_time, wake_time, [member.id for member in members])
+            if not more:
+                break
+            members += more
+        target = record if record.id is not None else overlapping[0]
+        target.sleep_time, target.wake_time = sleep_time, wake_time
+        if not target.notes:
+            target.notes = next((member.notes for member in members if member.notes), '')
+        if target.sleep_rating is None:
+            rated = next((member for member in members if member.sleep_rating is not None), None)
+            if rated is not None:
+                target.sleep_rating, target.is_rated = rated.sleep_rating, True
+        for member in members:
+            if member is not target and member.id is not None:
+                db.session.delete(member)
+        return target
+
+def find_all_overlaps(batch_size=1000):
+    """Yield (earlier, later) record pairs that overlap, in one pass ordered by sleep_time.
+
+    Each record is paired with the record reaching furthest among those
+    before it, so every record overlapping an earlier one is reported once.
+    """
+    columns = SleepRecord.__table__.c
+    rows = db.session.execute(
+        select(columns.id, columns.sleep_time, columns.wake_time)
+        .order_by(columns.sleep_time, columns.id)
+        .execution_options(yield_per=batch_size)
+    )
+    furthest = None
+    for row in rows:
+        if furthest is not None and row.sleep_time < furthest.wake_time:
+            yield furthest, row
+        if furthest is None or row.wake_time > furthest.wake_time:
+            furthest = row
+
+def mark_overlapping(records):
+    """Set 'overlaps' on plain record dicts of one day that overlap each other"""
+    furthest = None
+    for record in sorted(records, key=lambda record: record['sleep_time']):
+        record['overlaps'] = False
+        if furthest is not None and record['sleep_time'] < furthest['wake_time']:
+            record['overlaps'] = furthest['overlaps'] = True
+        if furthest is None or record['wake_time'] > furthest['wake_time']:
+            furthest = record
+    return records
+
+def records_for_day(day):
+    """Return records attributed to the given day, newest first, with nap numbers filled in"""
+    # Numerujemy drzemki jednym zapytaniem z funkcją okna zamiast liczyć je przy każdym zapisie
+    nap_number = func.row_number().over(
+        partition_by=SleepRecord.is_nap,
+        order_by=SleepRecord.sleep_time
+    )
+    rows = db.session.query(SleepRecord, nap_number).filter(
+        SleepRecord.day == day
+    ).order_by(SleepRecord.sleep_time.desc()).all()
+    
+    records = []
+    for record, number in rows:
+        record.nap_number = number if record.is_nap else None
+        records.append(record)
+    return records
+
+def search_records(phrase, page=1):
+    """Records whose notes match a phrase on a results page, as (record, snippet) pairs, and whether more pages follow"""
+    terms = search.query_terms(phrase)
+    query = search.match_query(terms)
+    if query is None:
+        return [], False
+    per_page = current_app.config['SEARCH_PAGE_SIZE']
+    offset = (page - 1) * per_page
+    # Najnowsze trafienia według trafności (bm25), starsze za nimi od najnowszych
+    newest = db.session.execute(text(search.NEWEST_STATEMENT), {'query': query, 'limit': search.RANK_WINDOW}).all()
+    ids = [record_id for record_id, rank in sorted(newest, key=lambda row: row.rank)][offset:offset + per_page + 1]
+    if len(newest) == search.RANK_WINDOW and len(ids) <= per_page:
+        ids += db.session.execute(text(search.OLDER_STATEMENT), {
+            'query': query,
+            'before': newest[-1].rowid,
+            'limit': per_page + 1 - len(ids),
+            'offset': max(0, offset - search.RANK_WINDOW),
+        }).scalars().all()
+    has_more = len(ids) > per_page
+    ids = ids[:per_page]
+    records = {record.id: record for record in db.session.scalars(select(SleepRecord).where(SleepRecord.id.in_(ids)))}
+    # Wpis usunięty między zapytaniami po prostu pomijamy
+    results = [(records[record_id], search.snippet(records[record_id].notes, terms)) for record_id in ids if record_id in records]
+    return results, has_more
+
+def rebuild_search_index():
+    """Create the notes search index if missing and refill it from sleep_records; returns the number of indexed records"""
+    connection = db.session.connection()
+    for statement in search.CREATE_STATEMENTS + search.REBUILD_STATEMENTS:
+        connection.exec_driver_sql(statement)
+    indexed = connection.exec_driver_sql(search.COUNT_STATEMENT).scalar()
+    db.session.commit()
+    return indexed
+
+def verify_search_index():
+    """Check that the notes search index matches sleep_records"""
+    try:
+        db.session.connection().exec_driver_sql(search.INTEGRITY_STATEMENT)
+        return True
+    except DatabaseError:
+        return False
+    finally:
+        db.session.rollback()
+
+@bp.before_app_request
+def resolve_tenant():
+    """Pick the tenant from the X-Tenant-ID header, ?tenant= or the tenant cookie"""
+    if not current_app.config['TENANT_MODE'] or request.endpoint in ('static', 'main.metrics'):
+        return None
+    tenant_id = request.headers.get('X-Tenant-ID') or request.args.get('tenant') or request.cookies.get('tenant')
+    if not is_valid_tenant_id(tenant_id):
+        return render_template('error.html', message="Nie wybrano rodziny."), 400
+    if not tenant_exists(tenant_id):
+        return render_template('error.html', message="Nie ma takiej rodziny."), 404
+    g.tenant_id = tenant_id
+
+@bp.before_app_request
+def resume_tenant_jobs():
+    if request.endpoint not in ('static', 'main.metrics'):
+        resume_jobs(current_tenant())
+
+@bp.after_app_request
+def remember_tenant(response):
+    """Keep the tenant chosen with ?tenant= in a cookie for the following pages"""
+    if current_tenant() and request.args.get('tenant') == g.tenant_id:
+        response.set_cookie('tenant', g.tenant_id, samesite='Lax')
+    return response
+
+def parse_date_param(value):
+    """Parse an optional YYYY-MM-DD query parameter"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def export_rows(start=None, end=None, batch_size=1000):
+    """Yield archived and live records as mappings ordered by day, fetched in batches"""
+    query = db.select(*SleepRecord.__table__.columns).order_by(SleepRecord.day, SleepRecord.sleep_time)
+    if start:
+        query = query.where(SleepRecord.day >= start)
+    if end:
+        query = query.where(SleepRecord.day <= end)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    zone = current_time_zone()
+    archived = (row for month in archived_months(start, end) for row in month.rows(zone, start, end))
+    # Wpisy dodane do już zarchiwizowanego miesiąca czekają w tabeli do kolejnej archiwizacji
+    yield from heapq.merge(archived, result.mappings(), key=lambda row: (row['day'], row['sleep_time']))
+
+def tenant_archive_dir(tenant_id):
+    """Directory with the archive files of a tenant (None: of the single database)"""
+    if tenant_id is None:
+        return _current_app().config['ARCHIVE_DIR']
+    return os.path.join(_current_app().config['ARCHIVE_DIR'], 'tenants', tenant_id)
+
+def archive_dir():
+    """Directory with the archive files of the current tenant (or of the single database)"""
+    return tenant_archive_dir(current_tenant())
+
+def upgrade_archive(tenant_id, zone, log=None):
+    """Convert a tenant's archive files of the old format (local times) to UTC epoch seconds"""
+    directory = tenant_archive_dir(tenant_id)
+    if not os.path.isdir(directory):
+        return
+    import archive
+    months = archive.upgrade_directory(directory, zone)
+    if months:
+        (log or _current_app().logger.info)(f"Archive months converted to UTC times: {', '.join(months)}")
+
+def archived_months(start=None, end=None):
+    """Memory-mapped archive files of the months covering days start..end, oldest first"""
+    directory = archive_dir()
+    if not os.path.isdir(directory):
+        return []
+    # numpy tylko wtedy, gdy archiwum istnieje (patrz api_stats)
+    import archive
+    low = start and archive.month_of(start)
+    high = end and archive.month_of(end)
+    return [
+        archive.MonthArchive(archive.month_path(directory, month))
+        for month in archive.list_months(directory)
+        if (not low or month >= low) and (not high or month <= high)
+    ]
+
+def archived_range():
+    """(last archived day, latest archived wake time), or None when nothing is archived.
+
+    Whole months are archived oldest first, so every day up to the newest
+    archived month is read-only: find_overlaps and records_for_day only see
+    sleep_records.
+    """
+    directory = archive_dir()
+    if not os.path.isdir(directory):
+        return None
+    import archive
+    months = archive.list_months(directory)
+    if not months:
+        return None
+    newest = archive.MonthArchive(archive.month_path(directory, months[-1]))
+    return archive.month_days(months[-1])[1], newest.latest_wake(current_time_zone())
+
+class ArchivedRangeError(ValueError):
+    """Record falls in the archived range, which cannot be written to"""
+
+    def __init__(self, last_day):
+        self.last_day = last_day
+        super().__init__(
+            f"Dni do {last_day.strftime('%d.%m.%Y')} są w archiwum - nie można dodawać ani zmieniać wpisów z tego okresu."
+        )
+
+def archived_day_message(last_day):
+    return f"Dni do {last_day.strftime('%d.%m.%Y')} są w archiwum - ich wpisy są dostępne tylko w eksporcie."
+
+def check_not_archived(sleep_time, wake_time, archived):
+    """Raise ArchivedRangeError if a record would fall on a day of the archived_range() or overlap its records"""
+    if archived is None:
+        return
+    last_day, latest_wake = archived
+    if sleep_time < latest_wake or classify_sleep(sleep_time, wake_time)[2] <= last_day:
+        raise ArchivedRangeError(last_day)
+
+def archived_summary():
+    """Per-day summary contributions of archived records"""
+    deltas = defaultdict(Counter)
+    zone = current_time_zone()
+    for month in archived_months():
+        for row in month.rows(zone):
+            for field, value in summary_contribution(row['is_nap'], row['duration_seconds'], row['sleep_rating']).items():
+                deltas[row['day']][field] += value
+    return deltas
+
+# Archiwum trzyma czasy tak jak tabela - surowe sekundy UTC
+_archive_columns = [
+    {'sleep_time': _epoch_sleep_time, 'wake_time': _epoch_wake_time}.get(column.name, column)
+    for column in _records_table.columns
+]
+
+def archive_records(before, chunk_size=500):
+    """Move records of whole months before `before` from sleep_records to archive files.
+
+    Daily summaries stay in SQLite. Each month's file is written before its
+    rows are deleted in a separate transaction, so an interrupted run only
+    needs to be repeated. Returns {month: number of archived records}.
+    """
+    import archive
+    directory = archive_dir()
+    before = before.replace(day=1)
+    month_start = db.session.query(func.min(SleepRecord.day)).filter(SleepRecord.day < before).scalar()
+    archived = {}
+    while month_start is not None and month_start < before:
+        month_start = month_start.replace(day=1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        rows = db.session.execute(
+            db.select(*_archive_columns)
+            .where(SleepRecord.day >= month_start, SleepRecord.day < month_end)
+            .order_by(SleepRecord.day, SleepRecord.sleep_time)
+        ).mappings().all()
+        if rows:
+            month = archive.month_of(month_start)
+            path = archive.month_path(directory, month)
+            columns = archive.columns_from_rows(rows)
+            if os.path.exists(path):
+                # Wpisy dodane po poprzedniej archiwizacji tego miesiąca
+                columns = archive.merge(archive.MonthArchive(path).columns(), columns)
+            archive.write_month(path, columns)
+
+            ids = [row['id'] for row in rows]
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                db.session.execute(SleepRecord.__table__.delete().where(SleepRecord.id.in_(chunk)))
+                db.session.execute(RecordChange.__table__.delete().where(RecordChange.record_id.in_(chunk)))
+            mark_days_changed(db.session, {row['day'] for row in rows})
+            db.session.commit()
+            archived[month] = len(rows)
+        month_start = month_end
+    return archived
+
+# Wstawianie z pominięciem przetwarzania typów przez SQLAlchemy - czasy podajemy
+# od razu jako sekundy UTC (jak LocalTime), created_at w formacie DateTime SQLAlchemy
+_BULK_INSERT_SQL = (
+    "INSERT INTO sleep_records (sleep_time, wake_time, notes, sleep_rating, is_rated, "
+    "created_at, duration_seconds, is_nap, day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+def _sqlite_datetime(value):
+    return value.isoformat(' ', 'microseconds')
+
+def bulk_insert_records(records, batch_size=10000):
+    """Insert (sleep_time, wake_time, notes, rating) tuples, one transaction per batch.
+
+    Records must already be validated. Returns the number of inserted rows.
+    """
+    inserted = 0
+    batch = []
+    sleep_times = []
+    deltas = defaultdict(Counter)
+
+    def flush_batch():
+        # executemany + delty podsumowań dziennych w jednej transakcji
+        connection = db.session.connection()
+        last_id = connection.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM sleep_records").scalar()
+        connection.exec_driver_sql(_BULK_INSERT_SQL, batch)
+        connection.exec_driver_sql(
+            "INSERT OR REPLACE INTO record_changes (record_id, deleted) SELECT id, 0 FROM sleep_records WHERE id > ?",
+            (last_id,)
+        )
+        # Okna aktywności wokół nowych wpisów: bez nich (przed) i z nimi (po)
+        new_ids = set(connection.exec_driver_sql("SELECT id FROM sleep_records WHERE id > ?", (last_id,)).scalars())
+        for day, windows in wake_window_deltas(connection, min(sleep_times), max(sleep_times), new_ids).items():
+            deltas[day].update(windows)
+        apply_summary_deltas(connection, deltas)
+        mark_days_changed(db.session, deltas)
+        db.session.info['nap_model_stale'] = True
+        db.session.commit()
+        batch.clear()
+        sleep_times.clear()
+        deltas.clear()
+
+    created_at = _sqlite_datetime(datetime.utcnow())
+    zone = current_time_zone()
+    for sleep_time, wake_time, notes, rating in records:
+        # Każdy czas przeliczamy na UTC raz - czas trwania to różnica tych samych sekund
+        sleep_seconds, wake_seconds = timezones.to_epoch(sleep_time, zone), timezones.to_epoch(wake_time, zone)
+        duration_seconds, is_nap, day = classify_duration(sleep_time, wake_time, wake_seconds - sleep_seconds)
+        batch.append((
+            sleep_seconds,
+            wake_seconds,
+            '' if is_standard_note(notes) else notes,
+            rating,
+            rating is not None,
+            created_at,
+            duration_seconds,
+            is_nap,
+            day.isoformat(),
+        ))
+        sleep_times.append(sleep_time)
+        # summary_contribution bez słownika na każdy wiersz
+        delta = deltas[day]
+        if is_nap:
+            delta['nap_count'] += 1
+            delta['nap_seconds'] += duration_seconds
+        else:
+            delta['night_count'] += 1
+            delta['night_seconds'] += duration_seconds
+            if rating is not None:
+                delta['rating_count'] += 1
+                delta['rating_sum'] += rating
+        if len(batch) >= batch_size:
+            inserted += len(batch)
+            flush_batch()
+
+    if batch:
+        inserted += len(batch)
+        flush_batch()
+    if inserted:
+        # Model drzemek uczymy raz po całym imporcie, a nie w tle po każdej paczce
+        queue_job(db.session, 'nap_model', 'next_nap', {})
+        db.session.commit()
+    return inserted
+
+def import_sleep_records(fmt, lines, batch_size=10000):
+    """Bulk insert records parsed from CSV/NDJSON lines, one transaction per batch.
+
+    Invalid rows are skipped and reported as (line_number, message) pairs.
+    """
+    rejected = []
+    zone = current_time_zone()
+    archived = archived_range()
+
+    def valid_records():
+        for line_number, raw in importer.iter_raw_rows(fmt, lines):
+            try:
+                if isinstance(raw, str):
+                    raise ValueError(raw)
+                sleep_time, wake_time, notes, rating = importer.parse_row(raw, zone)
+                if rating is not None and classify_sleep(sleep_time, wake_time, zone)[1]:
+                    raise ValueError("Tylko sen nocny może być oceniony.")
+                check_not_archived(sleep_time, wake_time, archived)
+            except ValueError as e:
+                rejected.append((line_number, str(e)))
+                continue
+            yield sleep_time, wake_time, notes, rating
+
+    imported = bulk_insert_records(valid_records(), batch_size=batch_size)
+    return {'imported': imported, 'rejected': rejected}
+
+# Cache strony głównej per dzień, unieważniany przez zapisy dotyczące danego dnia
+# (backend z PAGE_CACHE_BACKEND albo LRUCache, tworzony w create_app)
+page_cache = LocalProxy(lambda: _state().page_cache)
+_invalidation_lock = threading.Lock()
+_invalidation_count = 0
+
+def index_cache_key(day):
+    tenant_id = current_tenant()
+    if tenant_id is not None:
+        return f"index:{tenant_id}:{day.isoformat()}"
+    return f"index:{day.isoformat()}"
+
+def index_cache_version(day):
+    """Version of a day's records seen by every worker process: (record count, newest change id).
+
+    Each insert or edit gets a new, larger record_changes id and a delete
+    or a move to another day lowers the count, so an entry cached with an
+    older version is stale even if this process never saw the write.
+    """
+    return tuple(db.session.execute(
+        select(func.count(), func.max(RecordChange.id))
+        .select_from(_records_table)
+        .outerjoin(RecordChange, RecordChange.record_id == _records_table.c.id)
+        .where(_records_table.c.day == day)
+    ).one())
+
+def invalidate_days(days):
+    """Drop cached index pages of the given days"""
+    global _invalidation_count
+    with _invalidation_lock:
+        _invalidation_count += 1
+        for day in days:
+            page_cache.delete(index_cache_key(day))
+
+# Model następnej drzemki per rodzina, uczony przy pierwszym użyciu i potem aktualizowany po zapisach
+nap_models = LocalProxy(lambda: _state().nap_models)
+_nap_model_lock = threading.Lock()
+_nap_model_version = 0
+
+def nap_model_key():
+    tenant_id = current_tenant()
+    if tenant_id is not None:
+        return f"nap_model:{tenant_id}"
+    return "nap_model"
 
-@app.route('/')
+def fit_nap_model(today=None):
+    """Fit a next-nap model on the last NAP_MODEL_HISTORY_DAYS days of records"""
+    today = today or get_current_local_time().date()
+    since = datetime.combine(today - timedelta(days=current_app.config['NAP_MODEL_HISTORY_DAYS']), datetime.min.time())
+    records = db.session.query(SleepRecord.sleep_time, SleepRecord.wake_time, SleepRecord.is_nap).filter(
+        SleepRecord.sleep_time >= since
+    ).order_by(SleepRecord.sleep_time, SleepRecord.id)
+    return prediction.NapModel.fit(records, current_app.config['NAP_MODEL_HALF_LIFE_DAYS'])
+
+def get_nap_model():
+    """Cached next-nap model of the current tenant, fitted on a cache miss"""
+    key = nap_model_key()
+    model = nap_models.get(key)
+    if model is None:
+        version = _nap_model_version
+        model = fit_nap_model()
+        # Nie zapisuj, jeśli w międzyczasie zapis zmienił dane, z których uczył się model
+        with _nap_model_lock:
+            if version == _nap_model_version:
+                nap_models.set(key, model)
+    return model
+
+def update_nap_model(model=None, windows=()):
+    """Cache a model refitted after records changed, or add committed wake windows to the cached one.
+
+    Either way fits started before the change are no longer cached.
+    """
+    global _nap_model_version
+    key = nap_model_key()
+    with _nap_model_lock:
+        _nap_model_version += 1
+        if model is not None:
+            nap_models.set(key, model)
+            return
+        model = nap_models.get(key)
+        if model is not None:
+            for wake_time, nap_start in windows:
+                model.observe(wake_time, nap_start)
+
+@event.listens_for(db.session, 'after_commit')
+def _update_nap_model(session):
+    windows = session.info.pop('nap_windows', None)
+    # Nowy model dopasuje zadanie nap_model; do tego czasu odpowiada dotychczasowy
+    if session.info.pop('nap_model_stale', False):
+        update_nap_model()
+    elif windows:
+        update_nap_model(windows=windows)
+
+def day_wake_windows(connection, day):
+    """Wake windows of one day computed from the records, as summary fields"""
+    # Sen nocny przypisany do dnia zaczyna się najwyżej tyle przed jego początkiem, ile trwa najdłuższy wpis
+    longest = connection.execute(select(func.max(_records_table.c.duration_seconds))).scalar() or 0
+    start = datetime.combine(day, datetime.min.time())
+    previous, rows, _ = window_rows(connection, start - timedelta(seconds=longest + 1), start + timedelta(days=1))
+    windows = analytics.wake_windows((row[:3] for row in rows), previous and previous[1]).get(day, {})
+    return {field: windows.get(field, 0) for field in ('wake_window_count', 'wake_window_seconds')}
+
+def run_wake_windows_job(day, payload):
+    """Recompute wake windows of the day and of every day whose windows a change in low..high could move"""
+    connection = db.session.connection()
+    low, high = datetime.fromisoformat(payload['low']), datetime.fromisoformat(payload['high'])
+    # Zmienić mogły się okna zmienionych wpisów i pierwszego wpisu po każdym z nich
+    _, rows, following = window_rows(connection, low, high)
+    days = {date.fromisoformat(day)} | {row[2] for row in rows} | ({following[2]} if following else set())
+    stored = {
+        row.day: row for row in connection.execute(
+            select(_summary_table.c.day, _summary_table.c.wake_window_count, _summary_table.c.wake_window_seconds)
+            .where(_summary_table.c.day.in_(days))
+        )
+    }
+    deltas = {}
+    for changed_day in days:
+        windows = day_wake_windows(connection, changed_day)
+        current = stored.get(changed_day)
+        deltas[changed_day] = {
+            field: value - (getattr(current, field) if current is not None else 0) for field, value in windows.items()
+        }
+    # Strona główna nie pokazuje okien aktywności - bez unieważniania cache stron
+    apply_summary_deltas(connection, deltas)
+
+def run_nap_model_job(key, payload):
+    update_nap_model(fit_nap_model())
+
+JOB_HANDLERS = {
+    'wake_windows': run_wake_windows_job,
+    'nap_model': run_nap_model_job,
+}
+
+# Pobiera najstarsze wymagalne zadanie, odsuwając jego run_after o czas dzierżawy. Pobranie
+# zatwierdzamy od razu, więc blokada zapisu nie trwa przez całe zadanie; zadanie znika z tabeli
+# dopiero w transakcji z jego wynikami, a po awarii procesu wraca, gdy dzierżawa minie
+_job_claim = _jobs_table.update().where(
+    _jobs_table.c.id == select(_jobs_table.c.id).where(
+        _jobs_table.c.run_after <= bindparam('now'), _jobs_table.c.attempts < bindparam('max_attempts')
+    ).order_by(_jobs_table.c.run_after, _jobs_table.c.id).limit(1).scalar_subquery()
+).values(run_after=bindparam('lease_until')).returning(*_jobs_table.c)
+
+def _claimed_job(job):
+    # Zapis w trakcie zadania łączy się z nim przez queue_job i zmienia run_after - wtedy
+    # wiersz zostaje i zadanie uruchomi się jeszcze raz z nowymi danymi
+    return (_jobs_table.c.id == job.id) & (_jobs_table.c.run_after == job.run_after)
+
+def run_due_jobs():
+    """Run due jobs of the current database, each in its own transaction.
+
+    A failed job is retried with exponential backoff up to JOB_MAX_ATTEMPTS
+    times. Returns the seconds until the next retry, None when none waits.
+    """
+    max_attempts = current_app.config['JOB_MAX_ATTEMPTS']
+    while True:
+        now = time.time()
+        job = db.session.execute(_job_claim, {
+            'now': now, 'max_attempts': max_attempts, 'lease_until': now + current_app.config['JOB_LEASE_SECONDS']
+        }).first()
+        db.session.commit()
+        if job is None:
+            break
+        started = time.perf_counter()
+        try:
+            JOB_HANDLERS[job.kind](job.key, json.loads(job.payload))
+            db.session.execute(_jobs_table.delete().where(_claimed_job(job)))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            attempts = job.attempts + 1
+            db.session.execute(_jobs_table.update().where(_claimed_job(job)).values(
+                attempts=attempts,
+                run_after=time.time() + retry_delay(attempts, current_app.config['JOB_RETRY_SECONDS'], current_app.config['JOB_RETRY_MAX_SECONDS']),
+                last_error=str(e)
+            ))
+            db.session.commit()
+            outcome = 'failed' if attempts >= max_attempts else 'retry'
+            JOBS_TOTAL.inc(job.kind, outcome)
+            current_app.logger.error(f"Job {job.kind} {job.key} failed ({outcome}, attempt {attempts}): {str(e)}")
+            continue
+        JOB_SECONDS.observe(time.perf_counter() - started, job.kind)
+        JOB_LATENCY_SECONDS.observe(time.time() - job.enqueued_at, job.kind)
+        JOBS_TOTAL.inc(job.kind, 'done')
+
+    counts = dict(db.session.execute(
+        select(_jobs_table.c.kind, func.count()).where(_jobs_table.c.attempts < max_attempts).group_by(_jobs_table.c.kind)
+    ).all())
+    for kind in JOB_HANDLERS:
+        JOBS_PENDING.set(counts.get(kind, 0), kind)
+    next_run = db.session.execute(
+        select(func.min(_jobs_table.c.run_after)).where(_jobs_table.c.attempts < max_attempts)
+    ).scalar()
+    db.session.rollback()
+    return None if next_run is None else max(next_run - time.time(), 0)
+
+def _process_jobs(flask_app, tenant_id):
+    with flask_app.app_context():
+        g.tenant_id = tenant_id
+        try:
+            return run_due_jobs()
+        finally:
+            db.session.remove()
+
+# Kanałem kolejki jest rodzina (None poza trybem wielu rodzin), czyli jedna baza danych
+job_queue = LocalProxy(lambda: _state().job_queue)
+_resumed_channels = LocalProxy(lambda: _state().resumed_channels)
+
+def resume_jobs(tenant_id):
+    """Run jobs left in a database by a previous process, once per database and process"""
+    if tenant_id not in _resumed_channels:
+        _resumed_channels.add(tenant_id)
+        job_queue.submit(tenant_id)
+
+def build_index_view(selected_date, today):
+    """Load everything the index page shows for a day, as plain values"""
+    # Dzień z archiwum nie pokazuje wpisów - są tylko w eksporcie, a nie można ich edytować
+    archived = archived_range()
+    archived_until = archived[0] if archived and selected_date <= archived[0] else None
+    # Pobierz rekordy przypisane do wybranego dnia:
+    # drzemki (do 4h) według dnia rozpoczęcia, sen nocny według dnia zakończenia
+    records = [
+        {
+            'id': record.id,
+            'label': record.label,
+            'sleep_time': record.sleep_time,
+            'wake_time': record.wake_time,
+            'duration_seconds': record.duration_seconds,
+            'sleep_rating': record.sleep_rating,
+            'is_rated': record.is_rated,
+        }
+        for record in (records_for_day(selected_date) if archived_until is None else [])
+    ]
+    mark_overlapping(records)
+    
+    # Liczba drzemek i suma godzin drzemek z podsumowania dnia
+    summary = db.session.get(DailySleepSummary, selected_date)
+    naps_today = summary.nap_count if summary else 0
+    nap_seconds = summary.nap_seconds if summary else 0
+    
+    # Ostatnia pobudka potrzebna tylko dla dzisiejszego dnia
+    last_wake = None
+    if today == selected_date and records:
+        # Znajdź ostatni rekord (drzemkę lub sen nocny) zakończony dzisiaj
+        start_of_today = datetime.combine(today, datetime.min.time())
+        last_record = SleepRecord.query.filter(
+            SleepRecord.wake_time >= start_of_today,
+            SleepRecord.wake_time < start_of_today + timedelta(days=1),
+            SleepRecord.day == today
+        ).order_by(SleepRecord.wake_time.desc()).first()
+        if last_record:
+            last_wake = last_record.wake_time
+    
+    return {
+        'records': records,
+        'naps_today': naps_today,
+        'total_nap_hours': nap_seconds // 3600,
+        'total_nap_minutes': (nap_seconds % 3600) // 60,
+        'selected_date': selected_date,
+        'today': today,
+        'last_wake': last_wake,
+        'archived_until': archived_until,
+    }
+
+def render_index(view):
+    """Render the index page from a view built by build_index_view"""
+    time_since_last = None
+    if view['last_wake']:
+        # Upływ czasu liczony w UTC - poprawny także w noc zmiany czasu
+        zone = current_time_zone()
+        elapsed = timezones.seconds_between(view['last_wake'], get_current_local_time().replace(tzinfo=None), zone)
+        hours = elapsed // 3600
+        minutes = (elapsed % 3600) // 60
+        time_since_last = {'hours': hours, 'minutes': minutes}
+    
+    # Prognoza z modelu w pamięci - bez zapytań do bazy, poza pierwszym uczeniem modelu
+    next_nap = get_nap_model().predict(view['last_wake']) if view['last_wake'] else None
+    
+    # Średnie kroczące tylko na dzisiejszej stronie - ta nie jest zapisywana w cache jako HTML
+    rolling = rolling_sleep_stats(view['today']) if view['selected_date'] == view['today'] else None
+    
+    context = {key: value for key, value in view.items() if key != 'last_wake'}
+    return render_template('index.html', time_since_last=time_since_last, next_nap=next_nap, rolling=rolling, **context)
+
+@bp.route('/')
 def index():
     """Home page route"""
     try:
         # Get selected date from query parameters or use today
         selected_date_str = request.args.get('date')
-        # Używamy aktualnego czasu w strefie czasowej warszawskiej
-        today = get_current_warsaw_time().date()
+        # Dzisiejsza data w strefie czasowej rodziny
+        today = get_current_local_time().date()
         
         if selected_date_str:
             selected_date = datetime.strptime(selected_date_str, '%Y-%m-%d').date()
         else:
             selected_date = today
-
-        # Get records for selected date
-        start_of_day = datetime.combine(selected_date, datetime.min.time())
-        end_of_day = datetime.combine(selected_date, datetime.max.time())
-        
-        # Pobierz rekordy, które:
-        # 1. Są drzemkami (krótsze niż 4h) i zaczynają się w wybranym dniu
-        # 2. Są snem nocnym (dłuższe niż 4h) i kończą się w wybranym dniu
-        records = []
         
-        # Najpierw pobierz wszystkie rekordy, które mogą być związane z wybranym dniem
-        all_possible_records = SleepRecord.query.filter(
-            ((SleepRecord.sleep_time >= start_of_day) & (SleepRecord.sleep_time <= end_of_day)) |  # zaczynają się w wybranym dniu
-            ((SleepRecord.wake_time >= start_of_day) & (SleepRecord.wake_time <= end_of_day))      # kończą się w wybranym dniu
-        ).all()
-        
-        # Następnie przefiltruj je zgodnie z zasadami
-        for record in all_possible_records:
-            # Oblicz czas trwania snu w godzinach
-            sleep_duration = (record.wake_time - record.sleep_time).total_seconds() / 3600
-            
-            # Jeśli to drzemka (krótszy niż 4h), sprawdź czy zaczyna się w wybranym dniu
-            if sleep_duration <= 4 and record.sleep_time.date() == selected_date:
-                records.append(record)
-            # Jeśli to sen nocny (dłuższy niż 4h), sprawdź czy kończy się w wybranym dniu
-            elif sleep_duration > 4 and record.wake_time.date() == selected_date:
-                records.append(record)
-        
-        # Sortuj rekordy według czasu rozpoczęcia, od najnowszego
-        records.sort(key=lambda x: x.sleep_time, reverse=True)
-        
-        time_since_last = None
-        
-        # Oblicz liczbę drzemek i sumę godzin drzemek dla wybranego dnia
-        naps_today = 0
-        total_nap_hours = 0
-        total_nap_minutes = 0
+        key = index_cache_key(selected_date)
+        entry = page_cache.get(key)
+        # Zapis w innym procesie nie unieważnia naszego cache - wersję dnia sprawdzamy w bazie.
+        # Wpis z poprzedniego dnia kalendarzowego ma nieaktualne "dzisiaj" (np. limit w wyborze daty)
+        version = index_cache_version(selected_date)
+        if entry is None or entry['version'] != version or entry['view']['today'] != today:
+            invalidation_count = _invalidation_count
+            view = build_index_view(selected_date, today)
+            # Dzisiejszej strony nie zapisujemy jako HTML - "czas od ostatniej drzemki" zależy od bieżącej godziny
+            html = render_index(view) if selected_date != today else None
+            entry = {
+                'view': view,
+                'html': html,
+                'version': version,
+                'last_modified': datetime.utcnow().replace(microsecond=0),
+            }
+            # Nie zapisuj, jeśli w międzyczasie jakiś zapis unieważnił cache
+            with _invalidation_lock:
+                if invalidation_count == _invalidation_count:
+                    page_cache.set(key, entry)
         
-        for record in records:
-            sleep_duration = (record.wake_time - record.sleep_time).total_seconds()
-            # Jeśli to drzemka (krótszy niż 4h)
-            if sleep_duration <= 4 * 3600:
-                naps_today += 1
-                total_nap_hours += int(sleep_duration // 3600)
-                total_nap_minutes += int((sleep_duration % 3600) // 60)
+        html = entry['html'] if entry['html'] is not None else render_index(entry['view'])
         
-        # Konwertuj nadmiarowe minuty na godziny
-        if total_nap_minutes >= 60:
-            total_nap_hours += total_nap_minutes // 60
-            total_nap_minutes = total_nap_minutes % 60
-        
-        # Calculate time since last nap only for today
-        if today == selected_date and records:
-            # Znajdź ostatni rekord (drzemkę lub sen nocny) zakończony dzisiaj
-            today_records = [r for r in records if r.wake_time.date() == today]
-            if today_records:
-                last_wake = today_records[0].wake_time
-                # Używamy aktualnego czasu w strefie czasowej warszawskiej
-                current_time = get_current_warsaw_time().replace(tzinfo=None)
-                time_diff = current_time - last_wake
-                hours = int(time_diff.total_seconds() // 3600)
-                minutes = int((time_diff.total_seconds() % 3600) // 60)
-                time_since_last = {'hours': hours, 'minutes': minutes}
-            
-        return render_template('index.html', 
-                             records=records, 
-                             time_since_last=time_since_last,
-                             naps_today=naps_today,
-                             total_nap_hours=total_nap_hours,
-                             total_nap_minutes=total_nap_minutes,
-                             selected_date=selected_date,
-                             today=today)
+        response = make_response(html)
+        response.set_etag(hashlib.md5(html.encode('utf-8')).hexdigest())
+        if entry['html'] is not None:
+            response.last_modified = entry['last_modified']
+        # Przeglądarka zawsze pyta serwer, ale dostaje 304, jeśli strona się nie zmieniła
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
-        app.logger.error(f"Error fetching records: {str(e)}")
+        current_app.logger.error(f"Error fetching records: {str(e)}")
         return render_template('error.html', message="Nie udało się pobrać zapisów.")
 
-@app.route('/add', methods=['GET', 'POST'])
+@bp.route('/add', methods=['GET', 'POST'])
 def add_record():
     """Add new sleep record route"""
     if request.method == 'POST':
@@ -149,165 +1884,219 @@ def add_record():
             wake_time = datetime.strptime(request.form['wake_time'], '%Y-%m-%dT%H:%M')
             notes = request.form['notes']
 
-            if wake_time <= sleep_time:
+            if timezones.seconds_between(sleep_time, wake_time, current_time_zone()) <= 0:
                 return render_template('add.html', error="Czas pobudki musi być późniejszy niż czas zaśnięcia.")
             
-            # Oblicz czas trwania snu w godzinach
-            sleep_duration = (wake_time - sleep_time).total_seconds() / 3600
-            
-            # Sprawdź, czy notatki są puste lub zawierają standardowy opis
-            is_standard_note = not notes.strip() or notes.strip() == "Sen nocny" or notes.strip().startswith("Drzemka nr")
-            
-            # Jeśli notatki są puste lub zawierają standardowy opis, automatycznie określ typ snu
-            if is_standard_note:
-                if sleep_duration > 4:
-                    notes = "Sen nocny"
-                else:
-                    # Dla drzemek liczymy drzemki z dnia rozpoczęcia
-                    today = sleep_time.date()
-                    # Policz dzisiejsze drzemki
-                    naps_today = SleepRecord.query.filter(
-                        SleepRecord.sleep_time >= datetime.combine(today, datetime.min.time()),
-                        SleepRecord.sleep_time < datetime.combine(today, datetime.max.time()),
-                        (SleepRecord.wake_time - SleepRecord.sleep_time) <= timedelta(hours=4)  # tylko drzemki
-                    ).count()
-                    
-                    notes = f"Drzemka nr {naps_today + 1}"
+            # Standardowe opisy ("Sen nocny", "Drzemka nr N") wyliczamy przy odczycie
+            if is_standard_note(notes):
+                notes = ''
             
             record = SleepRecord(
                 sleep_time=sleep_time,
                 wake_time=wake_time,
                 notes=notes
             )
-            db.session.add(record)
+            db.session.add(resolve_overlaps(record))
             db.session.commit()
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         
+        except (OverlapError, ArchivedRangeError) as e:
+            db.session.rollback()
+            return render_template('add.html', error=str(e))
         except Exception as e:
-            app.logger.error(f"Error adding record: {str(e)}")
+            current_app.logger.error(f"Error adding record: {str(e)}")
             db.session.rollback()
             return render_template('add.html', error="Wystąpił błąd podczas dodawania zapisu.")
     
     return render_template('add.html')
 
-@app.route('/start_nap', methods=['POST'])
-def start_nap():
-    """Start new nap"""
+# Zdarzenia start/stop drzemki dla otwartych strumieni SSE (kanał na rodzinę)
+nap_events = EventBroker()
+
+def active_nap_state(event='state'):
+    """Return the current active nap as an event payload"""
+    active = ActiveNap.query.order_by(ActiveNap.start_time).first()
+    if active is None:
+        return {'event': event, 'active': False, 'nap_id': None, 'start_time': None}
+    return {
+        'event': event,
+        'active': True,
+        'nap_id': active.id,
+        # Czas w formacie ISO z przesunięciem strefy rodziny
+        'start_time': timezones.isoformat(active.start_time, current_time_zone())
+    }
+
+def begin_nap():
+    """Start a nap unless one is active; returns (payload, status) for the JSON API"""
     try:
-        # Używamy aktualnego czasu w strefie czasowej warszawskiej
-        start_time = get_current_warsaw_time()
+        # Jeśli drzemkę rozpoczęto już na innym urządzeniu, zwracamy tę samą
+        active = ActiveNap.query.order_by(ActiveNap.start_time).first()
+        if active is None:
+            # Używamy aktualnego czasu w strefie czasowej rodziny
+            active = ActiveNap(start_time=get_current_local_time().replace(tzinfo=None, microsecond=0))
+            db.session.add(active)
+            db.session.commit()
+            state = active_nap_state('start')
+            nap_events.publish(current_tenant(), state)
+        else:
+            state = active_nap_state()
         
         # Zwracamy czas w formacie ISO z informacją o strefie czasowej
-        # Dzięki temu przeglądarka będzie wiedziała, że to czas w strefie warszawskiej
-        return jsonify({
+        # Dzięki temu przeglądarka będzie wiedziała, w jakiej strefie jest ten czas
+        return {
             'status': 'success',
-            'start_time': start_time.isoformat()
-        })
+            'start_time': state['start_time'],
+            'nap_id': state['nap_id']
+        }, 200
     except Exception as e:
-        app.logger.error(f"Error starting nap: {str(e)}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        current_app.logger.error(f"Error starting nap: {str(e)}")
+        db.session.rollback()
+        return {'status': 'error', 'message': str(e)}, 500
 
-@app.route('/stop_nap', methods=['POST'])
-def stop_nap():
-    """Stop nap and save record"""
+@bp.route('/start_nap', methods=['POST'])
+def start_nap():
+    """Start new nap"""
+    payload, status = begin_nap()
+    return jsonify(payload), status
+
+@bp.route('/active_nap')
+def active_nap():
+    """Current active nap, if any"""
+    return jsonify(dict(active_nap_state(), status='success'))
+
+@bp.route('/naps/stream')
+def nap_stream():
+    """Server-Sent Events stream with nap start/stop events.
+
+    Each open stream holds a worker thread, so run it on a threaded
+    or gevent server.
+    """
+    channel = current_tenant()
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    
+    def stream():
+        subscriber = nap_events.subscribe(channel)
+        try:
+            last_state = active_nap_state()
+            db.session.remove()  # Nie trzymaj połączenia z bazą przez cały czas trwania strumienia
+            yield format_sse(last_state)
+            while True:
+                try:
+                    state = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Zdarzenia z innych procesów nie trafiają do tej kolejki - sprawdź stan w bazie
+                    state = active_nap_state()
+                    db.session.remove()
+                    if (state['active'], state['nap_id']) == (last_state['active'], last_state['nap_id']):
+                        yield ": keepalive\n\n"
+                        continue
+                last_state = state
+                yield format_sse(state)
+        finally:
+            nap_events.unsubscribe(channel, subscriber)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def finish_nap(data):
+    """Stop the active nap (or one started at data['start_time']) and save it as a record.
+
+    Returns (payload, status) for the JSON API.
+    """
     try:
-        data = request.get_json()
-        
-        # Konwertuj czasy do lokalnej strefy czasowej
-        sleep_time_str = data['start_time']
-        
-        # Poprawiona konwersja czasu - zakładamy, że czas przychodzący jest już w strefie czasowej warszawskiej
-        # ale został przekonwertowany do ISO format, więc musimy go prawidłowo zinterpretować
-        if 'Z' in sleep_time_str:
-            # Jeśli czas zawiera 'Z', oznacza to czas UTC
-            sleep_time = datetime.fromisoformat(sleep_time_str.replace('Z', '+00:00'))
-            sleep_time = sleep_time.astimezone(local_tz)
-        elif '+' in sleep_time_str or '-' in sleep_time_str[-6:]:
-            # Jeśli czas zawiera informację o strefie czasowej
-            sleep_time = datetime.fromisoformat(sleep_time_str)
-            sleep_time = sleep_time.astimezone(local_tz)
+        # Czas rozpoczęcia bierzemy z aktywnej drzemki zapisanej na serwerze;
+        # start_time z żądania obsługujemy dla klientów bez aktywnej drzemki
+        active_naps = ActiveNap.query.order_by(ActiveNap.start_time).all()
+        sleep_time_str = data.get('start_time')
+        zone = current_time_zone()
+        if active_naps:
+            sleep_time = active_naps[0].start_time
+            for active in active_naps:
+                db.session.delete(active)
+        elif not sleep_time_str:
+            return {'status': 'error', 'message': 'Brak aktywnej drzemki.'}, 400
         else:
-            # Jeśli czas nie zawiera informacji o strefie czasowej, zakładamy że jest w lokalnej strefie
-            sleep_time = datetime.fromisoformat(sleep_time_str)
-            sleep_time = sleep_time.replace(tzinfo=local_tz)
-        
-        # Używamy aktualnego czasu w strefie czasowej warszawskiej
-        wake_time = get_current_warsaw_time()
-        
-        # Zapisujemy czas bez informacji o strefie czasowej, ale zachowujemy lokalny czas warszawski
-        sleep_time = sleep_time.replace(tzinfo=None)
-        wake_time = wake_time.replace(tzinfo=None)
+            # Czas z przesunięciem (także 'Z') przeliczamy na czas rodziny, czas bez przesunięcia jest już lokalny
+            try:
+                sleep_time = timezones.parse_local(sleep_time_str, zone)
+            except ValueError:
+                return {'status': 'error', 'message': 'Nieprawidłowy czas rozpoczęcia drzemki.'}, 400
         
-        # Oblicz czas trwania snu w godzinach
-        sleep_duration = (wake_time - sleep_time).total_seconds() / 3600
-        
-        # Określ opis na podstawie czasu trwania snu
-        if sleep_duration > 4:
-            notes = "Sen nocny"
-            # Dla snu nocnego liczymy drzemki z dnia zakończenia
-            today = wake_time.date()
-        else:
-            # Dla drzemek liczymy drzemki z dnia rozpoczęcia
-            today = sleep_time.date()
-            # Policz dzisiejsze drzemki
-            naps_today = SleepRecord.query.filter(
-                SleepRecord.sleep_time >= datetime.combine(today, datetime.min.time()),
-                SleepRecord.sleep_time < datetime.combine(today, datetime.max.time()),
-                (SleepRecord.wake_time - SleepRecord.sleep_time) <= timedelta(hours=4)  # tylko drzemki
-            ).count()
-            
-            notes = f"Drzemka nr {naps_today + 1}"
+        # Zapisujemy lokalny czas rodziny bez strefy - LocalTime przelicza go na UTC
+        wake_time = get_current_local_time().replace(tzinfo=None)
         
+        # Opis ("Sen nocny" / "Drzemka nr N") jest wyliczany przy odczycie dnia
         record = SleepRecord(
             sleep_time=sleep_time,
             wake_time=wake_time,
-            notes=notes,
+            notes='',
             is_rated=False  # Domyślnie sen nie jest oceniony
         )
         
+        record = resolve_overlaps(record)
         db.session.add(record)
         db.session.commit()
+        nap_events.publish(current_tenant(), dict(active_nap_state('stop'), record_id=record.id))
         
         # Jeśli to sen nocny, zwróć ID rekordu, aby można było przekierować do oceny
-        if sleep_duration > 4:
-            return jsonify({
+        if not record.is_nap:
+            return {
                 'status': 'success',
                 'message': 'Sen nocny zapisany',
                 'is_night_sleep': True,
                 'record_id': record.id
-            })
+            }, 200
         else:
-            return jsonify({
+            return {
                 'status': 'success',
                 'message': 'Drzemka zapisana',
                 'is_night_sleep': False
-            })
+            }, 200
+    except (OverlapError, ArchivedRangeError) as e:
+        db.session.rollback()
+        return {'status': 'error', 'message': str(e)}, 409
+    except StaleDataError:
+        # Inne urządzenie zakończyło tę drzemkę w tym samym momencie
+        db.session.rollback()
+        DB_CONFLICTS_TOTAL.inc('stop_nap')
+        return {'status': 'error', 'message': 'Drzemka została już zakończona.'}, 409
     except Exception as e:
-        app.logger.error(f"Error saving nap: {str(e)}")
+        current_app.logger.error(f"Error saving nap: {str(e)}")
         db.session.rollback()
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return {'status': 'error', 'message': str(e)}, 500
+
+@bp.route('/stop_nap', methods=['POST'])
+def stop_nap():
+    """Stop nap and save record"""
+    payload, status = finish_nap(request.get_json(silent=True) or {})
+    return jsonify(payload), status
 
-@app.route('/delete_record/<int:record_id>', methods=['POST'])
+@bp.route('/delete_record/<int:record_id>', methods=['POST'])
 def delete_record(record_id):
     """Delete sleep record"""
     try:
         record = SleepRecord.query.get_or_404(record_id)
         db.session.delete(record)
         db.session.commit()
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     except Exception as e:
-        app.logger.error(f"Error deleting record: {str(e)}")
+        current_app.logger.error(f"Error deleting record: {str(e)}")
         return render_template('error.html', message="Nie udało się usunąć wpisu.")
 
-@app.route('/edit_record/<int:record_id>', methods=['GET', 'POST'])
+@bp.route('/edit_record/<int:record_id>', methods=['GET', 'POST'])
 def edit_record(record_id):
     """Edit sleep record"""
     record = SleepRecord.query.get_or_404(record_id)
     
     if request.method == 'POST':
         try:
-            record.sleep_time = datetime.strptime(request.form['sleep_time'], '%Y-%m-%dT%H:%M')
-            record.wake_time = datetime.strptime(request.form['wake_time'], '%Y-%m-%dT%H:%M')
+            # Niezmieniony czas zostawiamy - formularz nie odróżnia powtórzonej godziny przy zmianie czasu (fold)
+            for field in ('sleep_time', 'wake_time'):
+                value = datetime.strptime(request.form[field], '%Y-%m-%dT%H:%M')
+                if value != getattr(record, field):
+                    setattr(record, field, value)
             record.notes = request.form['notes']
             
             # Handle sleep rating if provided
@@ -320,49 +2109,33 @@ def edit_record(record_id):
                 except ValueError:
                     pass
             
-            if record.wake_time <= record.sleep_time:
+            if timezones.seconds_between(record.sleep_time, record.wake_time, current_time_zone()) <= 0:
                 return render_template('edit.html', record=record, error="Czas pobudki musi być późniejszy niż czas zaśnięcia.")
             
-            # Oblicz czas trwania snu w godzinach
-            sleep_duration = (record.wake_time - record.sleep_time).total_seconds() / 3600
-            
-            # Sprawdź, czy notatki są puste lub zawierają standardowy opis
-            is_standard_note = not record.notes.strip() or record.notes.strip() == "Sen nocny" or record.notes.strip().startswith("Drzemka nr")
-            
-            # Jeśli notatki są puste lub zawierają standardowy opis, automatycznie zaktualizuj opis
-            if is_standard_note:
-                if sleep_duration > 4:
-                    record.notes = "Sen nocny"
-                else:
-                    # Dla drzemek liczymy drzemki z dnia rozpoczęcia
-                    today = record.sleep_time.date()
-                    # Policz dzisiejsze drzemki
-                    naps_today = SleepRecord.query.filter(
-                        SleepRecord.sleep_time >= datetime.combine(today, datetime.min.time()),
-                        SleepRecord.sleep_time < datetime.combine(today, datetime.max.time()),
-                        (SleepRecord.wake_time - SleepRecord.sleep_time) <= timedelta(hours=4),  # tylko drzemki
-                        SleepRecord.id != record_id  # Wykluczamy aktualny rekord
-                    ).count()
-                    
-                    record.notes = f"Drzemka nr {naps_today + 1}"
+            # Standardowe opisy ("Sen nocny", "Drzemka nr N") wyliczamy przy odczycie
+            if is_standard_note(record.notes):
+                record.notes = ''
             
+            resolve_overlaps(record)
             db.session.commit()
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
+        except (OverlapError, ArchivedRangeError) as e:
+            db.session.rollback()
+            return render_template('edit.html', record=record, error=str(e))
         except Exception as e:
-            app.logger.error(f"Error editing record: {str(e)}")
+            current_app.logger.error(f"Error editing record: {str(e)}")
             db.session.rollback()
             return render_template('edit.html', record=record, error="Wystąpił błąd podczas edycji wpisu.")
     
     return render_template('edit.html', record=record)
 
-@app.route('/rate_sleep/<int:record_id>', methods=['GET', 'POST'])
+@bp.route('/rate_sleep/<int:record_id>', methods=['GET', 'POST'])
 def rate_sleep(record_id):
     """Rate sleep quality"""
     record = SleepRecord.query.get_or_404(record_id)
     
     # Check if this is a night sleep (longer than 4 hours)
-    sleep_duration = (record.wake_time - record.sleep_time).total_seconds() / 3600
-    if sleep_duration <= 4:
+    if record.is_nap:
         return render_template('error.html', message="Tylko sen nocny może być oceniony.")
     
     if request.method == 'POST':
@@ -372,22 +2145,382 @@ def rate_sleep(record_id):
                 record.sleep_rating = rating
                 record.is_rated = True
                 db.session.commit()
-                return redirect(url_for('index'))
+                return redirect(url_for('main.index'))
             else:
                 return render_template('rate_sleep.html', record=record, error="Ocena musi być w zakresie 1-5.")
         except Exception as e:
-            app.logger.error(f"Error rating sleep: {str(e)}")
+            current_app.logger.error(f"Error rating sleep: {str(e)}")
             db.session.rollback()
             return render_template('rate_sleep.html', record=record, error="Wystąpił błąd podczas oceny snu.")
     
     return render_template('rate_sleep.html', record=record)
 
-@app.errorhandler(404)
+def record_payload(record):
+    """Sleep record as returned by the JSON API"""
+    return dict(
+        export.serialize_row({column.name: getattr(record, column.name) for column in SleepRecord.__table__.columns}),
+        sleep_time=timezones.isoformat(record.sleep_time, current_time_zone()),
+        wake_time=timezones.isoformat(record.wake_time, current_time_zone()),
+        label=record.label
+    )
+
+def list_day_records(day=None):
+    """Records attributed to a day (default today) and the active nap; returns (payload, status) for the JSON API"""
+    day = day or get_current_local_time().date()
+    archived = archived_range()
+    if archived and day <= archived[0]:
+        return {'status': 'error', 'message': archived_day_message(archived[0])}, 410
+    records = []
+    for record in records_for_day(day):
+        records.append(dict(record_payload(record), nap_number=record.nap_number))
+    return {
+        'status': 'success',
+        'date': day.isoformat(),
+        'records': records,
+        'active_nap': active_nap_state(),
+    }, 200
+
+def rate_record(record_id, rating):
+    """Rate a night sleep 1-5; returns (payload, status) for the JSON API"""
+    record = db.session.get(SleepRecord, record_id)
+    if record is None:
+        return {'status': 'error', 'message': 'Nie znaleziono wpisu.'}, 404
+    if record.is_nap:
+        return {'status': 'error', 'message': 'Tylko sen nocny może być oceniony.'}, 400
+    if not isinstance(rating, int) or isinstance(rating, bool) or not 1 <= rating <= 5:
+        return {'status': 'error', 'message': 'Ocena musi być w zakresie 1-5.'}, 400
+    try:
+        record.sleep_rating = rating
+        record.is_rated = True
+        db.session.commit()
+        return {'status': 'success', 'record': record_payload(record)}, 200
+    except Exception as e:
+        current_app.logger.error(f"Error rating sleep: {str(e)}")
+        db.session.rollback()
+        return {'status': 'error', 'message': 'Wystąpił błąd podczas oceny snu.'}, 500
+
+@bp.route('/api/naps')
+def api_naps():
+    """Records of a day (?date=, default today) with the active nap"""
+    try:
+        day = parse_date_param(request.args.get('date'))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Niepoprawny format daty (RRRR-MM-DD).'}), 400
+    payload, status = list_day_records(day)
+    return jsonify(payload), status
+
+@bp.route('/api/naps/<int:record_id>/rate', methods=['POST'])
+def api_rate_nap(record_id):
+    """Rate a night sleep with JSON {"rating": 1-5}"""
+    data = request.get_json(silent=True) or {}
+    payload, status = rate_record(record_id, data.get('rating'))
+    return jsonify(payload), status
+
+def _sync_target(event):
+    """Record referred to by an edit/rate event, by id or by the key of its stop event"""
+    record_id = event['record_id']
+    if record_id is None:
+        stored = db.session.execute(select(SyncKey.result).where(SyncKey.key == event['record_key'])).scalar()
+        record_id = json.loads(stored).get('record_id') if stored else None
+    record = db.session.get(SleepRecord, record_id) if record_id is not None else None
+    if record is None:
+        raise LookupError("Nie znaleziono wpisu.")
+    return record
+
+def apply_sync_event(event):
+    """Apply one parsed event in the current transaction, returns its result"""
+    if event['type'] == 'start':
+        active = ActiveNap.query.order_by(ActiveNap.start_time).first()
+        if active is None:
+            start_time = event['time'] or get_current_local_time().replace(tzinfo=None, microsecond=0)
+            active = ActiveNap(start_time=start_time)
+            db.session.add(active)
+            db.session.flush()
+        return {'nap_id': active.id}
+
+    if event['type'] == 'stop':
+        # Jak w stop_nap: początek z aktywnej drzemki na serwerze, a gdy jej nie ma - z urządzenia
+        active_naps = ActiveNap.query.order_by(ActiveNap.start_time).all()
+        sleep_time = active_naps[0].start_time if active_naps else event['start_time']
+        if sleep_time is None:
+            raise ValueError("Brak aktywnej drzemki.")
+        wake_time = event['time'] or get_current_local_time().replace(tzinfo=None)
+        if timezones.seconds_between(sleep_time, wake_time, current_time_zone()) <= 0:
+            raise ValueError("Czas pobudki musi być późniejszy niż czas zaśnięcia.")
+        for active in active_naps:
+            db.session.delete(active)
+        # Ten sam sen zapisany już wcześniej (np. ponowione stop_nap bez klucza)
+        record = SleepRecord.query.filter_by(sleep_time=sleep_time, wake_time=wake_time).first()
+        if record is None:
+            record = resolve_overlaps(SleepRecord(sleep_time=sleep_time, wake_time=wake_time, notes='', is_rated=False))
+            db.session.add(record)
+            db.session.flush()
+        return {'record_id': record.id, 'is_night_sleep': not record.is_nap}
+
+    record = _sync_target(event)
+    if event['type'] == 'edit':
+        record.sleep_time = event['sleep_time']
+        record.wake_time = event['wake_time']
+        if event['notes'] is not None:
+            record.notes = '' if is_standard_note(event['notes']) else event['notes']
+        record = resolve_overlaps(record)
+    else:
+        if record.is_nap:
+            raise ValueError("Tylko sen nocny może być oceniony.")
+        record.sleep_rating = event['rating']
+        record.is_rated = True
+    db.session.flush()
+    return {'record_id': record.id}
+
+def _sync_one(raw):
+    """Claim the event's idempotency key and apply it, or return the stored result of a retry"""
+    key = raw.get('key') if isinstance(raw, dict) else None
+    if not sync.is_valid_key(key):
+        return {'key': key, 'status': 'error', 'message': 'Brak klucza idempotencji.'}
+    # Pierwszy zapis w transakcji - od tej chwili trzymamy blokadę zapisu SQLite
+    claimed = db.session.execute(
+        sqlite_insert(SyncKey.__table__).values(key=key, result='{}', created_at=datetime.utcnow())
+        .on_conflict_do_nothing()
+    ).rowcount
+    if not claimed:
+        stored = db.session.execute(select(SyncKey.result).where(SyncKey.key == key)).scalar()
+        return dict(json.loads(stored), key=key, status='duplicate')
+    try:
+        # Savepoint - odrzucone zdarzenie nie zostawia częściowych zmian w transakcji
+        with db.session.begin_nested():
+            event = sync.parse_event(raw, current_time_zone())
+            result = dict(apply_sync_event(event), type=event['type'])
+    except (ValueError, LookupError) as e:
+        # Klucz zwalniamy, żeby poprawione zdarzenie można było wysłać ponownie
+        db.session.execute(delete(SyncKey).where(SyncKey.key == key))
+        return {'key': key, 'status': 'error', 'message': str(e)}
+    db.session.execute(update(SyncKey).where(SyncKey.key == key).values(result=json.dumps(result)))
+    return dict(result, key=key, status='applied')
+
+def record_changes_since(cursor, limit):
+    """Records changed after `cursor`, deleted record ids and the next cursor"""
+    changes = RecordChange.query.filter(RecordChange.id > cursor).order_by(RecordChange.id).limit(limit + 1).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    changed_ids = [change.record_id for change in changes if not change.deleted]
+    records = SleepRecord.query.filter(SleepRecord.id.in_(changed_ids)).order_by(SleepRecord.sleep_time).all() if changed_ids else []
+    return {
+        'records': [record_payload(record) for record in records],
+        'deleted': [change.record_id for change in changes if change.deleted],
+        'cursor': changes[-1].id if changes else cursor,
+        'has_more': has_more,
+    }
+
+@bp.route('/api/sync', methods=['POST'])
+def api_sync():
+    """Apply a batch of offline client events in one transaction and return
+    the records changed since the client's cursor"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Niepoprawne dane synchronizacji.'}), 400
+    events = data.get('events', [])
+    if not isinstance(events, list):
+        return jsonify({'status': 'error', 'message': 'Pole events musi być listą.'}), 400
+    if len(events) > current_app.config['SYNC_MAX_EVENTS']:
+        return jsonify({'status': 'error', 'message': f"Za dużo zdarzeń w jednej synchronizacji (maks. {current_app.config['SYNC_MAX_EVENTS']})."}), 400
+    try:
+        cursor = int(data.get('cursor') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Niepoprawny kursor.'}), 400
+
+    try:
+        results = [_sync_one(raw) for raw in events]
+        db.session.commit()
+    except StaleDataError:
+        # Inne urządzenie zakończyło drzemkę w tym samym momencie - klient może bezpiecznie ponowić
+        db.session.rollback()
+        DB_CONFLICTS_TOTAL.inc('api_sync')
+        return jsonify({'status': 'error', 'message': 'Drzemka została już zakończona.'}), 409
+    except Exception as e:
+        current_app.logger.error(f"Error syncing events: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    nap_results = [result for result in results if result['status'] == 'applied' and result['type'] in ('start', 'stop')]
+    if nap_results:
+        nap_events.publish(current_tenant(), active_nap_state(nap_results[-1]['type']))
+
+    return jsonify(dict(
+        record_changes_since(cursor, current_app.config['SYNC_PAGE_SIZE']),
+        status='success',
+        results=results,
+        active_nap=active_nap_state()
+    ))
+
+@bp.route('/api/stats')
+def api_stats():
+    """Sleep statistics aggregated per day, week or month"""
+    try:
+        end = parse_date_param(request.args.get('to')) or get_current_local_time().date()
+        start = parse_date_param(request.args.get('from')) or end - timedelta(days=29)
+        bucket = request.args.get('bucket', 'day')
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Niepoprawny format daty (RRRR-MM-DD).'}), 400
+    
+    # numpy ładuje się dziesiątki ms - importujemy go dopiero przy pierwszym użyciu statystyk
+    import stats
+    if bucket not in stats.BUCKETS:
+        return jsonify({'status': 'error', 'message': 'Parametr bucket musi mieć wartość day, week lub month.'}), 400
+    if start > end:
+        return jsonify({'status': 'error', 'message': 'Data początkowa jest późniejsza niż końcowa.'}), 400
+    
+    try:
+        # Jedno zapytanie o same kolumny (bez obiektów ORM); dzień wcześniej dla pierwszego okna aktywności
+        first_day = start - timedelta(days=1)
+        # Czasy jako surowe sekundy UTC, a czas trwania, rodzaj i dzień z zapisanych kolumn -
+        # jak w podsumowaniach dziennych, także w noc zmiany czasu
+        table = SleepRecord.__table__
+        rows = db.session.execute(
+            select(type_coerce(table.c.sleep_time, db.Integer), type_coerce(table.c.wake_time, db.Integer),
+                   table.c.duration_seconds, table.c.is_nap, table.c.day, table.c.sleep_rating)
+            .where(table.c.day >= first_day, table.c.day <= end)
+            .order_by(table.c.sleep_time)
+        ).all()
+        sleep_times, wake_times, durations, is_nap, days, ratings = zip(*rows) if rows else ((),) * 6
+        # Zarchiwizowane miesiące czytamy prosto z plików kolumnowych
+        parts = [month.stats_columns(first_day, end) for month in archived_months(first_day, end)]
+        parts.append((stats.to_seconds(sleep_times), stats.to_seconds(wake_times), stats.to_seconds(durations),
+                      stats.to_flags(is_nap), stats.to_days(days), stats.to_ratings(ratings)))
+        buckets = stats.aggregate(*stats.combine(parts), start, end, bucket)
+        return jsonify({
+            'status': 'success',
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'bucket': bucket,
+            'buckets': buckets
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error computing stats: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@bp.route('/api/rolling_stats')
+def api_rolling_stats():
+    """Rolling 7 and 30-day sleep averages ending today"""
+    mode = request.args.get('mode', 'incremental')
+    if mode not in ('incremental', 'recompute'):
+        return jsonify({'status': 'error', 'message': 'Parametr mode musi mieć wartość incremental lub recompute.'}), 400
+    
+    today = get_current_local_time().date()
+    try:
+        windows = rolling_sleep_stats(today) if mode == 'incremental' else recompute_rolling_stats(today)
+        return jsonify({
+            'status': 'success',
+            'today': today.isoformat(),
+            'mode': mode,
+            'windows': windows
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error computing rolling stats: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def parse_page_param(value):
+    """Parse a 1-based ?page= number (default 1), raise ValueError for anything else"""
+    if value is None:
+        return 1
+    page = int(value)
+    if page < 1:
+        raise ValueError(value)
+    return page
+
+@bp.route('/search')
+def search_page():
+    """Search the notes of all records (?q=, ?page=)"""
+    phrase = request.args.get('q', '').strip()
+    try:
+        page = parse_page_param(request.args.get('page'))
+    except ValueError:
+        page = 1
+    try:
+        results, has_more = search_records(phrase, page)
+        return render_template('search.html', phrase=phrase, page=page, results=results, has_more=has_more)
+    except Exception as e:
+        current_app.logger.error(f"Error searching records: {str(e)}")
+        return render_template('error.html', message="Nie udało się wyszukać wpisów.")
+
+@bp.route('/api/search')
+def api_search():
+    """Records whose notes match ?q=, best matches first, with highlighted snippets (?page=)"""
+    phrase = request.args.get('q', '').strip()
+    try:
+        page = parse_page_param(request.args.get('page'))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Parametr page musi być liczbą całkowitą od 1.'}), 400
+    if not search.query_terms(phrase):
+        return jsonify({'status': 'error', 'message': 'Podaj szukane słowa w parametrze q.'}), 400
+
+    try:
+        results, has_more = search_records(phrase, page)
+        return jsonify({
+            'status': 'success',
+            'query': phrase,
+            'page': page,
+            'has_more': has_more,
+            'results': [dict(record_payload(record), snippet=str(snippet)) for record, snippet in results]
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error searching records: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@bp.route('/import', methods=['POST'])
+def import_records():
+    """Bulk import of records from an uploaded CSV/NDJSON file"""
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({'status': 'error', 'message': 'Brak pliku do importu.'}), 400
+    fmt = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    if fmt not in importer.FORMATS:
+        return jsonify({'status': 'error', 'message': 'Obsługiwane formaty to csv i ndjson.'}), 400
+    
+    try:
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        result = import_sleep_records(fmt, lines)
+        return jsonify({
+            'status': 'success',
+            'imported': result['imported'],
+            'rejected_count': len(result['rejected']),
+            # Nie odsyłamy wszystkich błędów przy bardzo dużych plikach
+            'rejected': [
+                {'line': line, 'message': message} for line, message in result['rejected'][:100]
+            ]
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error importing records: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@bp.route('/export.<fmt>')
+def export_records(fmt):
+    """Stream sleep records as CSV or NDJSON"""
+    if fmt not in export.FORMATS:
+        abort(404)
+    try:
+        start = parse_date_param(request.args.get('from'))
+        end = parse_date_param(request.args.get('to'))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Niepoprawny format daty (RRRR-MM-DD).'}), 400
+    
+    # Generator czyta kursor partiami, więc pamięć nie rośnie z rozmiarem tabeli
+    body = stream_with_context(export.chunks(fmt, export_rows(start, end)))
+    return Response(body, mimetype=export.FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename=sleep_records.{fmt}'
+    })
+
+@bp.route('/metrics')
+def metrics():
+    """Expose request, SQL and template metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     """Handle 404 errors"""
     return render_template('error.html', message="Strona nie została znaleziona."), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     """Handle 500 errors"""
     db.session.rollback()
@@ -395,11 +2528,299 @@ def internal_error(error):
 
 def init_db():
     """Initialize the database"""
-    with app.app_context():
-        db.create_all()
+    with _current_app().app_context():
+        prepare_schema(db.engine)
+        upgrade_archive(None, timezones.get_zone(read_time_zone(db.engine)))
+
+def command_tenant_ids(tenant_ids, create=False):
+    """Tenants a CLI command should work on: the given ones, all existing, or [None] outside tenant mode.
+
+    Given tenants must exist unless create is set (flask init-db registers
+    new ones); all existing means every database file and every tenant
+    listed in TENANTS.
+    """
+    if not current_app.config['TENANT_MODE']:
+        if tenant_ids:
+            raise click.UsageError("Opcja --tenant działa tylko w trybie wielu rodzin (TENANT_MODE).")
+        return [None]
+    if tenant_ids:
+        for tenant_id in tenant_ids:
+            if not is_valid_tenant_id(tenant_id):
+                raise click.BadParameter(f"Niepoprawny identyfikator rodziny: {tenant_id}", param_hint='--tenant')
+            if not create and not tenant_exists(tenant_id):
+                raise click.BadParameter(
+                    f"Nie ma rodziny {tenant_id} (dodaj ją: flask init-db --tenant {tenant_id}).", param_hint='--tenant'
+                )
+        return list(tenant_ids)
+    directory = current_app.config['TENANT_DB_DIR']
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    existing = {name[:-3] for name in names if name.endswith('.db') and is_valid_tenant_id(name[:-3])}
+    return sorted(existing | set(current_app.config['TENANTS']))
+
+# Wspólna opcja komend działających na bazach rodzin (patrz command_tenant_ids)
+tenant_option = click.option('--tenant', 'tenant_ids', multiple=True, help='Rodzina (domyślnie wszystkie).')
+
+@bp.cli.command('audit-overlaps')
+@tenant_option
+def audit_overlaps_command(tenant_ids):
+    """List sleep records that overlap earlier records"""
+    found = 0
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        prefix = f"{tenant_id}: " if tenant_id else ''
+        for earlier, later in find_all_overlaps():
+            found += 1
+            click.echo(
+                f"  {prefix}#{later.id} {later.sleep_time:%Y-%m-%d %H:%M}-{later.wake_time:%H:%M} nakłada się na "
+                f"#{earlier.id} {earlier.sleep_time:%Y-%m-%d %H:%M}-{earlier.wake_time:%Y-%m-%d %H:%M}"
+            )
+    if found:
+        click.echo(f"Znaleziono {found} nakładających się wpisów.")
+        raise SystemExit(1)
+    click.echo("Brak nakładających się wpisów.")
+
+@bp.cli.command('archive-records')
+@click.option('--days', type=int, default=None, help='Archiwizuj miesiące starsze niż tyle dni (domyślnie ARCHIVE_AFTER_DAYS).')
+@tenant_option
+def archive_records_command(days, tenant_ids):
+    """Move old sleep records to monthly columnar archive files"""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    before = get_current_local_time().date() - timedelta(days=days)
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        for month, count in archive_records(before).items():
+            prefix = f"{tenant_id}: " if tenant_id else ''
+            click.echo(f"{prefix}{month}: zarchiwizowano {count} wpisów.")
+
+@bp.cli.command('set-time-zone')
+@click.argument('zone_name')
+@tenant_option
+def set_time_zone_command(zone_name, tenant_ids):
+    """Set the time zone of a family (IANA name, e.g. Europe/London)"""
+    if not timezones.is_valid_zone(zone_name):
+        raise click.BadParameter(f"Nieznana strefa czasowa: {zone_name}", param_hint='ZONE_NAME')
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        moved = set_time_zone(zone_name)
+        prefix = f"{tenant_id}: " if tenant_id else ''
+        click.echo(f"{prefix}strefa {zone_name}, {moved} wpisów przypisano do innego dnia.")
+    # Działająca aplikacja czyta strefę z bazy raz na proces
+    click.echo("Uruchom aplikację ponownie, żeby przyjęła nową strefę.")
+
+@bp.cli.command('prune-sync-keys')
+@click.option('--days', type=int, default=30, help='Usuń klucze starsze niż tyle dni.')
+@tenant_option
+def prune_sync_keys_command(days, tenant_ids):
+    """Delete old /api/sync idempotency keys"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        deleted = db.session.execute(delete(SyncKey).where(SyncKey.created_at < cutoff)).rowcount
+        db.session.commit()
+        prefix = f"{tenant_id}: " if tenant_id else ''
+        click.echo(f"{prefix}Usunięto {deleted} kluczy synchronizacji.")
+
+class AppState:
+    """Objects create_app builds from an app's config (app.extensions['sleep_tracker'])"""
+
+    def __init__(self, app):
+        # Pusty cache ma długość 0 - stąd porównanie z None zamiast `or`
+        self.page_cache = app.config.get('PAGE_CACHE_BACKEND')
+        if self.page_cache is None:
+            self.page_cache = LRUCache(app.config['PAGE_CACHE_SIZE'])
+        # Hashe plików statycznych (None = nazwy bez hashy)
+        self.static_assets = None
+        if app.config['STATIC_FINGERPRINTS']:
+            self.static_assets = AssetManifest(app.static_folder, app.config['COMPRESS_MIN_SIZE'])
+        self.read_only_engine = None
+        self.tenant_engines = TenantEngines(
+            _open_tenant_engine,
+            maxsize=app.config['TENANT_ENGINE_CACHE_SIZE'],
+            idle_seconds=app.config['TENANT_ENGINE_IDLE_SECONDS']
+        )
+        self.time_zones = {}
+        self.nap_models = LRUCache(app.config['TENANT_ENGINE_CACHE_SIZE'])
+        self.job_queue = JobQueue(lambda tenant_id: _process_jobs(app, tenant_id), workers=app.config['JOB_WORKERS'])
+        self.resumed_channels = set()
+
+def create_app(config=None):
+    """Create the Flask app: configuration from the environment updated with `config`,
+    the database, views and CLI commands, caches and hashed static files.
+
+    Only configures objects - no connection is opened and no schema is
+    touched until the first query. Every call returns a new app.
+    """
+    app = Flask(__name__)
+    load_config(app)
+    if config:
+        app.config.update(config)
+    if not _is_memory_database(app.config['SQLALCHEMY_DATABASE_URI']):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        })
+    if app.config['TENANT_MODE'] and app.config['SQLITE_READ_ONLY_POOL']:
+        # Bazy rodzin mają tylko silniki do zapisu (patrz RoutingSession.get_bind)
+        app.logger.warning("SQLITE_READ_ONLY_POOL is ignored in TENANT_MODE")
+    db.init_app(app)
+    app.extensions['sleep_tracker'] = AppState(app)
+    app.register_blueprint(bp)
+    app.view_functions['static'] = serve_static
+    before_render_template.connect(_start_template_timer, app)
+    template_rendered.connect(_record_template, app)
+
+    cache_dir = app.config['JINJA_CACHE_DIR']
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        except OSError as e:
+            # Np. system plików tylko do odczytu - szablony będą kompilowane w pamięci
+            app.logger.warning(f"Cannot use Jinja cache directory {cache_dir}: {str(e)}")
+    return app
+
+@bp.cli.command('init-db')
+@tenant_option
+def init_db_command(tenant_ids):
+    """Migrate or create the database schema (run once per deployment); --tenant also adds new families"""
+    if not current_app.config['TENANT_MODE']:
+        command_tenant_ids(tenant_ids)
+        init_db()
+        click.echo("Baza danych gotowa.")
+        return
+    for tenant_id in command_tenant_ids(tenant_ids, create=True):
+        # Otwarcie bazy rodziny tworzy ją albo migruje (patrz _open_tenant_engine)
+        tenant_engines.get(tenant_id)
+        click.echo(f"{tenant_id}: baza danych gotowa.")
+
+@bp.cli.command('precompile-templates')
+def precompile_templates_command():
+    """Compile all templates into the Jinja bytecode cache"""
+    if current_app.jinja_env.bytecode_cache is None:
+        click.echo("Pamięć podręczna szablonów jest wyłączona (JINJA_CACHE_DIR).")
+        raise SystemExit(1)
+    names = current_app.jinja_env.list_templates()
+    for name in names:
+        current_app.jinja_env.get_template(name)
+    click.echo(f"Skompilowano {len(names)} szablonów do {current_app.config['JINJA_CACHE_DIR']}.")
+
+@bp.cli.command('export-records')
+@click.option('--format', 'fmt', type=click.Choice(sorted(export.FORMATS)), default='csv', help='Format eksportu.')
+@click.option('--from', 'start', type=click.DateTime(formats=['%Y-%m-%d']), help='Pierwszy dzień (RRRR-MM-DD).')
+@click.option('--to', 'end', type=click.DateTime(formats=['%Y-%m-%d']), help='Ostatni dzień (RRRR-MM-DD).')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Plik wynikowy (domyślnie stdout).')
+@tenant_option
+def export_records_command(fmt, start, end, output, tenant_ids):
+    """Export sleep records of one family as CSV or NDJSON"""
+    tenant_ids = command_tenant_ids(tenant_ids)
+    if len(tenant_ids) != 1:
+        # Pliki kilku rodzin nie dają się skleić w jeden eksport
+        raise click.UsageError("Eksport obejmuje jedną rodzinę - wybierz ją opcją --tenant.")
+    g.tenant_id = tenant_ids[0]
+    rows = export_rows(start and start.date(), end and end.date())
+    for chunk in export.chunks(fmt, rows):
+        output.write(chunk)
+
+@bp.cli.command('rebuild-summary')
+@click.option('--verify', is_flag=True, help='Tylko sprawdź podsumowania, bez zapisu.')
+@tenant_option
+def rebuild_summary_command(verify, tenant_ids):
+    """Rebuild or verify the daily_sleep_summary table"""
+    broken = False
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        prefix = f"{tenant_id}: " if tenant_id else ''
+        if not verify:
+            days = rebuild_daily_summary()
+            click.echo(f"{prefix}Odbudowano podsumowania dla {days} dni.")
+            continue
+        mismatched = verify_daily_summary()
+        if mismatched:
+            broken = True
+            click.echo(f"{prefix}Niezgodne podsumowania dla {len(mismatched)} dni:")
+            for day in mismatched:
+                click.echo(f"  {day.isoformat()}")
+        else:
+            click.echo(f"{prefix}Podsumowania dzienne są zgodne z wpisami.")
+    if broken:
+        raise SystemExit(1)
+
+@bp.cli.command('backtest-naps')
+@click.option('--count', type=int, default=3000, help='Liczba wpisów wygenerowanej historii.')
+@click.option('--seed', type=int, default=0, help='Ziarno generatora historii.')
+@click.option('--half-life', type=float, default=None, help='Okres połowicznego zaniku wag w dniach (domyślnie NAP_MODEL_HALF_LIFE_DAYS).')
+def backtest_naps_command(count, seed, half_life):
+    """Score the next-nap prediction on a seeded synthetic history"""
+    import synthetic_history
+    half_life = current_app.config['NAP_MODEL_HALF_LIFE_DAYS'] if half_life is None else half_life
+    records = [
+        (sleep_time, wake_time, classify_sleep(sleep_time, wake_time)[1])
+        for sleep_time, wake_time, _, _ in synthetic_history.generate_history(count, seed)
+    ]
+    result = prediction.backtest(records, half_life)
+    click.echo(
+        f"Prognozowano {result['predicted']} z {result['naps']} drzemek: "
+        f"średni błąd {result['mae_minutes']} min (mediana {result['median_error_minutes']} min), "
+        f"w przedziale {result['coverage']:.0%}; "
+        f"średnia wszystkich okien bez pory dnia: {result['baseline_mae_minutes']} min."
+    )
+
+@bp.cli.command('rolling-stats')
+@click.option('--verify', is_flag=True, help='Porównaj stan przyrostowy z pełnym przeliczeniem z wpisów.')
+@tenant_option
+def rolling_stats_command(verify, tenant_ids):
+    """Show or verify the rolling 7 and 30-day averages"""
+    broken = False
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        prefix = f"{tenant_id}: " if tenant_id else ''
+        # Dzisiejsza data w strefie danej rodziny
+        today = get_current_local_time().date()
+        windows = rolling_sleep_stats(today)
+        if not verify:
+            for window in windows:
+                click.echo(
+                    f"{prefix}{window['days']} dni: sen {window['avg_total_sleep_seconds'] / 3600:.1f} h/dzień, "
+                    f"drzemki {window['avg_nap_count']}/dzień, okno aktywności {window['avg_wake_window_seconds']} s, "
+                    f"ocena nocy {window['avg_sleep_rating']}"
+                )
+            continue
+        recomputed = recompute_rolling_stats(today)
+        if windows != recomputed:
+            broken = True
+            click.echo(f"{prefix}Średnie kroczące różnią się od pełnego przeliczenia (napraw: flask rebuild-summary):")
+            for incremental, expected in zip(windows, recomputed):
+                click.echo(f"  {incremental['days']} dni: {incremental} != {expected}")
+        else:
+            click.echo(f"{prefix}Średnie kroczące są zgodne z pełnym przeliczeniem.")
+    if broken:
+        raise SystemExit(1)
+
+@bp.cli.command('rebuild-search')
+@click.option('--verify', is_flag=True, help='Tylko sprawdź indeks, bez zapisu.')
+@tenant_option
+def rebuild_search_command(verify, tenant_ids):
+    """Rebuild or verify the full-text index of record notes"""
+    broken = False
+    for tenant_id in command_tenant_ids(tenant_ids):
+        g.tenant_id = tenant_id
+        prefix = f"{tenant_id}: " if tenant_id else ''
+        if verify:
+            ok = verify_search_index()
+            broken = broken or not ok
+            click.echo(f"{prefix}Indeks wyszukiwania {'jest zgodny z wpisami' if ok else 'wymaga odbudowy'}.")
+        else:
+            click.echo(f"{prefix}Zaindeksowano notatki {rebuild_search_index()} wpisów.")
+    if broken:
+        raise SystemExit(1)
+
+# Aplikacja WSGI (gunicorn app:app, asgi.py, flask CLI)
+app = create_app()
 
 if __name__ == '__main__':
-    init_db()
+    if app.config['INIT_DB_ON_STARTUP']:
+        init_db()
     app.run(
         host='0.0.0.0',
         port=int(os.getenv('PORT', 5000)),
@@ -0,0 +1,307 @@
+"""Columnar archive files for old sleep records.
+
+Each file holds one month of records (by attribution day) as contiguous
+NumPy columns: sleep times as UTC epoch seconds (like sleep_records),
+ratings as small integers, notes as one UTF-8 blob with offsets. Files are
+read with memory mapping, so only the columns a caller touches are paged in.
+Readers convert times to the family's current zone, so changing it does not
+shift archived instants and the repeated hour keeps its fold.
+"""
+import json
+import os
+import struct
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import timezones
+
+MAGIC = b'SLPARCH2'
+# Pierwsza wersja trzymała lokalny czas rodziny w mikrosekundach (patrz upgrade_directory)
+_LOCAL_TIME_MAGIC = b'SLPARCH1'
+SUFFIX = '.col'
+_ALIGN = 8
+# Brak oceny / brak daty utworzenia
+NO_RATING = -1
+NO_TIME = np.iinfo(np.int64).min
+
+COLUMNS = {
+    'id': np.int64,
+    'sleep_time': np.int64,  # Sekundy UTC od epoki, jak w sleep_records
+    'wake_time': np.int64,
+    'duration_seconds': np.int32,
+    'is_nap': np.uint8,
+    'day': np.int32,  # Dni od 1970-01-01
+    'sleep_rating': np.int8,
+    'is_rated': np.uint8,
+    'created_at': np.int64,  # Mikrosekundy od epoki (created_at jest w UTC bez strefy)
+}
+
+
+def month_of(day):
+    """Archive month ('YYYY-MM') of an attribution day"""
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def month_path(directory, month):
+    return os.path.join(directory, month + SUFFIX)
+
+
+def list_months(directory):
+    """Sorted months that have an archive file in directory"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(SUFFIX)] for name in os.listdir(directory) if name.endswith(SUFFIX))
+
+
+def _epoch_microseconds(value):
+    return NO_TIME if value is None else int(np.datetime64(value, 'us').astype(np.int64))
+
+
+def columns_from_rows(rows):
+    """Build archive columns from row mappings with sleep_records columns, times as stored (UTC epoch seconds)"""
+    rows = list(rows)
+    columns = {
+        'id': [row['id'] for row in rows],
+        'sleep_time': [row['sleep_time'] for row in rows],
+        'wake_time': [row['wake_time'] for row in rows],
+        'duration_seconds': [row['duration_seconds'] for row in rows],
+        'is_nap': [row['is_nap'] for row in rows],
+        'day': [(row['day'] - date(1970, 1, 1)).days for row in rows],
+        'sleep_rating': [NO_RATING if row['sleep_rating'] is None else row['sleep_rating'] for row in rows],
+        'is_rated': [bool(row['is_rated']) for row in rows],
+        'created_at': [_epoch_microseconds(row['created_at']) for row in rows],
+    }
+    columns = {name: np.array(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+    columns['notes'] = [row['notes'] or '' for row in rows]
+    return columns
+
+
+def merge(old, new):
+    """Combine two sets of columns; rows of `new` replace rows of `old` with the same id.
+
+    The result is ordered by day and sleep time, like exports.
+    """
+    keep = ~np.isin(old['id'], new['id'])
+    merged = {name: np.concatenate([np.asarray(old[name])[keep], new[name]]) for name in COLUMNS}
+    notes = [note for note, kept in zip(old['notes'], keep) if kept] + list(new['notes'])
+    order = np.lexsort((merged['sleep_time'], merged['day']))
+    merged = {name: values[order] for name, values in merged.items()}
+    merged['notes'] = [notes[i] for i in order]
+    return merged
+
+
+def upgrade_directory(directory, zone):
+    """Rewrite month files of the first format (local times) with UTC epoch seconds; returns upgraded months.
+
+    Local times are read in `zone`, the family's zone when they were
+    written; the repeated hour of a clock change was not kept apart by
+    that format, so it is taken as its first occurrence. Each file is
+    replaced atomically, so an interrupted run only needs to be repeated.
+    """
+    upgraded = []
+    for month in list_months(directory):
+        path = month_path(directory, month)
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != _LOCAL_TIME_MAGIC:
+                continue
+        columns = MonthArchive(path, magic=_LOCAL_TIME_MAGIC).columns()
+        for name in ('sleep_time', 'wake_time'):
+            columns[name] = np.array(
+                [timezones.to_epoch(_to_datetime(value), zone) for value in columns[name].tolist()], dtype=np.int64
+            )
+        write_month(path, columns)
+        upgraded.append(month)
+    return upgraded
+
+
+def write_month(path, columns):
+    """Write columns to path atomically (temporary file + rename)"""
+    encoded = [note.encode('utf-8') for note in columns['notes']]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(note) for note in encoded])
+    arrays = [(name, np.ascontiguousarray(columns[name], dtype=dtype)) for name, dtype in COLUMNS.items()]
+    arrays += [('notes_offsets', offsets), ('notes', np.frombuffer(b''.join(encoded), dtype=np.uint8))]
+
+    header = {'count': len(encoded), 'columns': {}}
+    offset = 0
+    for name, array in arrays:
+        header['columns'][name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 4 + len(header_bytes)) // _ALIGN) * _ALIGN
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for name, array in arrays:
+            f.seek(data_start + header['columns'][name][1])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def month_days(month):
+    """First and last day of an archive month"""
+    first = date(int(month[:4]), int(month[5:]), 1)
+    following = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return first, following - timedelta(days=1)
+
+
+def window_rows(directory, low, high):
+    """Archived rows needed for wake windows around sleep times low..high (UTC epoch seconds).
+
+    Returns (previous, rows, following): rows sleeping in low..high and the
+    nearest rows before and after them (or None), all as (sleep_time,
+    wake_time, day, id) with times as UTC epoch seconds. Only months that
+    can hold such rows are opened.
+    """
+    # Wpisy miesiąca zaczynają się najwcześniej dzień przed nim (sen nocny) i kończą w ostatnim dniu;
+    # dzień lokalny różni się od dnia UTC najwyżej o jeden
+    low_day = date.fromordinal(_EPOCH_ORDINAL + low // 86400 - 1)
+    high_day = date.fromordinal(_EPOCH_ORDINAL + high // 86400 + 1)
+    before, inside, after = [], [], []
+    for month in list_months(directory):
+        first, last = month_days(month)
+        if last < low_day:
+            before.append(month)
+        elif first - timedelta(days=1) > high_day:
+            after.append(month)
+        else:
+            inside.append(month)
+
+    rows, previous, following = [], [], []
+    for month in before[-2:] + inside + after[:2]:
+        archive = MonthArchive(month_path(directory, month))
+        sleep_times = archive.column('sleep_time')
+        selected = [np.flatnonzero((sleep_times >= low) & (sleep_times <= high))]
+        earlier = np.flatnonzero(sleep_times < low)
+        later = np.flatnonzero(sleep_times > high)
+        # Najbliższe wpisy przed i po zakresie (przy równym czasie liczy się id)
+        if len(earlier):
+            selected.append(earlier[sleep_times[earlier] == sleep_times[earlier].max()])
+        if len(later):
+            selected.append(later[sleep_times[later] == sleep_times[later].min()])
+        for row in archive.window_rows(np.concatenate(selected)):
+            if row[0] < low:
+                previous.append(row)
+            elif row[0] > high:
+                following.append(row)
+            else:
+                rows.append(row)
+    key = lambda row: (row[0], row[3])
+    return max(previous, key=key, default=None), rows, min(following, key=key, default=None)
+
+
+class MonthArchive:
+    """Read-only, memory-mapped view of one archive file"""
+
+    def __init__(self, path, magic=MAGIC):
+        self.path = path
+        with open(path, 'rb') as f:
+            found = f.read(len(MAGIC))
+            if found == _LOCAL_TIME_MAGIC and magic == MAGIC:
+                raise ValueError(f"Archive file in the old format (run flask init-db to upgrade it): {path}")
+            if found != magic:
+                raise ValueError(f"Not an archive file: {path}")
+            header_size, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_size))
+        self.count = header['count']
+        self._columns = header['columns']
+        self._data_start = -(-(len(MAGIC) + 4 + header_size) // _ALIGN) * _ALIGN
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        dtype, offset, length = self._columns[name]
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=self._data_start + offset, shape=(length,))
+
+    def latest_wake(self, zone):
+        """Latest wake time in the file as local time in zone (records of later months wake after it)"""
+        return timezones.from_epoch(int(self.column('wake_time').max()), zone)
+
+    def notes(self):
+        offsets = self.column('notes_offsets')
+        blob = self.column('notes').tobytes()
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(self.count)]
+
+    def columns(self):
+        """All columns loaded into memory, e.g. to merge with new rows"""
+        columns = {name: np.array(self.column(name)) for name in COLUMNS}
+        columns['notes'] = self.notes()
+        return columns
+
+    def _day_mask(self, start, end):
+        days = self.column('day')
+        mask = np.ones(self.count, dtype=bool)
+        if start:
+            mask &= days >= _day_number(start)
+        if end:
+            mask &= days <= _day_number(end)
+        return mask
+
+    def stats_columns(self, start=None, end=None):
+        """Columns in the form stats.aggregate takes, times as UTC epoch seconds"""
+        mask = self._day_mask(start, end)
+        ratings = self.column('sleep_rating')[mask].astype(float)
+        ratings[ratings == NO_RATING] = np.nan
+        return (
+            self.column('sleep_time')[mask].astype(np.int64),
+            self.column('wake_time')[mask].astype(np.int64),
+            self.column('duration_seconds')[mask].astype(np.int64),
+            self.column('is_nap')[mask].astype(bool),
+            self.column('day')[mask].astype('datetime64[D]'),
+            ratings,
+        )
+
+    def window_rows(self, indexes=slice(None)):
+        """(sleep_time, wake_time, day, id) of the rows at indexes (default all), times as UTC epoch seconds"""
+        columns = [self.column(name)[indexes].tolist() for name in ('sleep_time', 'wake_time', 'day', 'id')]
+        return [
+            (sleep_time, wake_time, date.fromordinal(_EPOCH_ORDINAL + day), record_id)
+            for sleep_time, wake_time, day, record_id in zip(*columns)
+        ]
+
+    def rows(self, zone, start=None, end=None):
+        """Yield records as row mappings with sleep_records columns (times local in zone), optionally limited to days"""
+        indexes = np.flatnonzero(self._day_mask(start, end))
+        if not len(indexes):
+            return
+        offsets = self.column('notes_offsets')
+        blob = self.column('notes')
+        values = {name: self.column(name)[indexes].tolist() for name in COLUMNS}
+        for position, i in enumerate(indexes):
+            row = {name: values[name][position] for name in COLUMNS}
+            rating = row['sleep_rating']
+            yield {
+                'id': row['id'],
+                'sleep_time': timezones.from_epoch(row['sleep_time'], zone),
+                'wake_time': timezones.from_epoch(row['wake_time'], zone),
+                'notes': blob[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8'),
+                'sleep_rating': None if rating == NO_RATING else rating,
+                'is_rated': bool(row['is_rated']),
+                'created_at': _to_datetime(row['created_at']),
+                'duration_seconds': row['duration_seconds'],
+                'is_nap': bool(row['is_nap']),
+                'day': date.fromordinal(_EPOCH_ORDINAL + row['day']),
+            }
+
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+
+def _day_number(day):
+    return day.toordinal() - _EPOCH_ORDINAL
+
+
+def _to_datetime(microseconds):
+    if microseconds == NO_TIME:
+        return None
+    return _EPOCH + timedelta(microseconds=microseconds)
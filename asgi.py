@@ -0,0 +1,216 @@
+"""ASGI entry point: async JSON API for naps, with the Flask pages mounted as WSGI.
+
+The endpoints script.js calls most often (start, stop, list, rate) are
+Starlette handlers on a pool of aiosqlite connections, so a request
+waiting for the database holds no thread and one process can keep
+thousands of requests in flight. The handlers run the same functions as
+the Flask routes (begin_nap, finish_nap, ...) through SQLAlchemy's
+run_sync, so the schema, nap/night classification, daily summaries,
+caches and SSE events are shared. Everything else goes to Flask.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+import os
+import time
+from collections import OrderedDict
+
+from a2wsgi import WSGIMiddleware
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as app_module
+from app import REQUEST_SECONDS, REQUESTS_TOTAL, app as flask_app, db, metrics_registry
+from assets import accepted_encoding, compress
+from tenants import is_valid_tenant_id
+
+IN_FLIGHT = metrics_registry.gauge(
+    'sleep_tracker_async_requests_in_flight', 'Async API requests being handled right now'
+)
+IN_FLIGHT_PEAK = metrics_registry.gauge(
+    'sleep_tracker_async_requests_in_flight_peak', 'Most async API requests handled at once since start'
+)
+
+
+class AsyncDatabase:
+    """Async engine of one SQLite file with a lock that queues this process's writes"""
+
+    def __init__(self, url, write_lock):
+        url = make_url(url)
+        if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+            raise RuntimeError(f"Async API needs an SQLite database file, got {url}")
+        self.engine = create_async_engine(
+            url.set(drivername='sqlite+aiosqlite'),
+            pool_size=flask_app.config['ASYNC_POOL_SIZE'],
+            max_overflow=0,
+            pool_timeout=flask_app.config['ASYNC_POOL_TIMEOUT'],
+        )
+        event.listen(self.engine.sync_engine, 'connect', _apply_pragmas)
+        # SQLite i tak zapisuje pojedynczo - czekanie w kolejce nie blokuje wątku ani nie kończy się "database is locked"
+        self.write_lock = write_lock
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    app_module.set_sqlite_pragmas(dbapi_connection)
+
+
+# Bazy otwarte w tym procesie: None dla jednej bazy, id rodziny w trybie wielu rodzin
+_databases = OrderedDict()
+# Blokady zapisu przeżywają usunięcie bazy z _databases - żądania w toku mogą jeszcze trzymać
+# starą AsyncDatabase, a nowa nie może dopuścić drugiego równoległego zapisu do tego samego pliku
+_write_locks = {}
+
+
+async def get_database(tenant_id):
+    """Return the async database of a tenant (None outside tenant mode), opening it on first use"""
+    database = _databases.get(tenant_id)
+    if database is None:
+        if tenant_id is None:
+            url = flask_app.config['SQLALCHEMY_DATABASE_URI']
+        else:
+            # Otwarcie przez Flask tworzy lub migruje schemat bazy rodziny
+            await asyncio.to_thread(app_module.tenant_engines.get, tenant_id)
+            url = f"sqlite:///{os.path.join(flask_app.config['TENANT_DB_DIR'], tenant_id)}.db"
+        database = _databases.get(tenant_id)
+        if database is None:
+            write_lock = _write_locks.setdefault(tenant_id, asyncio.Lock())
+            database = _databases[tenant_id] = AsyncDatabase(url, write_lock)
+    _databases.move_to_end(tenant_id)
+    while len(_databases) > flask_app.config['TENANT_ENGINE_CACHE_SIZE']:
+        _, evicted = _databases.popitem(last=False)
+        await evicted.engine.dispose()
+    return database
+
+
+async def dispose_databases():
+    while _databases:
+        _, database = _databases.popitem()
+        await database.engine.dispose()
+    # Przy zamykaniu nie ma już żądań w toku; blokady są związane z pętlą zdarzeń, która się kończy
+    _write_locks.clear()
+
+
+def _run_bound(connection, function, args):
+    # Cała obsługa żądania (sesja, zdarzenia sesji, commit) działa na połączeniu z puli aiosqlite
+    g.db_connection = connection
+    try:
+        return function(*args)
+    finally:
+        db.session.remove()
+        g.db_connection = None
+
+
+async def call(request, route, function, *args, write=False):
+    """Run an app function returning (payload, status) for the request's tenant and answer with JSON"""
+    started = time.perf_counter()
+    IN_FLIGHT.inc()
+    if IN_FLIGHT.value() > IN_FLIGHT_PEAK.value():
+        IN_FLIGHT_PEAK.set(IN_FLIGHT.value())
+    try:
+        tenant_id = None
+        if flask_app.config['TENANT_MODE']:
+            tenant_id = (request.headers.get('X-Tenant-ID') or request.query_params.get('tenant')
+                         or request.cookies.get('tenant'))
+            if not is_valid_tenant_id(tenant_id):
+                payload, status = {'status': 'error', 'message': 'Nie wybrano rodziny.'}, 400
+                return json_response(request, payload, status)
+            if not app_module.tenant_exists(tenant_id):
+                payload, status = {'status': 'error', 'message': 'Nie ma takiej rodziny.'}, 404
+                return json_response(request, payload, status)
+        database = await get_database(tenant_id)
+        app_module.resume_jobs(tenant_id)
+        with flask_app.app_context():
+            g.tenant_id = tenant_id
+            async with database.write_lock if write else contextlib.nullcontext():
+                async with database.engine.connect() as connection:
+                    payload, status = await connection.run_sync(_run_bound, function, args)
+    except Exception as e:
+        flask_app.logger.error(f"Error in async API {route}: {str(e)}")
+        payload, status = {'status': 'error', 'message': str(e)}, 500
+    finally:
+        IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method)
+    REQUESTS_TOTAL.inc(route, request.method, str(status))
+    return json_response(request, payload, status)
+
+
+def json_response(request, payload, status=200):
+    """JSON response compressed like the Flask responses (see app.compress_response)"""
+    response = JSONResponse(payload, status_code=status)
+    if not flask_app.config['COMPRESS_RESPONSES']:
+        return response
+    response.headers['Vary'] = 'Accept-Encoding'
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None or len(response.body) < flask_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.body = compress(response.body, encoding, flask_app.config['COMPRESS_LEVEL'])
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(response.body))
+    return response
+
+
+async def json_body(request):
+    """Request body as a dict, empty for a missing or malformed body"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def start_nap(request):
+    return await call(request, 'start_nap', app_module.begin_nap, write=True)
+
+
+async def stop_nap(request):
+    return await call(request, 'stop_nap', app_module.finish_nap, await json_body(request), write=True)
+
+
+def _active_nap():
+    return dict(app_module.active_nap_state(), status='success'), 200
+
+
+async def active_nap(request):
+    return await call(request, 'active_nap', _active_nap)
+
+
+async def list_naps(request):
+    try:
+        # Domyślny dzień wylicza list_day_records - dopiero tam znana jest rodzina i jej strefa czasowa
+        day = app_module.parse_date_param(request.query_params.get('date'))
+    except ValueError:
+        return json_response(request, {'status': 'error', 'message': 'Niepoprawny format daty (RRRR-MM-DD).'}, 400)
+    return await call(request, 'api_naps', app_module.list_day_records, day)
+
+
+async def rate_nap(request):
+    data = await json_body(request)
+    return await call(request, 'api_rate_nap', app_module.rate_record, request.path_params['record_id'],
+                      data.get('rating'), write=True)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    if flask_app.config['INIT_DB_ON_STARTUP']:
+        await asyncio.to_thread(app_module.init_db)
+    yield
+    await dispose_databases()
+
+
+application = Starlette(
+    routes=[
+        Route('/start_nap', start_nap, methods=['POST']),
+        Route('/stop_nap', stop_nap, methods=['POST']),
+        Route('/active_nap', active_nap, methods=['GET']),
+        Route('/api/naps', list_naps, methods=['GET']),
+        Route('/api/naps/{record_id:int}/rate', rate_nap, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=flask_app.config['ASYNC_WSGI_THREADS'])),
+    ],
+    lifespan=lifespan,
+)
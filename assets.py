@@ -0,0 +1,117 @@
+"""Fingerprinted static assets and response compression.
+
+At startup every file in the static folder is read once, hashed and
+compressed. url_for('static', filename='style.css') then points to
+style.<hash>.css, which can be cached by browsers forever - a changed file
+gets a new name. Brotli is used when the `brotli` package is installed,
+gzip otherwise.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:  # Opcjonalne - bez niego kompresujemy tylko gzipem
+    brotli = None
+
+# Kolejność preferencji, gdy klient akceptuje kilka kodowań
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Odpowiedzi, które warto kompresować (obrazy, archiwa itp. są już skompresowane)
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript', 'text/javascript')
+
+HASH_LENGTH = 12
+
+
+def accepted_encoding(accept_encoding):
+    """Best encoding from ENCODINGS allowed by an Accept-Encoding header, None for identity"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, level=6):
+    """Compress bytes with 'br' or 'gzip'"""
+    if encoding == 'br':
+        # Jakość brotli 0-11, poziom gzip 1-9 - mapujemy liniowo
+        return brotli.compress(data, quality=min(11, round(level * 11 / 9)))
+    # mtime=0 - te same dane dają te same bajty (stabilne ETagi)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def fingerprinted_name(filename, digest):
+    """style.css -> style.<digest>.css"""
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+class Asset:
+    """A static file with its content, hash and pre-compressed variants"""
+
+    def __init__(self, filename, data, min_size=0):
+        self.filename = filename
+        self.digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        self.url_name = fingerprinted_name(filename, self.digest)
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.variants = {None: data}
+        if is_compressible(self.mimetype) and len(data) >= min_size:
+            for encoding in ENCODINGS:
+                compressed = compress(data, encoding, level=9)
+                # Nie wysyłaj wersji skompresowanej, jeśli nic nie zyskujemy
+                if len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+
+    def body(self, accept_encoding):
+        """Return (encoding, bytes) of the best variant for an Accept-Encoding header"""
+        encoding = accepted_encoding(accept_encoding)
+        if encoding in self.variants:
+            return encoding, self.variants[encoding]
+        return None, self.variants[None]
+
+
+class AssetManifest:
+    """Hashed names of all files in a static folder, built once at startup"""
+
+    def __init__(self, folder, min_size=0):
+        self.folder = folder
+        self.by_filename = {}
+        self.by_url_name = {}
+        if not folder or not os.path.isdir(folder):
+            return
+        for root, _, names in os.walk(folder):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = Asset(filename, f.read(), min_size)
+                self.by_filename[filename] = asset
+                self.by_url_name[asset.url_name] = asset
+
+    def url_name(self, filename):
+        """Fingerprinted name of a static file, or the name itself for unknown files"""
+        asset = self.by_filename.get(filename)
+        return asset.url_name if asset is not None else filename
+
+    def lookup(self, url_name):
+        return self.by_url_name.get(url_name)
+
+    def __len__(self):
+        return len(self.by_filename)
@@ -0,0 +1,55 @@
+"""In-process publish/subscribe for Server-Sent Events.
+
+Each channel (one per tenant) has a set of subscriber queues. Events only
+reach clients connected to the same process, so stream handlers should
+also re-check the database state on every heartbeat.
+"""
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class EventBroker:
+    """Fan-out of events to every subscriber of a channel"""
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._channels[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._channels[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Klient nie odbiera zdarzeń - pomijamy je, stan i tak przyjdzie z kolejnym heartbeatem
+                pass
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._channels.get(channel, ()))
+
+
+def format_sse(data, event=None):
+    """Format a dict as a Server-Sent Events message"""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
@@ -0,0 +1,70 @@
+"""Serialization of sleep records for CSV and NDJSON exports.
+
+Functions here turn an iterable of row mappings into an iterable of text
+chunks, so exports can be streamed without holding the table in memory.
+"""
+import csv
+import io
+import json
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+COLUMNS = (
+    'id', 'sleep_time', 'wake_time', 'day', 'sleep_duration', 'duration_seconds',
+    'type', 'notes', 'sleep_rating', 'is_rated', 'created_at',
+)
+
+
+def serialize_row(row):
+    """Return an export dict for a row with sleep_records columns"""
+    return {
+        'id': row['id'],
+        'sleep_time': row['sleep_time'].isoformat(),
+        'wake_time': row['wake_time'].isoformat(),
+        'day': row['day'].isoformat(),
+        'sleep_duration': round(row['duration_seconds'] / 3600, 2),
+        'duration_seconds': row['duration_seconds'],
+        'type': 'nap' if row['is_nap'] else 'night',
+        'notes': row['notes'] or '',
+        'sleep_rating': row['sleep_rating'],
+        'is_rated': bool(row['is_rated']),
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+    }
+
+
+def csv_chunks(rows, chunk_size=1000):
+    """Yield CSV text for the header and rows, chunk_size rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(serialize_row(row))
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, chunk_size=1000):
+    """Yield one JSON object per line, chunk_size rows at a time"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(serialize_row(row), ensure_ascii=False))
+        if len(lines) == chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def chunks(fmt, rows):
+    """Dispatch to the serializer for the given format"""
+    if fmt == 'csv':
+        return csv_chunks(rows)
+    if fmt == 'ndjson':
+        return ndjson_chunks(rows)
+    raise ValueError(f"Unknown export format: {fmt}")
@@ -0,0 +1,47 @@
+import argparse
+import os
+
+from flask import g
+
+from app import app, import_sleep_records, tenant_exists
+from tenants import is_valid_tenant_id
+import importer
+
+def main():
+    """Import wpisów snu z pliku CSV/NDJSON (np. eksportu z innej aplikacji)"""
+    parser = argparse.ArgumentParser(description="Import wpisów snu z pliku CSV lub NDJSON.")
+    parser.add_argument('path', help="Ścieżka do pliku z wpisami")
+    parser.add_argument('--format', choices=importer.FORMATS, help="Format pliku (domyślnie z rozszerzenia)")
+    parser.add_argument('--tenant', help="Rodzina, do której importujemy (tryb TENANT_MODE)")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Liczba wpisów zapisywanych w jednej transakcji")
+    args = parser.parse_args()
+    
+    fmt = args.format or os.path.splitext(args.path)[1].lstrip('.').lower()
+    if fmt not in importer.FORMATS:
+        print(f"Nieznany format pliku: {fmt or '(brak rozszerzenia)'}")
+        return
+    
+    # Błędy opcji kończą się kodem 2 (parser.error) - bez rodziny wpisy trafiłyby do złej bazy
+    if args.tenant and not app.config['TENANT_MODE']:
+        parser.error("--tenant działa tylko w trybie wielu rodzin (TENANT_MODE)")
+    if app.config['TENANT_MODE'] and not args.tenant:
+        parser.error("w trybie wielu rodzin (TENANT_MODE) podaj rodzinę: --tenant")
+    if args.tenant and not is_valid_tenant_id(args.tenant):
+        parser.error(f"niepoprawny identyfikator rodziny: {args.tenant}")
+    if args.tenant and not tenant_exists(args.tenant):
+        parser.error(f"nie ma rodziny {args.tenant} (dodaj ją: flask init-db --tenant {args.tenant})")
+    
+    print(f"Importuję wpisy z {args.path}...")
+    with open(args.path, encoding='utf-8', newline='') as lines, app.app_context():
+        if args.tenant:
+            g.tenant_id = args.tenant
+        result = import_sleep_records(fmt, lines, batch_size=args.batch_size)
+    
+    print(f"Zaimportowano {result['imported']} wpisów.")
+    if result['rejected']:
+        print(f"Odrzucono {len(result['rejected'])} wierszy:")
+        for line, message in result['rejected']:
+            print(f"  wiersz {line}: {message}")
+
+if __name__ == "__main__":
+    main()
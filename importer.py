@@ -0,0 +1,76 @@
+"""Parsing of CSV/NDJSON files with sleep records for bulk imports.
+
+Rows are parsed lazily one line at a time, so files of any size can be
+imported with constant memory. Accepts the files produced by export.py.
+"""
+import csv
+import json
+
+import timezones
+
+FORMATS = ('csv', 'ndjson')
+
+
+def iter_raw_rows(fmt, lines):
+    """Yield (line_number, dict or error message) for every data row"""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, "Niepoprawny JSON."
+                continue
+            if not isinstance(row, dict):
+                yield line_number, "Wiersz musi być obiektem JSON."
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+def parse_row(row, tz):
+    """Validate a raw row, returns (sleep_time, wake_time, notes, rating).
+
+    Raises ValueError with a user-facing message for invalid rows.
+    """
+    # W NDJSON pola mogą mieć dowolny typ JSON - inne niż tekst (i liczba w ocenie) odrzucamy
+    try:
+        sleep_time = timezones.parse_local(row['sleep_time'], tz)
+        wake_time = timezones.parse_local(row['wake_time'], tz)
+    except KeyError as e:
+        raise ValueError(f"Brak kolumny {e.args[0]}.")
+    except ValueError:
+        raise ValueError("Niepoprawny format czasu.")
+
+    if timezones.seconds_between(sleep_time, wake_time, tz) <= 0:
+        raise ValueError("Czas pobudki musi być późniejszy niż czas zaśnięcia.")
+
+    notes = row.get('notes')
+    if notes is None:
+        notes = ''
+    elif not isinstance(notes, str):
+        raise ValueError("Notatka musi być tekstem.")
+    notes = notes.strip()
+    if len(notes) > 200:
+        raise ValueError("Notatka może mieć najwyżej 200 znaków.")
+
+    rating = row.get('sleep_rating')
+    if rating in (None, ''):
+        rating = None
+    elif isinstance(rating, bool) or not isinstance(rating, (int, str)):
+        raise ValueError("Ocena musi być liczbą.")
+    else:
+        try:
+            rating = int(rating)
+        except (TypeError, ValueError):
+            raise ValueError("Ocena musi być liczbą.")
+        if not 1 <= rating <= 5:
+            raise ValueError("Ocena musi być w zakresie 1-5.")
+
+    return sleep_time, wake_time, notes, rating
@@ -0,0 +1,115 @@
+"""In-process runner for background jobs persisted in the database.
+
+Jobs themselves live in a table written in the same transaction as the
+change that needs them, so nothing is lost when the process stops. This
+module only decides when to look at that table: JobQueue runs
+`process(channel)` (one channel per database) on a small thread pool
+after a commit, again when a retry is due, and never twice at once for
+the same channel.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_SCHEDULED, _RUNNING, _RERUN = 'scheduled', 'running', 'rerun'
+
+
+def retry_delay(attempts, base_seconds=1.0, max_seconds=300.0):
+    """Exponential backoff: base, 2*base, 4*base, ... capped at max_seconds"""
+    return min(max_seconds, base_seconds * 2 ** max(attempts - 1, 0))
+
+
+class JobQueue:
+    """Runs process(channel) on a thread pool whenever a channel may have due jobs.
+
+    process returns the number of seconds until its next job is due, or
+    None when nothing is left. A submit while the channel is running
+    schedules exactly one more run after it, so bursts of writes coalesce.
+    """
+
+    def __init__(self, process, workers=2):
+        self.process = process
+        self.workers = workers
+        self._executor = None
+        self._states = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(self, channel, delay=0):
+        if delay > 0:
+            self._submit_later(channel, delay)
+            return
+        with self._lock:
+            state = self._states.get(channel)
+            if state == _RUNNING:
+                self._states[channel] = _RERUN
+                return
+            if state is not None:
+                return
+            self._states[channel] = _SCHEDULED
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='jobs')
+            executor = self._executor
+        executor.submit(self._run, channel)
+
+    def _submit_later(self, channel, delay):
+        timer = threading.Timer(delay, self._fire_timer, (channel,))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get(channel)
+            if previous is not None:
+                previous.cancel()
+            self._timers[channel] = timer
+        timer.start()
+
+    def _fire_timer(self, channel):
+        with self._lock:
+            self._timers.pop(channel, None)
+        self.submit(channel)
+
+    def _run(self, channel):
+        with self._lock:
+            self._states[channel] = _RUNNING
+        delay = None
+        try:
+            delay = self.process(channel)
+        except Exception:
+            # Np. baza chwilowo niedostępna - zadania czekają w tabeli na kolejne uruchomienie
+            logger.exception("Background jobs of %r failed", channel)
+        finally:
+            with self._lock:
+                rerun = self._states.pop(channel) == _RERUN
+                if rerun:
+                    self._states[channel] = _SCHEDULED
+                else:
+                    self._idle.notify_all()
+            if rerun:
+                self._executor.submit(self._run, channel)
+        if delay is not None:
+            self.submit(channel, delay)
+
+    def depth(self):
+        """Channels scheduled or running right now"""
+        with self._lock:
+            return len(self._states)
+
+    def drain(self, timeout=None):
+        """Wait until no channel is scheduled or running (retries waiting for their time don't count).
+
+        Returns False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._states, timeout)
+
+    def shutdown(self):
+        with self._lock:
+            timers = list(self._timers.values())
+            self._timers.clear()
+            executor, self._executor = self._executor, None
+        for timer in timers:
+            timer.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -1,52 +1,661 @@
-import sqlite3
+"""Wersjonowane migracje bazy danych SQLite.
+
+Każda migracja ma numer wersji zapisywany w tabeli schema_version, więc
+uruchamiana jest tylko raz. Uzupełnianie danych (backfill) idzie porcjami
+w krótkich transakcjach, a postęp trafia do tabeli migration_progress -
+aplikacja może w tym czasie zapisywać (np. stop_nap), a przerwaną
+migrację wystarczy uruchomić ponownie.
+
+    python migrate_db.py                  # baza z DATABASE_URL
+    python migrate_db.py --database plik.db --chunk-size 1000
+    python migrate_db.py --status
+"""
+import argparse
+import itertools
 import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
+
+import analytics
+import search
+import timezones
+
+# Względne ścieżki sqlite:/// Flask-SQLAlchemy rozwiązuje względem katalogu instance
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+DEFAULT_DATABASE_URL = 'sqlite:///sleep_tracker.db'
+# Liczba wierszy (albo dni) uzupełnianych w jednej transakcji
+DEFAULT_CHUNK_SIZE = 5000
+BUSY_TIMEOUT_MS = 5000
+
+
+def database_path_from_url(url=None):
+    """Ścieżka do pliku bazy dla DATABASE_URL (domyślnie ze zmiennej środowiskowej)"""
+    if url is None:
+        load_dotenv()
+        url = os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        raise ValueError(f"Migracje obsługują tylko SQLite, a DATABASE_URL wskazuje na {url.get_backend_name()}.")
+    if not url.database or url.database == ':memory:':
+        raise ValueError("Baza w pamięci nie wymaga migracji.")
+    if os.path.isabs(url.database):
+        return url.database
+    return os.path.join(INSTANCE_DIR, url.database)
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def _add_columns(conn, table, columns, log):
+    existing = _columns(conn, table)
+    for name, definition in columns.items():
+        if name in existing:
+            log(f"Kolumna {name} już istnieje.")
+            continue
+        log(f"Dodaję kolumnę {name}...")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+class Transaction:
+    """Krótka transakcja z blokadą zapisu od początku (BEGIN IMMEDIATE)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def _progress(conn, version):
+    row = conn.execute("SELECT position FROM migration_progress WHERE version = ?", (version,)).fetchone()
+    return row[0] if row else None
+
+
+def _save_progress(conn, version, position):
+    conn.execute(
+        "INSERT INTO migration_progress (version, position) VALUES (?, ?) "
+        "ON CONFLICT(version) DO UPDATE SET position = excluded.position",
+        (version, position)
+    )
+
+
+def backfill(conn, version, next_chunk, apply_chunk, chunk_size, log, start=0):
+    """Uzupełnij dane porcjami, zapisując postęp w tej samej transakcji co porcję.
+
+    next_chunk(conn, position, chunk_size) zwraca (pierwszy, ostatni) klucz
+    kolejnej porcji albo None na końcu, apply_chunk(conn, first, last)
+    zwraca liczbę zmienionych wierszy.
+    """
+    position = _progress(conn, version)
+    if position is None:
+        position = start
+    elif position != start:
+        log(f"Wznawiam uzupełnianie od pozycji {position}.")
+    total = 0
+    while True:
+        with Transaction(conn):
+            chunk = next_chunk(conn, position, chunk_size)
+            if chunk is None:
+                break
+            first, position = chunk
+            total += apply_chunk(conn, first, position)
+            _save_progress(conn, version, position)
+    return total
+
+
+# --- Migracje -----------------------------------------------------------------
+
+def _records_chunk(conn, last_id, chunk_size):
+    row = conn.execute(
+        "SELECT MIN(id), MAX(id) FROM (SELECT id FROM sleep_records WHERE id > ? ORDER BY id LIMIT ?)",
+        (last_id, chunk_size)
+    ).fetchone()
+    return None if row[0] is None else row
+
+
+def _days_chunk(conn, last_day, chunk_size):
+    row = conn.execute(
+        "SELECT MIN(day), MAX(day) FROM (SELECT DISTINCT day FROM sleep_records "
+        "WHERE day > ? ORDER BY day LIMIT ?)",
+        (last_day, chunk_size)
+    ).fetchone()
+    return None if row[0] is None else row
+
+
+def add_rating_columns(conn, log, chunk_size):
+    """Kolumny oceny snu"""
+    with Transaction(conn):
+        _add_columns(conn, 'sleep_records', {
+            'sleep_rating': "INTEGER",
+            'is_rated': "BOOLEAN DEFAULT 0",
+        }, log)
+
+
+def add_derived_fields(conn, log, chunk_size):
+    """Pola wyliczane (czas trwania, drzemka/sen nocny, dzień przypisania) z indeksami"""
+    with Transaction(conn):
+        _add_columns(conn, 'sleep_records', {
+            'duration_seconds': "INTEGER NOT NULL DEFAULT 0",
+            'is_nap': "BOOLEAN NOT NULL DEFAULT 1",
+            'day': "DATE",
+        }, log)
+
+    # Drzemka do 4h włącznie - dzień rozpoczęcia, sen nocny - dzień zakończenia.
+    # Nowe wpisy zapisywane przez aplikację mają już day, więc pomijamy je.
+    def apply_chunk(conn, first_id, last_id):
+        return conn.execute("""
+            UPDATE sleep_records
+            SET duration_seconds = CAST(ROUND((julianday(wake_time) - julianday(sleep_time)) * 86400, 3) AS INTEGER),
+                is_nap = ROUND((julianday(wake_time) - julianday(sleep_time)) * 86400, 3) <= 4 * 3600,
+                day = CASE WHEN ROUND((julianday(wake_time) - julianday(sleep_time)) * 86400, 3) <= 4 * 3600
+                           THEN date(sleep_time) ELSE date(wake_time) END
+            WHERE id BETWEEN ? AND ? AND day IS NULL
+        """, (first_id, last_id)).rowcount
+
+    updated = backfill(conn, 2, _records_chunk, apply_chunk, chunk_size, log)
+    log(f"Uzupełniono pola wyliczane dla {updated} wpisów.")
+
+    # Indeksy dla widoku dnia i wyszukiwania ostatniej pobudki
+    with Transaction(conn):
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_sleep_records_day_sleep_time ON sleep_records (day, sleep_time)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_sleep_records_wake_time ON sleep_records (wake_time)")
+
+
+def create_daily_summary(conn, log, chunk_size):
+    """Tabela podsumowań dziennych wypełniona z istniejących wpisów"""
+    with Transaction(conn):
+        if _table_exists(conn, 'daily_sleep_summary'):
+            if _progress(conn, 3) is None:
+                log("Tabela daily_sleep_summary już istnieje (do odbudowy użyj: flask rebuild-summary).")
+                return
+        else:
+            log("Tworzę tabelę daily_sleep_summary...")
+            conn.execute("""
+                CREATE TABLE daily_sleep_summary (
+                    day DATE NOT NULL PRIMARY KEY,
+                    nap_count INTEGER NOT NULL,
+                    nap_seconds INTEGER NOT NULL,
+                    night_count INTEGER NOT NULL,
+                    night_seconds INTEGER NOT NULL,
+                    rating_count INTEGER NOT NULL,
+                    rating_sum INTEGER NOT NULL
+                )
+            """)
+            # Postęp zapisany razem z tabelą - przerwane wypełnianie zostanie wznowione
+            _save_progress(conn, 3, '')
+
+    # Każdą porcję dni liczymy od nowa z sleep_records w jednej transakcji,
+    # więc zmiany zapisane przez aplikację w międzyczasie nie giną
+    def apply_chunk(conn, first_day, last_day):
+        return conn.execute("""
+            INSERT OR REPLACE INTO daily_sleep_summary
+            SELECT day,
+                   SUM(CASE WHEN is_nap THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN is_nap THEN duration_seconds ELSE 0 END),
+                   SUM(CASE WHEN is_nap THEN 0 ELSE 1 END),
+                   SUM(CASE WHEN is_nap THEN 0 ELSE duration_seconds END),
+                   SUM(CASE WHEN NOT is_nap AND sleep_rating IS NOT NULL THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN NOT is_nap AND sleep_rating IS NOT NULL THEN sleep_rating ELSE 0 END)
+            FROM sleep_records
+            WHERE day BETWEEN ? AND ?
+            GROUP BY day
+        """, (first_day, last_day)).rowcount
+
+    days = backfill(conn, 3, _days_chunk, apply_chunk, max(1, chunk_size // 10), log, start='')
+    log(f"Utworzono podsumowania dla {days} dni.")
+
+
+def create_active_naps(conn, log, chunk_size):
+    """Tabela trwających drzemek współdzielona przez urządzenia"""
+    with Transaction(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS active_naps (
+                id INTEGER NOT NULL PRIMARY KEY,
+                start_time DATETIME NOT NULL,
+                created_at DATETIME
+            )
+        """)
+
+
+def create_sync_tables(conn, log, chunk_size):
+    """Klucze idempotencji i dziennik zmian wpisów dla /api/sync"""
+    with Transaction(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_keys (
+                "key" VARCHAR(64) NOT NULL PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at DATETIME
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS record_changes (
+                id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                record_id INTEGER NOT NULL UNIQUE,
+                deleted BOOLEAN NOT NULL
+            )
+        """)
+
+    # Istniejące wpisy trafiają do dziennika, żeby pierwsza synchronizacja je pobrała
+    def apply_chunk(conn, first_id, last_id):
+        return conn.execute(
+            "INSERT OR IGNORE INTO record_changes (record_id, deleted) "
+            "SELECT id, 0 FROM sleep_records WHERE id BETWEEN ? AND ?",
+            (first_id, last_id)
+        ).rowcount
+
+    logged = backfill(conn, 5, _records_chunk, apply_chunk, chunk_size, log)
+    log(f"Dodano {logged} wpisów do dziennika zmian.")
+
 
-# Ścieżka do bazy danych
-db_path = 'instance/sleep_tracker.db'
+def add_overlap_indexes(conn, log, chunk_size):
+    """Indeksy do wyszukiwania nakładających się wpisów przy każdym zapisie"""
+    with Transaction(conn):
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_sleep_records_sleep_time ON sleep_records (sleep_time)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_sleep_records_duration_seconds ON sleep_records (duration_seconds)")
+
+
+_RECORD_COLUMNS = ('id, sleep_time, wake_time, notes, sleep_rating, is_rated, created_at, '
+                   'duration_seconds, is_nap, day')
+_RECORD_INDEXES = (
+    ('ix_sleep_records_day_sleep_time', 'day, sleep_time'),
+    ('ix_sleep_records_wake_time', 'wake_time'),
+    ('ix_sleep_records_sleep_time', 'sleep_time'),
+    ('ix_sleep_records_duration_seconds', 'duration_seconds'),
+)
+
+
+def make_record_ids_autoincrement(conn, log, chunk_size):
+    """Identyfikatory wpisów bez ponownego użycia - archiwum i /api/sync odwołują się do usuniętych id"""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='sleep_records'").fetchone()[0]
+    if 'AUTOINCREMENT' in sql.upper():
+        log("Tabela sleep_records ma już AUTOINCREMENT.")
+        return
+    # SQLite nie zmienia klucza głównego przez ALTER TABLE - kopiujemy wpisy porcjami do nowej tabeli,
+    # a wyzwalacze przenoszą do niej zapisy aplikacji w trakcie kopiowania
+    copy = f"INSERT OR REPLACE INTO sleep_records_new ({_RECORD_COLUMNS}) SELECT {_RECORD_COLUMNS} FROM sleep_records"
+    if _progress(conn, 7) is None:
+        with Transaction(conn):
+            conn.execute("DROP TABLE IF EXISTS sleep_records_new")
+            conn.execute("""
+                CREATE TABLE sleep_records_new (
+                    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                    sleep_time DATETIME NOT NULL,
+                    wake_time DATETIME NOT NULL,
+                    notes VARCHAR(200),
+                    sleep_rating INTEGER,
+                    is_rated BOOLEAN,
+                    created_at DATETIME,
+                    duration_seconds INTEGER NOT NULL,
+                    is_nap BOOLEAN NOT NULL,
+                    day DATE NOT NULL
+                )
+            """)
+            # Znikają razem ze starą tabelą
+            conn.execute(f"""CREATE TRIGGER sleep_records_copy_insert AFTER INSERT ON sleep_records BEGIN
+                {copy} WHERE id = new.id;
+            END""")
+            conn.execute(f"""CREATE TRIGGER sleep_records_copy_update AFTER UPDATE ON sleep_records BEGIN
+                {copy} WHERE id = new.id;
+            END""")
+            conn.execute("""CREATE TRIGGER sleep_records_copy_delete AFTER DELETE ON sleep_records BEGIN
+                DELETE FROM sleep_records_new WHERE id = old.id;
+            END""")
+            _save_progress(conn, 7, 0)
+
+    def apply_chunk(conn, first_id, last_id):
+        return conn.execute(f"{copy} WHERE id BETWEEN ? AND ?", (first_id, last_id)).rowcount
+
+    copied = backfill(conn, 7, _records_chunk, apply_chunk, chunk_size, log)
+    # Indeksy po jednym na transakcję - stara tabela traci je dopiero tuż przed podmianą
+    for name, columns in _RECORD_INDEXES:
+        with Transaction(conn):
+            owner = conn.execute("SELECT tbl_name FROM sqlite_master WHERE type='index' AND name = ?", (name,)).fetchone()
+            if owner and owner[0] == 'sleep_records_new':
+                continue
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+            conn.execute(f"CREATE INDEX {name} ON sleep_records_new ({columns})")
+    with Transaction(conn):
+        conn.execute("DROP TABLE sleep_records")
+        conn.execute("ALTER TABLE sleep_records_new RENAME TO sleep_records")
+    log(f"Przepisano {copied} wpisów.")
+
+
+def _warsaw_epoch(text):
+    # Przed migracją 11 czasy są tekstem w lokalnym czasie warszawskim
+    return timezones.to_epoch(datetime.fromisoformat(text), timezones.get_zone(timezones.DEFAULT_ZONE))
+
+
+def add_wake_windows(conn, log, chunk_size):
+    """Okna aktywności w podsumowaniach dziennych i tabela okien kroczących (7/30 dni)"""
+    with Transaction(conn):
+        _add_columns(conn, 'daily_sleep_summary', {
+            'wake_window_count': "INTEGER NOT NULL DEFAULT 0",
+            'wake_window_seconds': "INTEGER NOT NULL DEFAULT 0",
+        }, log)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rolling_sleep_stats (
+                window_days INTEGER NOT NULL PRIMARY KEY,
+                end_day DATE NOT NULL,
+                nap_count INTEGER NOT NULL,
+                nap_seconds INTEGER NOT NULL,
+                night_count INTEGER NOT NULL,
+                night_seconds INTEGER NOT NULL,
+                rating_count INTEGER NOT NULL,
+                rating_sum INTEGER NOT NULL,
+                wake_window_count INTEGER NOT NULL,
+                wake_window_seconds INTEGER NOT NULL
+            )
+        """)
+
+    # Okno należy do dnia wpisu, który je kończy, i zależy od poprzedniego wpisu -
+    # liczymy je w Pythonie tak samo jak aplikacja (analytics.wake_windows)
+    def apply_chunk(conn, first_day, last_day):
+        start = conn.execute(
+            "SELECT MIN(sleep_time) FROM sleep_records WHERE day BETWEEN ? AND ?", (first_day, last_day)
+        ).fetchone()[0]
+        previous = conn.execute(
+            "SELECT wake_time FROM sleep_records WHERE sleep_time < ? ORDER BY sleep_time DESC, id DESC LIMIT 1",
+            (start,)
+        ).fetchone()
+        # Wpis przypisany do last_day zaczyna się najpóźniej tego dnia
+        stop = (date.fromisoformat(last_day) + timedelta(days=1)).isoformat()
+        rows = conn.execute(
+            "SELECT sleep_time, wake_time, day FROM sleep_records WHERE sleep_time >= ? ORDER BY sleep_time, id",
+            (start,)
+        )
+        windows = analytics.wake_windows(
+            ((_warsaw_epoch(sleep_time), _warsaw_epoch(wake_time), day)
+             for sleep_time, wake_time, day in itertools.takewhile(lambda row: row[0] < stop, rows)),
+            previous and _warsaw_epoch(previous[0])
+        )
+        conn.execute(
+            "UPDATE daily_sleep_summary SET wake_window_count = 0, wake_window_seconds = 0 WHERE day BETWEEN ? AND ?",
+            (first_day, last_day)
+        )
+        conn.executemany(
+            "UPDATE daily_sleep_summary SET wake_window_count = ?, wake_window_seconds = ? WHERE day = ?",
+            [(totals['wake_window_count'], totals['wake_window_seconds'], day)
+             for day, totals in windows.items() if first_day <= day <= last_day]
+        )
+        return len(windows)
+
+    days = backfill(conn, 8, _days_chunk, apply_chunk, max(1, chunk_size // 10), log, start='')
+    # Okna kroczące policzone w trakcie uzupełniania mogły widzieć niepełne dane - aplikacja policzy je od nowa
+    with Transaction(conn):
+        conn.execute("DELETE FROM rolling_sleep_stats")
+    log(f"Uzupełniono okna aktywności dla {days} dni.")
+
+
+def create_derived_jobs(conn, log, chunk_size):
+    """Trwała kolejka zadań w tle (okna aktywności, model drzemek) zapisywanych razem z wpisem"""
+    with Transaction(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS derived_jobs (
+                id INTEGER NOT NULL PRIMARY KEY,
+                kind VARCHAR(32) NOT NULL,
+                "key" VARCHAR(64) NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                run_after FLOAT NOT NULL,
+                enqueued_at FLOAT NOT NULL,
+                last_error TEXT,
+                UNIQUE (kind, "key")
+            )
+        """)
+
+
+def create_search_index(conn, log, chunk_size):
+    """Indeks pełnotekstowy notatek (FTS5) z wyzwalaczami, które utrzymują go przy każdym zapisie"""
+    # Do czasu wypełnienia wyzwalacze obsługują tylko wpisy z już zaindeksowanych porcji -
+    # zapis między porcjami nie trafi do indeksu dwa razy
+    indexed_up_to = "SELECT position FROM migration_progress WHERE version = 10"
+    if _progress(conn, 10) is None:
+        with Transaction(conn):
+            for statement in search.INDEX_STATEMENTS + search.DROP_TRIGGER_STATEMENTS:
+                conn.execute(statement)
+            conn.execute(search.CLEAR_STATEMENT)
+            for statement in search.trigger_statements(indexed_up_to):
+                conn.execute(statement)
+            _save_progress(conn, 10, 0)
+
+    def apply_chunk(conn, first_id, last_id):
+        return conn.execute(
+            f"INSERT INTO {search.TABLE} (rowid, notes) SELECT id, notes FROM {search.VIEW} WHERE id BETWEEN ? AND ?",
+            (first_id, last_id)
+        ).rowcount
+
+    backfill(conn, 10, _records_chunk, apply_chunk, chunk_size, log)
+    with Transaction(conn):
+        # Wpisy dodane po ostatniej porcji
+        conn.execute(
+            f"INSERT INTO {search.TABLE} (rowid, notes) SELECT id, notes FROM {search.VIEW} WHERE id > ?",
+            (_progress(conn, 10),)
+        )
+        for statement in search.DROP_TRIGGER_STATEMENTS + search.trigger_statements():
+            conn.execute(statement)
+    with Transaction(conn):
+        conn.execute(search.OPTIMIZE_STATEMENT)
+        indexed = conn.execute(search.COUNT_STATEMENT).fetchone()[0]
+    log(f"Zaindeksowano notatki {indexed} wpisów.")
+
+
+# Wkład wpisu w podsumowanie dnia - jak summary_contribution w app.py
+def _summary_contribution(is_nap, duration_seconds, sleep_rating):
+    if is_nap:
+        return {'nap_count': 1, 'nap_seconds': duration_seconds}
+    contribution = {'night_count': 1, 'night_seconds': duration_seconds}
+    if sleep_rating is not None:
+        contribution.update(rating_count=1, rating_sum=sleep_rating)
+    return contribution
+
+
+_SUMMARY_FIELDS = ('nap_count', 'nap_seconds', 'night_count', 'night_seconds', 'rating_count', 'rating_sum')
+
+
+def convert_times_to_utc(conn, log, chunk_size):
+    """Czasy snu jako sekundy UTC od epoki zamiast lokalnego czasu warszawskiego, strefa rodziny w app_settings"""
+    with Transaction(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS app_settings (
+                "key" VARCHAR(64) NOT NULL PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        # Dotąd wszystkie czasy były zapisywane w strefie warszawskiej
+        conn.execute("INSERT OR IGNORE INTO app_settings (\"key\", value) VALUES ('time_zone', ?)",
+                     (timezones.DEFAULT_ZONE,))
+        name = conn.execute("SELECT value FROM app_settings WHERE \"key\" = 'time_zone'").fetchone()[0]
+    zone = timezones.get_zone(name)
+    changed_days = set()
+
+    def epoch(value):
+        # Wiersze zapisane już przez nową wersję aplikacji mają liczby
+        return value if isinstance(value, int) else timezones.to_epoch(datetime.fromisoformat(value), zone)
+
+    # Czas trwania liczony w UTC - noc zmiany czasu staje się o godzinę krótsza lub dłuższa,
+    # a z nią może zmienić się rodzaj wpisu i dzień (jak classify_sleep w app.py)
+    def apply_chunk(conn, first_id, last_id):
+        rows = conn.execute(
+            "SELECT id, sleep_time, wake_time, duration_seconds, is_nap, day, sleep_rating FROM sleep_records "
+            "WHERE id BETWEEN ? AND ? AND (typeof(sleep_time) = 'text' OR typeof(wake_time) = 'text')",
+            (first_id, last_id)
+        ).fetchall()
+        updates, deltas = [], {}
+        for record_id, sleep_time, wake_time, duration, is_nap, day, rating in rows:
+            sleep_time, wake_time = epoch(sleep_time), epoch(wake_time)
+            new_duration = wake_time - sleep_time
+            new_is_nap = new_duration <= 4 * 3600
+            new_day = timezones.local_day(sleep_time if new_is_nap else wake_time, zone).isoformat()
+            updates.append((sleep_time, wake_time, new_duration, new_is_nap, new_day, record_id))
+            if (new_duration, new_is_nap, new_day) == (duration, bool(is_nap), day):
+                continue
+            for sign, contribution_day, contribution in (
+                (-1, day, _summary_contribution(is_nap, duration, rating)),
+                (1, new_day, _summary_contribution(new_is_nap, new_duration, rating)),
+            ):
+                totals = deltas.setdefault(contribution_day, dict.fromkeys(_SUMMARY_FIELDS, 0))
+                for field, value in contribution.items():
+                    totals[field] += sign * value
+            # Klienci /api/sync pobiorą wpisy z nowym czasem trwania
+            conn.execute("INSERT OR REPLACE INTO record_changes (record_id, deleted) VALUES (?, 0)", (record_id,))
+        conn.executemany(
+            "UPDATE sleep_records SET sleep_time = ?, wake_time = ?, duration_seconds = ?, is_nap = ?, day = ? "
+            "WHERE id = ?",
+            updates
+        )
+        conn.executemany(
+            "INSERT INTO daily_sleep_summary (day, " + ', '.join(_SUMMARY_FIELDS) + ") VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(day) DO UPDATE SET " + ', '.join(f"{field} = {field} + excluded.{field}"
+                                                          for field in _SUMMARY_FIELDS),
+            [(day,) + tuple(totals[field] for field in _SUMMARY_FIELDS) for day, totals in deltas.items()]
+        )
+        conn.executemany(
+            "DELETE FROM daily_sleep_summary WHERE day = ? AND nap_count = 0 AND night_count = 0 "
+            "AND wake_window_count = 0",
+            [(day,) for day in deltas]
+        )
+        changed_days.update(deltas)
+        return len(updates)
+
+    converted = backfill(conn, 11, _records_chunk, apply_chunk, chunk_size, log)
+    with Transaction(conn):
+        active = conn.execute("SELECT id, start_time FROM active_naps WHERE typeof(start_time) = 'text'").fetchall()
+        conn.executemany("UPDATE active_naps SET start_time = ? WHERE id = ?",
+                         [(epoch(start_time), nap_id) for nap_id, start_time in active])
+        if changed_days:
+            conn.execute("DELETE FROM rolling_sleep_stats")
+    log(f"Przeliczono na UTC czasy {converted} wpisów (strefa {name}).")
+    if changed_days:
+        # Okna aktywności zależą od dnia wpisu - tych kilku dni nie liczymy tu od nowa
+        log(f"Zmienił się czas trwania wpisów z {len(changed_days)} dni zmiany czasu "
+            f"(okna aktywności przeliczy: flask rebuild-summary).")
+
+
+# (wersja, nazwa, funkcja) - nowe migracje dopisujemy na końcu z kolejnym numerem
+MIGRATIONS = [
+    (1, 'rating_columns', add_rating_columns),
+    (2, 'derived_fields', add_derived_fields),
+    (3, 'daily_sleep_summary', create_daily_summary),
+    (4, 'active_naps', create_active_naps),
+    (5, 'sync_tables', create_sync_tables),
+    (6, 'overlap_indexes', add_overlap_indexes),
+    (7, 'record_ids_autoincrement', make_record_ids_autoincrement),
+    (8, 'wake_windows', add_wake_windows),
+    (9, 'derived_jobs', create_derived_jobs),
+    (10, 'search_index', create_search_index),
+    (11, 'utc_epoch_times', convert_times_to_utc),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def connect(db_path):
+    # Autocommit - transakcje otwieramy jawnie (BEGIN IMMEDIATE)
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _ensure_version_tables(conn):
+    with Transaction(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER NOT NULL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at DATETIME NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS migration_progress (
+                version INTEGER NOT NULL PRIMARY KEY,
+                position
+            )
+        """)
+
+
+def current_version(conn):
+    if not _table_exists(conn, 'schema_version'):
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate_database(db_path=None, log=print, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Uruchom brakujące migracje, zwraca wersję schematu po migracji"""
+    db_path = db_path or database_path_from_url()
 
-def migrate_database():
-    """Migracja bazy danych - dodanie kolumn sleep_rating i is_rated"""
-    print("Rozpoczynam migrację bazy danych...")
-    
     # Sprawdź, czy baza danych istnieje
     if not os.path.exists(db_path):
-        print(f"Baza danych {db_path} nie istnieje!")
-        return
-    
-    # Połącz z bazą danych
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
+        log(f"Baza danych {db_path} nie istnieje!")
+        return None
+
+    conn = connect(db_path)
     try:
-        # Sprawdź, czy kolumny już istnieją
-        cursor.execute("PRAGMA table_info(sleep_records)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Dodaj kolumnę sleep_rating, jeśli nie istnieje
-        if 'sleep_rating' not in columns:
-            print("Dodaję kolumnę sleep_rating...")
-            cursor.execute("ALTER TABLE sleep_records ADD COLUMN sleep_rating INTEGER")
-        else:
-            print("Kolumna sleep_rating już istnieje.")
-        
-        # Dodaj kolumnę is_rated, jeśli nie istnieje
-        if 'is_rated' not in columns:
-            print("Dodaję kolumnę is_rated...")
-            cursor.execute("ALTER TABLE sleep_records ADD COLUMN is_rated BOOLEAN DEFAULT 0")
-        else:
-            print("Kolumna is_rated już istnieje.")
-        
-        # Zatwierdź zmiany
-        conn.commit()
-        print("Migracja zakończona pomyślnie!")
-    
+        version = current_version(conn)
+        if version >= LATEST_VERSION:
+            log(f"Schemat jest aktualny (wersja {version}).")
+            return version
+        if not _table_exists(conn, 'sleep_records'):
+            log("Tabela sleep_records nie istnieje - nie ma czego migrować.")
+            return version
+
+        _ensure_version_tables(conn)
+        for migration_version, name, migration in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            log(f"Migracja {migration_version}: {name}...")
+            migration(conn, log, chunk_size)
+            with Transaction(conn):
+                conn.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (migration_version, name, datetime.utcnow().isoformat(' '))
+                )
+                conn.execute("DELETE FROM migration_progress WHERE version = ?", (migration_version,))
+            version = migration_version
+        log("Migracja zakończona pomyślnie!")
+        return version
+
     except Exception as e:
-        print(f"Błąd podczas migracji: {str(e)}")
-        conn.rollback()
-    
+        # Zakończone porcje i migracje zostają - kolejne uruchomienie wznowi pracę
+        log(f"Błąd podczas migracji: {str(e)}")
+        raise
+
     finally:
-        # Zamknij połączenie
         conn.close()
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Migracje bazy danych śledzenia snu.")
+    parser.add_argument('--database', help="Plik bazy SQLite (domyślnie z DATABASE_URL)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Liczba wierszy uzupełnianych w jednej transakcji")
+    parser.add_argument('--status', action='store_true', help="Pokaż tylko wersję schematu")
+    args = parser.parse_args()
+
+    db_path = args.database or database_path_from_url()
+    if args.status:
+        if not os.path.exists(db_path):
+            print(f"Baza danych {db_path} nie istnieje!")
+            return
+        conn = connect(db_path)
+        try:
+            print(f"Wersja schematu: {current_version(conn)} (najnowsza: {LATEST_VERSION})")
+        finally:
+            conn.close()
+        return
+    migrate_database(db_path, chunk_size=args.chunk_size)
+
+
 if __name__ == "__main__":
-    migrate_database() 
\ No newline at end of file
+    main()
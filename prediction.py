@@ -0,0 +1,127 @@
+"""Next-nap prediction from past wake windows.
+
+NapModel keeps time-decayed sums of the wake windows that ended with a
+nap, bucketed by the hour the child woke up. Adding a window is O(1) and
+gives the same model as fitting all windows at once. The app caches the
+fitted model, adds the window of each newly appended nap with observe()
+and refits it in a background job only after edits, deletes or imports.
+"""
+import math
+import threading
+from datetime import timedelta
+
+HALF_LIFE_DAYS = 7
+# Dłuższa przerwa to raczej brak wpisów niż okno aktywności
+MAX_WINDOW_MINUTES = 8 * 60
+# Minimalna (zanikająca) liczba obserwacji potrzebna do prognozy
+MIN_WEIGHT = 2.0
+# Sąsiednie godziny liczą się z mniejszą wagą - w jednej godzinie bywa mało danych
+NEIGHBOUR_WEIGHTS = ((0, 1.0), (-1, 0.5), (1, 0.5))
+
+
+class NapModel:
+    """Time-decayed mean and spread of wake windows per hour of waking up"""
+
+    def __init__(self, half_life_days=HALF_LIFE_DAYS):
+        self.half_life_seconds = half_life_days * 86400
+        self.reference = None  # Czas najnowszej obserwacji - wagi liczone są względem niego
+        self.weights = [0.0] * 24
+        self.sums = [0.0] * 24
+        self.squares = [0.0] * 24
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fit(cls, records, half_life_days=HALF_LIFE_DAYS):
+        """Model of (sleep_time, wake_time, is_nap) records sorted by sleep time"""
+        model = cls(half_life_days)
+        previous_wake = None
+        for sleep_time, wake_time, is_nap in records:
+            if previous_wake is not None and is_nap:
+                model.observe(previous_wake, sleep_time)
+            previous_wake = wake_time
+        return model
+
+    def observe(self, wake_time, nap_start):
+        """Add the wake window from wake_time to a nap starting at nap_start"""
+        minutes = (nap_start - wake_time).total_seconds() / 60
+        if not 0 < minutes <= MAX_WINDOW_MINUTES:
+            return False
+        with self._lock:
+            if self.reference is None:
+                self.reference = wake_time
+            age = (self.reference - wake_time).total_seconds()
+            if age < 0:
+                # Nowsza obserwacja - starsze tracą wagę
+                decay = 0.5 ** (-age / self.half_life_seconds)
+                self.weights = [weight * decay for weight in self.weights]
+                self.sums = [total * decay for total in self.sums]
+                self.squares = [total * decay for total in self.squares]
+                self.reference = wake_time
+                age = 0
+            weight = 0.5 ** (age / self.half_life_seconds)
+            hour = wake_time.hour
+            self.weights[hour] += weight
+            self.sums[hour] += weight * minutes
+            self.squares[hour] += weight * minutes * minutes
+            self.observations += 1
+        return True
+
+    def predict(self, last_wake):
+        """Expected next nap start with an earliest-latest window, or None without enough data"""
+        weight = total = squares = 0.0
+        with self._lock:
+            for offset, factor in NEIGHBOUR_WEIGHTS:
+                hour = (last_wake.hour + offset) % 24
+                weight += factor * self.weights[hour]
+                total += factor * self.sums[hour]
+                squares += factor * self.squares[hour]
+        if weight < MIN_WEIGHT:
+            return None
+        mean = total / weight
+        spread = math.sqrt(max(squares / weight - mean * mean, 0.0))
+        return {
+            'expected': last_wake + timedelta(minutes=mean),
+            'earliest': last_wake + timedelta(minutes=max(mean - spread, 0.0)),
+            'latest': last_wake + timedelta(minutes=mean + spread),
+        }
+
+
+def backtest(records, half_life_days=HALF_LIFE_DAYS, warmup_days=14):
+    """Score walk-forward predictions on (sleep_time, wake_time, is_nap) records sorted by sleep time.
+
+    Every nap after the warm-up is predicted from the records before it.
+    The baseline predicts the plain mean of all earlier wake windows.
+    """
+    model = NapModel(half_life_days)
+    errors, baseline_errors = [], []
+    covered = naps = 0
+    window_sum = window_count = 0
+    previous_wake = first_wake = None
+    for sleep_time, wake_time, is_nap in records:
+        if previous_wake is not None and is_nap:
+            actual = (sleep_time - previous_wake).total_seconds() / 60
+            if previous_wake - first_wake >= timedelta(days=warmup_days) and 0 < actual <= MAX_WINDOW_MINUTES:
+                naps += 1
+                prediction = model.predict(previous_wake)
+                if prediction is not None:
+                    errors.append(abs((prediction['expected'] - sleep_time).total_seconds()) / 60)
+                    covered += prediction['earliest'] <= sleep_time <= prediction['latest']
+                    baseline_errors.append(abs(window_sum / window_count - actual))
+            if model.observe(previous_wake, sleep_time):
+                window_sum += actual
+                window_count += 1
+        previous_wake = wake_time
+        first_wake = first_wake or wake_time
+
+    def mean(values):
+        return round(sum(values) / len(values), 1) if values else None
+
+    return {
+        'naps': naps,
+        'predicted': len(errors),
+        'mae_minutes': mean(errors),
+        'median_error_minutes': round(sorted(errors)[len(errors) // 2], 1) if errors else None,
+        'coverage': round(covered / len(errors), 3) if errors else None,
+        'baseline_mae_minutes': mean(baseline_errors),
+    }
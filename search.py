@@ -0,0 +1,145 @@
+"""Full-text search over the notes of sleep records (SQLite FTS5).
+
+sleep_records_fts is an external-content FTS5 index: it keeps only the
+tokens, the notes themselves are read from sleep_records through the
+sleep_record_notes view. Triggers keep it in sync on every insert,
+delete and change of notes, also for raw SQL writes (bulk import,
+archiving). Automatic labels ("Sen nocny", "Drzemka nr N") are left out -
+they would match most of the table.
+
+Ranking every match with bm25 costs about 2 us per row, so only the
+newest RANK_WINDOW matches are ranked; older matches follow, newest first.
+"""
+import re
+import unicodedata
+
+from markupsafe import Markup, escape
+
+TABLE = 'sleep_records_fts'
+# Tyle najnowszych trafień sortujemy według trafności
+RANK_WINDOW = 500
+# Dłuższe zapytania i tak niczego nie znajdą, a każde słowo to osobne przejście po indeksie
+MAX_TERMS = 8
+SNIPPET_WORDS = 16
+
+
+VIEW = 'sleep_record_notes'
+
+
+def _indexed(row):
+    # Ten sam warunek co is_standard_note w app.py
+    return (f"{row}.notes IS NOT NULL AND trim({row}.notes) <> '' AND trim({row}.notes) <> 'Sen nocny' "
+            f"AND substr(trim({row}.notes), 1, 10) <> 'Drzemka nr'")
+
+
+def _up_to(row, indexed_up_to):
+    return f" AND {row}.id <= ({indexed_up_to})" if indexed_up_to else ''
+
+
+def trigger_statements(indexed_up_to=None):
+    """CREATE TRIGGER statements that keep the index in sync with sleep_records.
+
+    indexed_up_to is an SQL expression with the last id already in the
+    index while a migration fills it in portions: changes of later rows
+    are left to the migration, which reads their current notes anyway.
+    """
+    return (
+        f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON sleep_records
+        WHEN {_indexed('new')}{_up_to('new', indexed_up_to)} BEGIN
+        INSERT INTO {TABLE} (rowid, notes) VALUES (new.id, new.notes);
+    END""",
+        # Usunięcie z indeksu wpisu, którego w nim nie ma, psułoby indeks - stąd te same warunki co w widoku
+        f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON sleep_records
+        WHEN {_indexed('old')}{_up_to('old', indexed_up_to)} BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, notes) VALUES ('delete', old.id, old.notes);
+    END""",
+        # Jeden wyzwalacz, żeby usunięcie starej treści zawsze poprzedzało dodanie nowej
+        f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE OF notes ON sleep_records
+        WHEN old.notes IS NOT new.notes{_up_to('old', indexed_up_to)} BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, notes) SELECT 'delete', old.id, old.notes WHERE {_indexed('old')};
+        INSERT INTO {TABLE} (rowid, notes) SELECT new.id, new.notes WHERE {_indexed('new')};
+    END""",
+    )
+
+
+# Treścią indeksu jest widok z samymi indeksowanymi notatkami - wtedy 'rebuild' i 'integrity-check'
+# porównują indeks z tymi samymi wierszami, które dodają i usuwają wyzwalacze
+INDEX_STATEMENTS = (
+    f"CREATE VIEW IF NOT EXISTS {VIEW} AS SELECT id, notes FROM sleep_records WHERE {_indexed('sleep_records')}",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        notes, content='{VIEW}', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+)
+CREATE_STATEMENTS = INDEX_STATEMENTS + trigger_statements()
+DROP_TRIGGER_STATEMENTS = tuple(
+    f"DROP TRIGGER IF EXISTS {TABLE}_{event}" for event in ('insert', 'delete', 'update')
+)
+DROP_STATEMENTS = (f"DROP TABLE IF EXISTS {TABLE}", f"DROP VIEW IF EXISTS {VIEW}")
+
+# Odbudowa musi iść w jednej transakcji - zapis w trakcie rozsynchronizowałby indeks z tabelą
+OPTIMIZE_STATEMENT = f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')"
+REBUILD_STATEMENTS = (f"INSERT INTO {TABLE} ({TABLE}) VALUES ('rebuild')", OPTIMIZE_STATEMENT)
+CLEAR_STATEMENT = f"INSERT INTO {TABLE} ({TABLE}) VALUES ('delete-all')"
+COUNT_STATEMENT = f"SELECT COUNT(*) FROM {VIEW}"
+# Błąd "database disk image is malformed", gdy indeks nie zgadza się z notatkami
+INTEGRITY_STATEMENT = f"INSERT INTO {TABLE} ({TABLE}, rank) VALUES ('integrity-check', 1)"
+
+# rank (bm25) liczony tylko dla wierszy z LIMIT - sortujemy je już w Pythonie
+NEWEST_STATEMENT = f"SELECT rowid, rank FROM {TABLE} WHERE {TABLE} MATCH :query ORDER BY rowid DESC LIMIT :limit"
+OLDER_STATEMENT = (f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH :query AND rowid < :before "
+                   f"ORDER BY rowid DESC LIMIT :limit OFFSET :offset")
+
+# Jak tokenizer unicode61: litery i cyfry, podkreślenie rozdziela słowa
+_WORD = re.compile(r'[^\W_]+')
+
+
+def fold(word):
+    """Lowercase a word and strip diacritics, as the index does ("Płaczą" -> "płacza")"""
+    decomposed = unicodedata.normalize('NFKD', word.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def query_terms(text):
+    """Folded words of a user's query; all must occur, the last one as a word prefix"""
+    return [fold(word) for word in _WORD.findall(text or '')[:MAX_TERMS]]
+
+
+def match_query(terms):
+    """FTS5 query for query_terms, or None without words.
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    never interpreted. Only the last word is a prefix (search as you type):
+    a prefix query has to merge the lists of every matching token first,
+    so it costs a few times more than a whole word.
+    """
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def _matches(word, terms):
+    word = fold(word)
+    return word in terms[:-1] or word.startswith(terms[-1])
+
+
+def snippet(notes, terms, size=SNIPPET_WORDS):
+    """Notes escaped for HTML with matching words in <mark>, cut to about size words around the first match"""
+    words = list(_WORD.finditer(notes))
+    hits = [index for index, word in enumerate(words) if _matches(word.group(), terms)]
+    start, end = 0, len(notes)
+    if len(words) > size:
+        first = max(0, (hits[0] if hits else 0) - size // 4)
+        last = min(len(words), first + size) - 1
+        start, end = words[first].start(), words[last].end()
+    parts = ['… '] if start > 0 else []
+    position = start
+    for index in hits:
+        word = words[index]
+        if word.start() < start or word.end() > end:
+            continue
+        parts += [escape(notes[position:word.start()]), Markup('<mark>'), escape(word.group()), Markup('</mark>')]
+        position = word.end()
+    parts.append(escape(notes[position:end]))
+    if end < len(notes):
+        parts.append(' …')
+    return Markup('').join(parts)
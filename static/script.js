@@ -1,5 +1,9 @@
 let napStartTime = null;
 let timerInterval = null;
+let stoppingLocally = false;
+
+// Zdarzenia zapisane bez połączenia z serwerem, wysyłane później przez /api/sync
+const SYNC_QUEUE_KEY = 'napSyncQueue';
 
 function toggleNap() {
     const button = document.getElementById('napButton');
@@ -13,25 +17,27 @@ function toggleNap() {
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
-                // Konwertujemy string na obiekt Date
-                // JavaScript automatycznie obsłuży strefę czasową z ISO string
-                napStartTime = new Date(data.start_time);
-                console.log('Nap start time (local):', napStartTime.toLocaleString());
-                console.log('Nap start time (ISO):', napStartTime.toISOString());
-                
-                button.textContent = 'STOP';
-                button.style.backgroundColor = '#dc3545'; // czerwony kolor dla STOP
-                timerContainer.style.display = 'block';
-                startTimer();
-                
-                // Resetujemy licznik
-                updateTimer();
+                showRunningNap(data.start_time);
             }
         })
-        .catch(error => console.error('Error:', error));
+        .catch(error => {
+            // Brak połączenia - drzemka trwa lokalnie, serwer dowie się przy synchronizacji
+            console.error('Error:', error);
+            const startTime = new Date();
+            queueSyncEvent({type: 'start', time: startTime.toISOString()});
+            showRunningNap(startTime.toISOString());
+        });
     } else {
         // Stop nap
         const endTime = new Date();
+        if (loadSyncQueue().length) {
+            // W kolejce czekają zdarzenia (np. start zapisany bez połączenia) - stop musi trafić
+            // na serwer po nich, inaczej wysłany później start otworzyłby drzemkę bez końca
+            queueNapStop(endTime);
+            flushSyncQueue();
+            return;
+        }
+        stoppingLocally = true;
         
         fetch('/stop_nap', {
             method: 'POST',
@@ -47,6 +53,7 @@ function toggleNap() {
         .then(data => {
             if (data.status === 'success') {
                 stopTimer();
+                napStartTime = null;
                 
                 // Jeśli to sen nocny, zapytaj czy chce ocenić sen teraz
                 if (data.is_night_sleep) {
@@ -58,10 +65,130 @@ function toggleNap() {
                 } else {
                     window.location.href = '/';  // Wracamy na stronę główną
                 }
+            } else {
+                // Np. drzemkę zakończono już na innym urządzeniu - pobierz aktualny stan
+                stoppingLocally = false;
+                fetch('/active_nap')
+                    .then(response => response.json())
+                    .then(applyNapState);
             }
         })
-        .catch(error => console.error('Error:', error));
+        .catch(error => {
+            // Brak połączenia - zapisz zakończenie w kolejce, żeby drzemka nie przepadła
+            console.error('Error:', error);
+            queueNapStop(endTime);
+        });
+    }
+}
+
+function queueNapStop(endTime) {
+    queueSyncEvent({
+        type: 'stop',
+        start_time: napStartTime.toISOString(),
+        time: endTime.toISOString()
+    });
+    stopTimer();
+    napStartTime = null;
+    stoppingLocally = false;
+    showStoppedNap();
+}
+
+function showStoppedNap() {
+    const button = document.getElementById('napButton');
+    button.textContent = 'START';
+    button.style.backgroundColor = '';
+    document.getElementById('timer-container').style.display = 'none';
+}
+
+function newEventKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
     }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+function loadSyncQueue() {
+    try {
+        return JSON.parse(localStorage.getItem(SYNC_QUEUE_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function queueSyncEvent(event) {
+    // Klucz nadajemy od razu - ponowne wysłanie tego samego zdarzenia nie utworzy duplikatu
+    const queue = loadSyncQueue();
+    queue.push(Object.assign({key: newEventKey()}, event));
+    localStorage.setItem(SYNC_QUEUE_KEY, JSON.stringify(queue));
+}
+
+function flushSyncQueue() {
+    const queue = loadSyncQueue();
+    if (!queue.length) return;
+
+    fetch('/api/sync', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({events: queue})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status !== 'success') return;
+        // Zdarzenia z błędem też usuwamy - ponowienie ich nie naprawi
+        const done = new Set(data.results.map(result => result.key));
+        const remaining = loadSyncQueue().filter(event => !done.has(event.key));
+        localStorage.setItem(SYNC_QUEUE_KEY, JSON.stringify(remaining));
+        data.results
+            .filter(result => result.status === 'error')
+            .forEach(result => console.error('Sync error:', result.message));
+        if (data.results.some(result => result.status === 'applied')) {
+            window.location.reload();
+        }
+    })
+    .catch(error => console.error('Sync failed, will retry:', error));
+}
+
+function showRunningNap(startTime) {
+    const button = document.getElementById('napButton');
+    const timerContainer = document.getElementById('timer-container');
+
+    // Konwertujemy string na obiekt Date
+    // JavaScript automatycznie obsłuży strefę czasową z ISO string
+    napStartTime = new Date(startTime);
+    console.log('Nap start time (local):', napStartTime.toLocaleString());
+    console.log('Nap start time (ISO):', napStartTime.toISOString());
+    
+    button.textContent = 'STOP';
+    button.style.backgroundColor = '#dc3545'; // czerwony kolor dla STOP
+    timerContainer.style.display = 'block';
+    stopTimer();
+    startTimer();
+    
+    // Resetujemy licznik
+    updateTimer();
+}
+
+// Stan drzemki z serwera - wspólny dla wszystkich urządzeń
+function applyNapState(state) {
+    if (state.active) {
+        if (!napStartTime || napStartTime.getTime() !== new Date(state.start_time).getTime()) {
+            showRunningNap(state.start_time);
+        }
+    } else if (napStartTime && !stoppingLocally) {
+        // Drzemkę zakończono na innym urządzeniu - odśwież listę wpisów
+        window.location.reload();
+    }
+}
+
+function subscribeToNapEvents() {
+    if (!window.EventSource || !document.getElementById('napButton')) return;
+
+    // Jedno długie połączenie zamiast odpytywania strony głównej;
+    // EventSource sam wznawia połączenie po jego zerwaniu
+    const source = new EventSource('/naps/stream');
+    source.onmessage = event => applyNapState(JSON.parse(event.data));
 }
 
 function startTimer() {
@@ -93,6 +220,10 @@ function updateTimer() {
 }
 
 document.addEventListener('DOMContentLoaded', function() {
+    subscribeToNapEvents();
+    flushSyncQueue();
+    window.addEventListener('online', flushSyncQueue);
+
     const dateFilter = document.getElementById('dateFilter');
     if (dateFilter) {
         dateFilter.addEventListener('change', function() {
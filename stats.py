@@ -0,0 +1,106 @@
+"""Vectorized sleep statistics for date ranges.
+
+Functions here work on plain NumPy arrays, so callers can load the needed
+columns in a single query without building ORM objects per record.
+"""
+import numpy as np
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def to_seconds(values):
+    """Convert a sequence of UTC epoch seconds to an int64 array"""
+    return np.array(values, dtype=np.int64)
+
+
+def to_flags(values):
+    """Convert a sequence of booleans (e.g. is_nap) to a bool array"""
+    return np.array(values, dtype=bool)
+
+
+def to_days(values):
+    """Convert a sequence of dates to a datetime64[D] array"""
+    return np.array(values, dtype='datetime64[D]')
+
+
+def to_ratings(values):
+    """Convert a sequence of ratings (with None) to a float array (with NaN)"""
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def bucket_start(days, bucket):
+    """Map datetime64[D] days to the first day of their bucket"""
+    days = days.astype('datetime64[D]')
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        # 1970-01-01 to czwartek - przesuwamy do poniedziałku
+        return days - (days.astype(np.int64) + 3) % 7
+    if bucket == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Unknown bucket: {bucket}")
+
+
+def aggregate(sleep_times, wake_times, durations, is_nap, days, ratings, start, end, bucket):
+    """Aggregate records into day/week/month buckets covering start..end.
+
+    sleep_times and wake_times are UTC epoch seconds, durations, is_nap
+    and days the stored derived columns (see app.classify_sleep), so a
+    night with a clock change counts the same as in daily summaries.
+    Records must be sorted by sleep time. Returns a list of dicts, one per
+    bucket, including empty ones.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket: {bucket}")
+
+    all_days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    starts = np.unique(bucket_start(all_days, bucket))
+    size = len(starts)
+
+    index = np.searchsorted(starts, bucket_start(days, bucket), side='right') - 1
+    in_range = (days >= all_days[0]) & (days <= all_days[-1])
+
+    def total(weights, mask):
+        return np.bincount(index[mask], weights=weights[mask], minlength=size)
+
+    ones = np.ones(len(durations))
+    nap_count = total(ones, in_range & is_nap)
+    nap_seconds = total(durations, in_range & is_nap)
+    night_count = total(ones, in_range & ~is_nap)
+    night_seconds = total(durations, in_range & ~is_nap)
+
+    rated = in_range & ~is_nap & ~np.isnan(ratings)
+    rating_count = total(ones, rated)
+    rating_sum = total(np.nan_to_num(ratings), rated)
+
+    # Okno aktywności: od pobudki do zaśnięcia w kolejnym wpisie, liczone w kubełku kolejnego wpisu
+    windows = sleep_times[1:] - wake_times[:-1]
+    window_index = index[1:]
+    window_mask = in_range[1:] & (windows > 0)
+    window_count = np.bincount(window_index[window_mask], minlength=size)
+    window_seconds = np.bincount(window_index[window_mask], weights=windows[window_mask], minlength=size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_rating = rating_sum / rating_count
+        avg_window = window_seconds / window_count
+
+    return [
+        {
+            'start': str(starts[i]),
+            'nap_count': int(nap_count[i]),
+            'nap_seconds': int(nap_seconds[i]),
+            'night_count': int(night_count[i]),
+            'night_seconds': int(night_seconds[i]),
+            'avg_sleep_rating': None if rating_count[i] == 0 else round(float(avg_rating[i]), 2),
+            'wake_window_count': int(window_count[i]),
+            'avg_wake_window_seconds': None if window_count[i] == 0 else int(avg_window[i]),
+        }
+        for i in range(size)
+    ]
+
+
+def combine(parts):
+    """Concatenate parts with the columns of aggregate (sleep_times ... ratings) and sort them by sleep time"""
+    columns = [np.concatenate(column) for column in zip(*parts)]
+    order = np.argsort(columns[0], kind='stable')
+    return tuple(column[order] for column in columns)
@@ -0,0 +1,71 @@
+"""Validation of client events for the /api/sync batch endpoint.
+
+Phones that were offline send the start/stop/edit/rate events they queued,
+each with a client-generated idempotency key. parse_event checks one event
+and returns it normalized, raising ValueError with a message for the user.
+"""
+import timezones
+
+EVENT_TYPES = ('start', 'stop', 'edit', 'rate')
+MAX_KEY_LENGTH = 64
+
+
+def is_valid_key(key):
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def parse_time(value, tz):
+    """Parse an ISO 8601 time; times without an offset are local. Returns naive local time"""
+    try:
+        return timezones.parse_local(value, tz)
+    except ValueError:
+        raise ValueError(f"Niepoprawny format czasu: {value}.")
+
+
+def _optional_time(event, name, tz):
+    value = event.get(name)
+    return parse_time(value, tz) if value else None
+
+
+def _target(event):
+    """Record an edit/rate event refers to: a server id or the key of the stop event that created it"""
+    record_id = event.get('record_id')
+    record_key = event.get('record_key')
+    if record_id is not None:
+        if isinstance(record_id, bool) or not isinstance(record_id, int):
+            raise ValueError("Niepoprawny identyfikator wpisu.")
+        return {'record_id': record_id, 'record_key': None}
+    if is_valid_key(record_key):
+        return {'record_id': None, 'record_key': record_key}
+    raise ValueError("Brak wpisu do zmiany (record_id lub record_key).")
+
+
+def parse_event(event, tz):
+    """Return the event as a dict with its type and parsed fields"""
+    event_type = event.get('type')
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Nieznany typ zdarzenia: {event_type}.")
+    parsed = {'type': event_type}
+
+    if event_type == 'start':
+        parsed['time'] = _optional_time(event, 'time', tz)
+    elif event_type == 'stop':
+        parsed['time'] = _optional_time(event, 'time', tz)
+        parsed['start_time'] = _optional_time(event, 'start_time', tz)
+    elif event_type == 'edit':
+        parsed.update(_target(event))
+        parsed['sleep_time'] = parse_time(event.get('sleep_time'), tz)
+        parsed['wake_time'] = parse_time(event.get('wake_time'), tz)
+        if timezones.seconds_between(parsed['sleep_time'], parsed['wake_time'], tz) <= 0:
+            raise ValueError("Czas pobudki musi być późniejszy niż czas zaśnięcia.")
+        notes = event.get('notes')
+        if notes is not None and (not isinstance(notes, str) or len(notes) > 200):
+            raise ValueError("Notatka może mieć najwyżej 200 znaków.")
+        parsed['notes'] = notes
+    else:
+        parsed.update(_target(event))
+        rating = event.get('rating')
+        if isinstance(rating, bool) or not isinstance(rating, int) or not 1 <= rating <= 5:
+            raise ValueError("Ocena musi być w zakresie 1-5.")
+        parsed['rating'] = rating
+    return parsed
@@ -0,0 +1,68 @@
+"""Seeded generator of realistic sleep histories for benchmarks and backtests.
+
+Every day has a night sleep (ending that morning) and one to three naps,
+fewer as the child gets older; after two years the cycle starts again
+with the next child. Yields (sleep_time, wake_time, notes,
+rating) tuples accepted by app.bulk_insert_records.
+"""
+import random
+from datetime import date, datetime, timedelta
+
+# Po tylu dniach historia zaczyna się od nowa (kolejne dziecko)
+CHILD_CYCLE_DAYS = 730
+# Średnia liczba wpisów na dzień (sen nocny + drzemki)
+RECORDS_PER_DAY = 3.1
+
+
+def _naps_for_age(age_days):
+    """Number of naps on a day, by the child's age in days"""
+    if age_days < 270:
+        return 3
+    if age_days < 540:
+        return 2
+    return 1
+
+
+def generate_history(count, seed=0, end=None):
+    """Yield `count` records in chronological order, ending around `end`.
+
+    Very large histories that do not fit between year 1 and `end` are
+    continued past `end`.
+    """
+    rng = random.Random(seed)
+    end = end or date(2024, 12, 31)
+    days_needed = int(count / RECORDS_PER_DAY) + 1
+    try:
+        start = end - timedelta(days=days_needed)
+    except OverflowError:
+        start = date(1, 1, 2)
+
+    generated = 0
+    day = start
+    age_days = 0
+    while generated < count:
+        # Sen nocny od wieczora poprzedniego dnia do rana
+        night_start = datetime.combine(day - timedelta(days=1), datetime.min.time()) + timedelta(
+            hours=19, minutes=rng.randint(0, 90)
+        )
+        morning = datetime.combine(day, datetime.min.time()) + timedelta(hours=6, minutes=rng.randint(0, 75))
+        rating = rng.randint(1, 5) if rng.random() < 0.7 else None
+        yield night_start, morning, '', rating
+        generated += 1
+
+        # Drzemki z przerwami (oknami aktywności) rosnącymi z wiekiem
+        awake_from = morning
+        base_window = 90 + min(age_days, 900) // 6
+        for _ in range(_naps_for_age(age_days)):
+            if generated >= count:
+                break
+            nap_start = awake_from + timedelta(minutes=base_window + rng.randint(-20, 40))
+            nap_end = nap_start + timedelta(minutes=rng.randint(25, 130))
+            if nap_end.date() != day or nap_end.hour >= 19:
+                break
+            yield nap_start, nap_end, '', None
+            generated += 1
+            awake_from = nap_end
+
+        day += timedelta(days=1)
+        age_days = (age_days + 1) % CHILD_CYCLE_DAYS
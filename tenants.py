@@ -0,0 +1,94 @@
+"""Per-tenant (family) database engines.
+
+Every tenant has its own SQLite file. Open engines are kept in a bounded
+LRU and disposed when evicted or idle for too long, so the number of
+open files stays limited however many tenants there are.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def is_valid_tenant_id(tenant_id):
+    """Tenant ids become file names, so only a safe subset of characters is allowed"""
+    return bool(tenant_id) and TENANT_ID_PATTERN.match(tenant_id) is not None
+
+
+class TenantEngines:
+    """Thread-safe LRU of engines created on demand by factory(tenant_id)"""
+
+    def __init__(self, factory, maxsize=32, idle_seconds=600):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.idle_seconds = idle_seconds
+        self._engines = OrderedDict()  # tenant_id -> (engine, last_used)
+        self._opening = {}  # tenant_id -> blokada otwierania jego bazy
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id):
+        """Return the tenant's engine, opening (and initializing) it if needed"""
+        with self._lock:
+            entry = self._engines.get(tenant_id)
+            if entry is None:
+                opening = self._opening.setdefault(tenant_id, threading.Lock())
+        if entry is not None:
+            return self._store(tenant_id, entry[0])
+        # Otwarcie bazy uruchamia migracje - trwa bez wspólnej blokady, inne rodziny nie czekają,
+        # a równoległe żądania tej samej rodziny czekają na jedno otwarcie
+        with opening:
+            try:
+                with self._lock:
+                    entry = self._engines.get(tenant_id)
+                engine = self.factory(tenant_id) if entry is None else entry[0]
+                return self._store(tenant_id, engine)
+            finally:
+                with self._lock:
+                    if self._opening.get(tenant_id) is opening:
+                        del self._opening[tenant_id]
+
+    def _store(self, tenant_id, engine):
+        now = time.monotonic()
+        with self._lock:
+            self._engines[tenant_id] = (engine, now)
+            self._engines.move_to_end(tenant_id)
+            evicted = self._evict(now)
+        for old_engine in evicted:
+            old_engine.dispose()
+        return engine
+
+    def _evict(self, now):
+        evicted = []
+        while len(self._engines) > self.maxsize:
+            evicted.append(self._engines.popitem(last=False)[1][0])
+        # Najdawniej używane są na początku - wystarczy sprawdzić początek kolejki
+        while self._engines:
+            tenant_id, (engine, last_used) = next(iter(self._engines.items()))
+            if now - last_used <= self.idle_seconds:
+                break
+            del self._engines[tenant_id]
+            evicted.append(engine)
+        return evicted
+
+    def evict_idle(self):
+        """Dispose engines that have not been used for idle_seconds"""
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        for engine in evicted:
+            engine.dispose()
+        return len(evicted)
+
+    def dispose_all(self):
+        with self._lock:
+            engines = [engine for engine, _ in self._engines.values()]
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def __contains__(self, tenant_id):
+        return tenant_id in self._engines
+
+    def __len__(self):
+        return len(self._engines)
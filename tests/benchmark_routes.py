@@ -0,0 +1,229 @@
+"""Route benchmarks on Flask's test client with synthetic histories.
+
+Times index(), add_record, stop_nap, edit_record and rate_sleep against
+databases of growing size and counts SQL statements per request:
+
+    python tests/benchmark_routes.py --sizes 1000,10000,100000 --output baseline.json
+    python tests/benchmark_routes.py --sizes 1000,10000,100000 --compare baseline.json
+
+In compare mode the exit code is 1 when any route got slower than
+--threshold times the baseline median or runs more queries than before.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from sqlalchemy import event, func  # noqa: E402
+
+ROUTES = ('index', 'index_cached', 'add_record', 'stop_nap', 'edit_record', 'rate_sleep')
+
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+def grow_history(app_module, size, seed):
+    """Insert synthetic records until sleep_records holds `size` rows"""
+    from synthetic_history import generate_history
+
+    current = app_module.SleepRecord.query.count()
+    if current >= size:
+        return current
+    # Kolejne porcje historii z innym ziarnem kończą się przed wcześniejszymi
+    end = app_module.db.session.query(func.min(app_module.SleepRecord.day)).scalar()
+    end = end - timedelta(days=1) if end else None
+    app_module.bulk_insert_records(generate_history(size - current, seed=seed + current, end=end))
+    return size
+
+
+def _random_record_id(app_module, rng, is_nap):
+    SleepRecord = app_module.SleepRecord
+    low, high = app_module.db.session.query(
+        func.min(SleepRecord.id), func.max(SleepRecord.id)
+    ).one()
+    start = rng.randint(low, high)
+    record = SleepRecord.query.filter(SleepRecord.id >= start, SleepRecord.is_nap == is_nap).order_by(SleepRecord.id).first()
+    if record is None:
+        record = SleepRecord.query.filter(SleepRecord.is_nap == is_nap).order_by(SleepRecord.id).first()
+    return record
+
+
+def _random_day(app_module, rng):
+    Summary = app_module.DailySleepSummary
+    first, last = app_module.db.session.query(func.min(Summary.day), func.max(Summary.day)).one()
+    return first + timedelta(days=rng.randint(0, (last - first).days))
+
+
+def _request_for(app_module, route, rng):
+    """Prepare (method, url, kwargs) for one request, outside the timed section"""
+    if route in ('index', 'index_cached'):
+        if route == 'index':
+            app_module.page_cache.clear()
+        return 'GET', f"/?date={_random_day(app_module, rng).isoformat()}", {}
+    if route == 'add_record':
+        start = datetime.combine(_random_day(app_module, rng), datetime.min.time()) + timedelta(hours=12, minutes=rng.randint(0, 120))
+        return 'POST', '/add', {'data': {
+            'sleep_time': start.strftime('%Y-%m-%dT%H:%M'),
+            'wake_time': (start + timedelta(minutes=45)).strftime('%Y-%m-%dT%H:%M'),
+            'notes': '',
+        }}
+    if route == 'stop_nap':
+        start = app_module.get_current_local_time() - timedelta(minutes=30)
+        return 'POST', '/stop_nap', {'json': {'start_time': start.isoformat()}}
+    if route == 'edit_record':
+        record = _random_record_id(app_module, rng, is_nap=True)
+        return 'POST', f"/edit_record/{record.id}", {'data': {
+            'sleep_time': record.sleep_time.strftime('%Y-%m-%dT%H:%M'),
+            'wake_time': record.wake_time.strftime('%Y-%m-%dT%H:%M'),
+            'notes': f"benchmark {rng.randint(0, 1000)}",
+        }}
+    if route == 'rate_sleep':
+        record = _random_record_id(app_module, rng, is_nap=False)
+        return 'POST', f"/rate_sleep/{record.id}", {'data': {'rating': str(rng.randint(1, 5))}}
+    raise ValueError(f"Unknown route: {route}")
+
+
+def time_route(app_module, client, route, repeat, rng):
+    """Run a route `repeat` times, returns timing and query statistics"""
+    timings = []
+    queries = []
+    errors = 0
+    if route == 'index_cached':
+        method, url, kwargs = _request_for(app_module, route, rng)
+        client.open(url, method=method, **kwargs)
+    for _ in range(repeat):
+        if route != 'index_cached':
+            method, url, kwargs = _request_for(app_module, route, rng)
+        app_module.db.session.remove()
+        with QueryCounter(app_module.db.engine) as counter:
+            started = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400 or b'error-message' in response.data:
+            errors += 1
+        timings.append(elapsed * 1000)
+        queries.append(counter.count)
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'queries': int(statistics.median(queries)),
+        'errors': errors,
+    }
+
+
+def run_benchmark(app_module, sizes, repeat=20, seed=0, log=print):
+    """Benchmark every route at every dataset size, returns the results document"""
+    rng = random.Random(seed)
+    client = app_module.app.test_client()
+    # Zapisy benchmarku trafiają w istniejące wpisy; 'flag' mierzy pełną ścieżkę zapisu razem ze sprawdzeniem nakładania
+    policy = app_module.app.config['OVERLAP_POLICY']
+    app_module.app.config['OVERLAP_POLICY'] = 'flag'
+    results = {}
+    try:
+        for size in sorted(sizes):
+            log(f"Przygotowuję historię z {size} wpisami...")
+            with app_module.app.app_context():
+                grow_history(app_module, size, seed)
+                results[str(size)] = {route: time_route(app_module, client, route, repeat, rng) for route in ROUTES}
+                app_module.db.session.remove()
+            for route, result in results[str(size)].items():
+                log(f"  {route:<13} median {result['median_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  queries {result['queries']}")
+    finally:
+        app_module.app.config['OVERLAP_POLICY'] = policy
+    return {
+        'meta': {
+            'seed': seed,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=1.25, min_delta_ms=0.5):
+    """Return a list of regression descriptions between two results documents"""
+    regressions = []
+    for size, routes in current['results'].items():
+        for route, result in routes.items():
+            base = baseline['results'].get(size, {}).get(route)
+            if base is None:
+                continue
+            slower = result['median_ms'] - base['median_ms']
+            if result['median_ms'] > base['median_ms'] * threshold and slower > min_delta_ms:
+                regressions.append(
+                    f"{route} @ {size}: median {base['median_ms']} ms -> {result['median_ms']} ms"
+                )
+            if result['queries'] > base['queries']:
+                regressions.append(f"{route} @ {size}: queries {base['queries']} -> {result['queries']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tras aplikacji na syntetycznej historii snu.")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Rozmiary historii oddzielone przecinkami")
+    parser.add_argument('--repeat', type=int, default=20, help="Liczba powtórzeń każdej trasy")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Zapisz wyniki do pliku JSON (baseline)")
+    parser.add_argument('--compare', help="Porównaj wyniki z zapisanym baseline")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Dopuszczalny wzrost mediany (krotność)")
+    args = parser.parse_args()
+
+    # Baza benchmarku musi być ustawiona przed importem aplikacji
+    workdir = tempfile.mkdtemp(prefix='sleep_tracker_bench_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    import app as app_module
+    with app_module.app.app_context():
+        app_module.db.create_all()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    current = run_benchmark(app_module, sizes, repeat=args.repeat, seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(current, output, indent=2)
+        print(f"Zapisano wyniki do {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, current, threshold=args.threshold)
+        if regressions:
+            print("Regresje:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("Brak regresji względem baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Startup benchmark: time from spawning `python app.py` to the first 200 response.
+
+    python tests/benchmark_startup.py --repeat 10 --output startup.json
+
+Modes:
+    cold - every process starts with an empty Jinja cache and prepares the schema itself
+    warm - `flask init-db` and `flask precompile-templates` ran once before, like in a deployment
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('cold', 'warm')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _environment(workdir, **overrides):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(workdir, 'startup.db'),
+        'JINJA_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'FLASK_DEBUG': 'False',
+    })
+    env.update(overrides)
+    return env
+
+
+def measure_startup(env, timeout=30):
+    """Spawn the app and return the seconds until GET / answers 200"""
+    port = _free_port()
+    env = dict(env, PORT=str(port))
+    url = f"http://127.0.0.1:{port}/"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'app.py')],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Aplikacja zakończyła się z kodem {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"Brak odpowiedzi 200 po {timeout} s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _flask(env, *args):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', *args], cwd=ROOT, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def run_startup_benchmark(repeat=5, modes=MODES, log=print):
+    """Measure every mode `repeat` times, returns the results document"""
+    results = {}
+    for mode in modes:
+        timings = []
+        for _ in range(repeat):
+            workdir = tempfile.mkdtemp(prefix='sleep_tracker_startup_')
+            try:
+                if mode == 'warm':
+                    env = _environment(workdir, INIT_DB_ON_STARTUP='False')
+                    _flask(env, 'init-db')
+                    _flask(env, 'precompile-templates')
+                else:
+                    env = _environment(workdir)
+                timings.append(measure_startup(env) * 1000)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        results[mode] = {
+            'median_ms': round(statistics.median(timings), 1),
+            'min_ms': round(min(timings), 1),
+            'max_ms': round(max(timings), 1),
+        }
+        log(f"  {mode:<5} median {results[mode]['median_ms']:>8.1f} ms  "
+            f"min {results[mode]['min_ms']:>8.1f} ms  max {results[mode]['max_ms']:>8.1f} ms")
+    return {
+        'meta': {
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Czas od uruchomienia procesu do pierwszej odpowiedzi 200.")
+    parser.add_argument('--repeat', type=int, default=5, help="Liczba uruchomień w każdym trybie")
+    parser.add_argument('--mode', choices=MODES, action='append', help="Tryb (domyślnie oba)")
+    parser.add_argument('--output', help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    document = run_startup_benchmark(repeat=args.repeat, modes=args.mode or MODES)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(document, output, indent=2)
+        print(f"Zapisano wyniki do {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+import pytest
+
+# Baza testowa musi być ustawiona przed importem aplikacji
+_db_dir = tempfile.mkdtemp(prefix='sleep_tracker_test_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'test.db')
+os.environ['ARCHIVE_DIR'] = os.path.join(_db_dir, 'archive')
+
+from app import SleepRecord, app as flask_app, db, job_queue, nap_models, page_cache  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    page_cache.clear()
+    nap_models.clear()
+    with flask_app.app_context():
+        db.create_all()
+        # Połączenia z puli sprzed zmiany schematu przy pierwszym zapisie przez wyzwalacz indeksu FTS5
+        # dostają od razu "database is locked", gdy zapisuje też wątek zadań - aplikacja nie zmienia
+        # schematu w trakcie działania, więc testy też zaczynają od świeżych połączeń
+        db.engine.dispose()
+        yield flask_app
+        # Zadania w tle nie mogą działać na usuwanych tabelach
+        job_queue.drain()
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add(sleep_time, wake_time, notes=''):
+    """Zapisz wpis przez ORM (jak formularz, ze zdarzeniami sesji) - do przygotowania danych w testach"""
+    record = SleepRecord(sleep_time=sleep_time, wake_time=wake_time, notes=notes)
+    db.session.add(record)
+    db.session.commit()
+    return record
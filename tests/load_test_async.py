@@ -0,0 +1,244 @@
+"""Load test of the async nap API (asgi.py) served by uvicorn.
+
+Seeds a synthetic history, starts `uvicorn asgi:application` in a separate
+process and keeps --concurrency requests in flight at once: day lists,
+active nap checks, starts, stops and ratings. Reports throughput, latency,
+status codes and the peak number of requests the server process was
+handling at the same time (from /metrics):
+
+    python tests/load_test_async.py --concurrency 2000 --requests 20000 --output load.json
+
+Stops that find no active nap (400) or would overlap a nap saved a
+moment earlier (409) are expected with many parallel clients; only
+transport errors and 5xx responses count as errors.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Udział operacji w ruchu - listy dnia i stan drzemki odświeżają wszystkie otwarte karty
+OPERATIONS = (('list', 60), ('active', 15), ('start', 10), ('stop', 10), ('rate', 5))
+
+_SEED_SCRIPT = """
+import sys
+import app
+import synthetic_history
+with app.app.app_context():
+    app.init_db()
+    end = app.get_current_local_time().date()
+    app.bulk_insert_records(synthetic_history.generate_history(int(sys.argv[1]), seed=int(sys.argv[2]), end=end))
+"""
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def start_server(env, timeout=30):
+    """Spawn uvicorn with the ASGI app and return (process, port) once it answers"""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--backlog', '4096'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Serwer zakończył się z kodem {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + '/active_nap', timeout=timeout) as response:
+                if response.status == 200:
+                    return process, port
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.02)
+    process.terminate()
+    raise RuntimeError(f"Brak odpowiedzi serwera po {timeout} s")
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client connection - light enough to keep thousands open on one core"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=2 ** 20)
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+        )
+        try:
+            await self.writer.drain()
+            head = await self.reader.readuntil(b'\r\n\r\n')
+            status = int(head.split(b' ', 2)[1])
+            length = int(re.search(rb'(?i)content-length: *(\d+)', head).group(1))
+            return status, await self.reader.readexactly(length)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def _drive(host, port, concurrency, total, seed):
+    rng = random.Random(seed)
+    names = [name for name, _ in OPERATIONS]
+    weights = [weight for _, weight in OPERATIONS]
+    plan = rng.choices(names, weights, k=total)
+    latencies, statuses, errors = [], Counter(), Counter()
+
+    setup = Connection(host, port)
+    yesterday = (datetime.now() - timedelta(days=1)).date()
+    _, listing = await setup.request('GET', f'/api/naps?date={yesterday.isoformat()}')
+    setup.close()
+    night_ids = [record['id'] for record in json.loads(listing)['records'] if record['type'] == 'night']
+
+    async def one(connection, operation):
+        if operation == 'list':
+            request = ('GET', '/api/naps')
+        elif operation == 'active':
+            request = ('GET', '/active_nap')
+        elif operation == 'start':
+            request = ('POST', '/start_nap', {})
+        elif operation == 'stop':
+            request = ('POST', '/stop_nap', {})
+        else:
+            record_id = rng.choice(night_ids) if night_ids else 1
+            request = ('POST', f'/api/naps/{record_id}/rate', {'rating': rng.randint(1, 5)})
+        started = time.perf_counter()
+        try:
+            status, _ = await connection.request(*request)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            errors[type(e).__name__] += 1
+            return
+        latencies.append(time.perf_counter() - started)
+        statuses[f"{operation} {status}"] += 1
+        if status >= 500:
+            errors[f"HTTP {status}"] += 1
+
+    async def worker(operations):
+        connection = Connection(host, port)
+        try:
+            for operation in operations:
+                await one(connection, operation)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(plan[i::concurrency]) for i in range(concurrency)))
+    seconds = time.perf_counter() - started
+
+    # Nowe połączenie - bezczynne połączenie z początku serwer mógł już zamknąć
+    setup = Connection(host, port)
+    _, metrics = await setup.request('GET', '/metrics')
+    setup.close()
+    peak = re.search(r'^sleep_tracker_async_requests_in_flight_peak (\S+)$', metrics.decode('utf-8'), re.M)
+    return {
+        'requests': total,
+        'seconds': round(seconds, 2),
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'latency_ms': {
+            'p50': round(statistics.median(latencies) * 1000, 1),
+            'p95': round(_percentile(latencies, 0.95) * 1000, 1),
+            'p99': round(_percentile(latencies, 0.99) * 1000, 1),
+            'max': round(max(latencies) * 1000, 1),
+        } if latencies else None,
+        'errors': sum(errors.values()),
+        'error_types': dict(errors),
+        'statuses': dict(sorted(statuses.items())),
+        'server_peak_in_flight': int(float(peak.group(1))) if peak else None,
+    }
+
+
+def run_load_test(concurrency=1000, requests=10000, history=5000, seed=0, log=print):
+    """Run the load test on a fresh database, returns the results document"""
+    workdir = tempfile.mkdtemp(prefix='sleep_tracker_load_')
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(workdir, 'load.db'),
+        'ARCHIVE_DIR': os.path.join(workdir, 'archive'),
+        'JINJA_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'TENANT_MODE': 'False',
+        'FLASK_DEBUG': 'False',
+    })
+    process = None
+    try:
+        subprocess.run([sys.executable, '-c', _SEED_SCRIPT, str(history), str(seed)], cwd=ROOT, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        process, port = start_server(env)
+        result = asyncio.run(_drive('127.0.0.1', port, concurrency, requests, seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    log(f"  {result['requests']} żądań w {result['seconds']} s ({result['throughput_rps']}/s), "
+        f"błędy {result['errors']}, szczyt równoległych żądań na serwerze {result['server_peak_in_flight']}")
+    if result['latency_ms']:
+        log(f"  p50 {result['latency_ms']['p50']} ms  p95 {result['latency_ms']['p95']} ms  "
+            f"p99 {result['latency_ms']['p99']} ms  max {result['latency_ms']['max']} ms")
+    return {
+        'meta': {
+            'concurrency': concurrency,
+            'history': history,
+            'seed': seed,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        },
+        'results': result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test obciążeniowy async API drzemek (uvicorn + aiosqlite).")
+    parser.add_argument('--concurrency', type=int, default=1000, help="Liczba żądań utrzymywanych jednocześnie")
+    parser.add_argument('--requests', type=int, default=10000, help="Łączna liczba żądań")
+    parser.add_argument('--history', type=int, default=5000, help="Liczba wpisów w wygenerowanej historii")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    document = run_load_test(args.concurrency, args.requests, args.history, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(document, output, indent=2)
+        print(f"Zapisano wyniki do {args.output}")
+    if document['results']['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""Load test of the whole app with many caregivers using it at the same time.
+
+Seeds a synthetic history into a fresh SQLite database, starts the app
+(`python app.py`, Werkzeug with a thread per connection, or
+`uvicorn asgi:application`) in a separate process and runs --users
+virtual caregivers for --duration seconds. Each caregiver keeps its own
+keep-alive connection and, with a short pause between actions, starts
+and stops naps, browses days (`/?date=`), adds forgotten sleeps, edits
+notes and rates nights - the mix of OPERATIONS. Reports throughput,
+p50/p95/p99 latency and outcomes per route, including "database is
+locked" errors (from response bodies and sleep_tracker_db_locked_total):
+
+    python tests/load_test_caregivers.py --users 50 --duration 60 --output caregivers.json
+    python tests/load_test_caregivers.py --users 50 --duration 60 --server asgi --output caregivers_asgi.json
+
+Outcomes:
+    ok       - 2xx JSON or a redirect after a saved form
+    rejected - expected refusals: no active nap (400), overlap or a nap stopped
+               on another device (409), a form shown again with a validation message
+    error    - transport errors, 5xx and pages with the generic error message
+
+All caregivers share one family (one database), so every write competes
+for the same SQLite write lock. The exit code is 1 when any request ended
+with an error.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'flask': [sys.executable, 'app.py'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--log-level', 'warning',
+             '--backlog', '4096'],
+}
+# Udział czynności opiekuna - przeglądanie dni przeważa, drzemka to para start + stop
+OPERATIONS = (('browse', 40), ('nap', 20), ('edit', 15), ('rate', 15), ('add', 10))
+# Nazwy jak endpointy Flaska - takie same etykiety ma sleep_tracker_db_locked_total
+ROUTES = ('index', 'start_nap', 'stop_nap', 'add_record', 'edit_record', 'rate_sleep')
+# Tyle ostatnich dni historii przeglądają i poprawiają opiekunowie
+RECENT_DAYS = 14
+NOTES = ('', 'Zasnęła przy karmieniu', 'Marudził przed snem', 'Spacer w wózku', 'Obudził się z płaczem')
+
+# Ogólne komunikaty z bloków except - strona z nimi oznacza błąd serwera, choć ma status 200
+_ERROR_PAGE = re.compile('Wystąpił błąd|Nie udało się')
+_LOCKED = 'database is locked'
+
+_SEED_SCRIPT = """
+import sys
+import app
+import synthetic_history
+with app.app.app_context():
+    app.init_db()
+    end = app.get_current_local_time().date()
+    records = list(synthetic_history.generate_history(int(sys.argv[1]), seed=int(sys.argv[2]), end=end))
+    app.bulk_insert_records(records)
+    # Historia może kończyć się przed `end` - opiekunowie przeglądają jej ostatnie dni
+    print(max(wake for _, wake, _, _ in records).date().isoformat())
+"""
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def start_server(server, env, timeout=30):
+    """Spawn the app with the given server and return (process, port) once it answers"""
+    port = _free_port()
+    command = SERVERS[server] + (['--port', str(port)] if server == 'asgi' else [])
+    process = subprocess.Popen(command, cwd=ROOT, env=dict(env, PORT=str(port)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Serwer zakończył się z kodem {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + '/active_nap', timeout=timeout) as response:
+                if response.status == 200:
+                    return process, port
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError(f"Brak odpowiedzi serwera po {timeout} s")
+
+
+def locked_counts(port):
+    """sleep_tracker_db_locked_total per route label, read from /metrics"""
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=30) as response:
+        metrics = response.read().decode('utf-8')
+    return {
+        route: int(float(value))
+        for route, value in re.findall(r'^sleep_tracker_db_locked_total\{route="([^"]*)"\} (\S+)$', metrics, re.M)
+    }
+
+
+def load_recent_records(port, last_day):
+    """Records of the last RECENT_DAYS days of history from /api/naps - the ones caregivers edit and rate"""
+    records = []
+    for days_ago in range(RECENT_DAYS):
+        day = last_day - timedelta(days=days_ago)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/naps?date={day.isoformat()}", timeout=30) as response:
+            records += json.loads(response.read())['records']
+    return records
+
+
+def _form_time(value):
+    return datetime.fromisoformat(value).strftime('%Y-%m-%dT%H:%M')
+
+
+class Caregiver:
+    """One virtual user: a keep-alive connection and a loop of weighted actions until the deadline"""
+
+    def __init__(self, port, rng, records, last_day, think, stats):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.rng, self.records, self.last_day, self.think, self.stats = rng, records, last_day, think, stats
+        self.nights = [record for record in records if record['type'] == 'night']
+
+    def request(self, route, method, path, form=None, json_body=None):
+        """Send one request and record its latency and outcome under `route`"""
+        headers = {}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            text = response.read().decode('utf-8', 'replace')
+        except (OSError, http.client.HTTPException) as e:
+            # Nowe połączenie przy następnym żądaniu
+            self.connection.close()
+            self.stats.record(route, time.perf_counter() - started, 'error', type(e).__name__)
+            return None
+        elapsed = time.perf_counter() - started
+        if _LOCKED in text:
+            outcome, detail = 'error', _LOCKED
+        elif response.status >= 500 or (response.status == 200 and _ERROR_PAGE.search(text)):
+            outcome, detail = 'error', f"HTTP {response.status}"
+        elif response.status >= 400 or (method == 'POST' and response.status == 200 and form is not None):
+            # Formularz pokazany ponownie z komunikatem (np. nakładanie się wpisów) zamiast przekierowania
+            outcome, detail = 'rejected', f"HTTP {response.status}"
+        else:
+            outcome, detail = 'ok', None
+        self.stats.record(route, elapsed, outcome, detail)
+        return response.status
+
+    def pause(self):
+        if self.think:
+            time.sleep(self.rng.uniform(0, 2 * self.think))
+
+    def browse(self):
+        day = self.last_day - timedelta(days=self.rng.randrange(RECENT_DAYS))
+        self.request('index', 'GET', f'/?date={day.isoformat()}')
+
+    def nap(self):
+        if self.request('start_nap', 'POST', '/start_nap', json_body={}) == 200:
+            self.pause()
+            self.request('stop_nap', 'POST', '/stop_nap', json_body={})
+
+    def add(self):
+        # Zapomniany sen sprzed kilku dni, o losowej godzinie
+        sleep_time = datetime.combine(self.last_day, datetime.min.time()) - timedelta(
+            days=self.rng.randrange(1, RECENT_DAYS), minutes=self.rng.randrange(24 * 60)
+        )
+        wake_time = sleep_time + timedelta(minutes=self.rng.choice([20, 45, 90]))
+        self.request('add_record', 'POST', '/add', form={
+            'sleep_time': sleep_time.strftime('%Y-%m-%dT%H:%M'),
+            'wake_time': wake_time.strftime('%Y-%m-%dT%H:%M'),
+            'notes': self.rng.choice(NOTES),
+        })
+
+    def edit(self):
+        if not self.records:
+            return self.browse()
+        record = self.rng.choice(self.records)
+        # Te same godziny, inna notatka - zmiana przechodzi przez wyzwalacze indeksu wyszukiwania
+        self.request('edit_record', 'POST', f"/edit_record/{record['id']}", form={
+            'sleep_time': _form_time(record['sleep_time']),
+            'wake_time': _form_time(record['wake_time']),
+            'notes': self.rng.choice(NOTES),
+        })
+
+    def rate(self):
+        if not self.nights:
+            return self.browse()
+        record = self.rng.choice(self.nights)
+        self.request('rate_sleep', 'POST', f"/rate_sleep/{record['id']}", form={'rating': self.rng.randint(1, 5)})
+
+    def run(self, deadline):
+        names = [name for name, _ in OPERATIONS]
+        weights = [weight for _, weight in OPERATIONS]
+        try:
+            # Opiekunowie nie zaczynają w tej samej milisekundzie
+            self.pause()
+            while time.perf_counter() < deadline:
+                getattr(self, self.rng.choices(names, weights)[0])()
+                self.pause()
+        finally:
+            self.connection.close()
+
+
+class RouteStats:
+    """Latencies and outcomes per route, shared by all caregiver threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.details = defaultdict(Counter)
+
+    def record(self, route, seconds, outcome, detail=None):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.outcomes[route][outcome] += 1
+            if detail is not None:
+                self.details[route][detail] += 1
+
+
+def _summary(latencies, outcomes, seconds):
+    count = len(latencies)
+    return {
+        'requests': count,
+        'throughput_rps': round(count / seconds, 1),
+        'latency_ms': {
+            'p50': round(statistics.median(latencies) * 1000, 1),
+            'p95': round(_percentile(latencies, 0.95) * 1000, 1),
+            'p99': round(_percentile(latencies, 0.99) * 1000, 1),
+            'max': round(max(latencies) * 1000, 1),
+        } if latencies else None,
+        'ok': outcomes['ok'],
+        'rejected': outcomes['rejected'],
+        'errors': outcomes['error'],
+        'error_rate': round(outcomes['error'] / count, 4) if count else 0.0,
+    }
+
+
+def _drive(port, last_day, users, duration, think, seed):
+    records = load_recent_records(port, last_day)
+    locked_before = locked_counts(port)
+    stats = RouteStats()
+    caregivers = [Caregiver(port, random.Random(seed * 100003 + i), records, last_day, think, stats)
+                  for i in range(users)]
+
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [threading.Thread(target=caregiver.run, args=(deadline,), daemon=True) for caregiver in caregivers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    locked_after = locked_counts(port)
+    server_locked = {route: locked_after[route] - locked_before.get(route, 0)
+                     for route in locked_after if locked_after[route] != locked_before.get(route, 0)}
+    routes = {}
+    for route in ROUTES:
+        routes[route] = dict(
+            _summary(stats.latencies[route], stats.outcomes[route], seconds),
+            database_locked=stats.details[route][_LOCKED],
+            server_database_locked=server_locked.get(route, 0),
+            details=dict(stats.details[route]),
+        )
+    all_latencies = [value for route in ROUTES for value in stats.latencies[route]]
+    all_outcomes = sum((stats.outcomes[route] for route in ROUTES), Counter())
+    return {
+        'seconds': round(seconds, 2),
+        'total': dict(
+            _summary(all_latencies, all_outcomes, seconds),
+            database_locked=sum(route['database_locked'] for route in routes.values()),
+            server_database_locked=sum(server_locked.values()),
+        ),
+        'routes': routes,
+        # Blokady poza trasami z ROUTES, np. '-' dla zadań w tle
+        'server_database_locked_other': {route: count for route, count in server_locked.items() if route not in ROUTES},
+    }
+
+
+def run_load_test(users=20, duration=30, think=0.2, history=5000, server='flask', overlap_policy='flag', seed=0,
+                  log=print):
+    """Run the caregiver load test on a fresh database, returns the results document"""
+    workdir = tempfile.mkdtemp(prefix='sleep_tracker_caregivers_')
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(workdir, 'load.db'),
+        'ARCHIVE_DIR': os.path.join(workdir, 'archive'),
+        'JINJA_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'TENANT_MODE': 'False',
+        'FLASK_DEBUG': 'False',
+        'OVERLAP_POLICY': overlap_policy,
+    })
+    process = None
+    try:
+        seeded = subprocess.run([sys.executable, '-c', _SEED_SCRIPT, str(history), str(seed)], cwd=ROOT, env=env,
+                                check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        last_day = date.fromisoformat(seeded.stdout.split()[-1])
+        process, port = start_server(server, env)
+        result = _drive(port, last_day, users, duration, think, seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = result['total']
+    log(f"  {total['requests']} żądań w {result['seconds']} s ({total['throughput_rps']}/s), "
+        f"odrzucone {total['rejected']}, błędy {total['errors']}, "
+        f"'database is locked' {total['database_locked']} (serwer: {total['server_database_locked']})")
+    for route, summary in result['routes'].items():
+        latency = summary['latency_ms']
+        if latency is None:
+            continue
+        log(f"  {route:<12} {summary['requests']:>6} żądań  p50 {latency['p50']:>7} ms  p95 {latency['p95']:>7} ms  "
+            f"p99 {latency['p99']:>7} ms  błędy {summary['error_rate']:.1%}  locked {summary['database_locked']}")
+    return {
+        'meta': {
+            'users': users,
+            'duration': duration,
+            'think': think,
+            'history': history,
+            'server': server,
+            'overlap_policy': overlap_policy,
+            'seed': seed,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        },
+        'results': result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test obciążeniowy: wielu opiekunów korzysta z aplikacji naraz.")
+    parser.add_argument('--users', type=int, default=20, help="Liczba wirtualnych opiekunów")
+    parser.add_argument('--duration', type=float, default=30, help="Czas trwania testu w sekundach")
+    parser.add_argument('--think', type=float, default=0.2,
+                        help="Średnia przerwa między czynnościami opiekuna w sekundach (0 = bez przerw)")
+    parser.add_argument('--history', type=int, default=5000, help="Liczba wpisów w wygenerowanej historii")
+    parser.add_argument('--server', choices=sorted(SERVERS), default='flask',
+                        help="flask: python app.py (wątek na połączenie), asgi: uvicorn asgi:application")
+    parser.add_argument('--overlap-policy', choices=('reject', 'flag', 'merge'), default='flag',
+                        help="OVERLAP_POLICY serwera; przy 'reject' większość zapisów odbija się od historii")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    document = run_load_test(args.users, args.duration, args.think, args.history, args.server, args.overlap_policy,
+                             args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(document, output, indent=2)
+        print(f"Zapisano wyniki do {args.output}")
+    if document['results']['total']['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import json
+from datetime import timedelta
+
+from app import ActiveNap, SleepRecord, db, get_current_local_time, nap_events
+
+
+def read_event(chunks):
+    chunk = next(chunks)
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode()
+    assert chunk.startswith('data: ')
+    return json.loads(chunk[len('data: '):])
+
+
+def test_start_nap_is_shared_between_devices(client):
+    first = client.post('/start_nap').get_json()
+    second = client.post('/start_nap').get_json()
+    assert first['nap_id'] == second['nap_id']
+    assert first['start_time'] == second['start_time']
+    assert ActiveNap.query.count() == 1
+
+    state = client.get('/active_nap').get_json()
+    assert state['active'] and state['nap_id'] == first['nap_id']
+
+
+def test_stop_nap_uses_server_start_time(client):
+    start = get_current_local_time().replace(tzinfo=None, microsecond=0) - timedelta(minutes=40)
+    db.session.add(ActiveNap(start_time=start))
+    db.session.commit()
+
+    # Czas z klienta jest ignorowany, gdy drzemka jest zapisana na serwerze
+    response = client.post('/stop_nap', json={'start_time': '2000-01-01T10:00:00Z'})
+    assert response.get_json()['is_night_sleep'] is False
+    assert SleepRecord.query.one().sleep_time == start
+    assert ActiveNap.query.count() == 0
+    assert client.get('/active_nap').get_json()['active'] is False
+
+
+def test_stop_nap_without_active_nap_or_start_time(client):
+    assert client.post('/stop_nap', json={}).status_code == 400
+
+
+def test_stream_pushes_start_and_stop_events(app, client):
+    response = client.get('/naps/stream', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+
+    assert read_event(chunks)['active'] is False
+    assert nap_events.subscriber_count(None) == 1
+
+    started = client.post('/start_nap').get_json()
+    event = read_event(chunks)
+    assert (event['event'], event['active'], event['nap_id']) == ('start', True, started['nap_id'])
+    assert event['start_time'] == started['start_time']
+
+    client.post('/stop_nap', json={})
+    event = read_event(chunks)
+    assert (event['event'], event['active']) == ('stop', False)
+    assert event['record_id'] == SleepRecord.query.one().id
+
+    response.close()
+    assert nap_events.subscriber_count(None) == 0
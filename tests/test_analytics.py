@@ -0,0 +1,89 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import analytics
+from app import (RollingSleepStats, SleepRecord, bulk_insert_records, db, get_current_local_time, job_queue,
+                 recompute_rolling_stats, rebuild_daily_summary, rolling_sleep_stats, update_rolling_stats,
+                 verify_daily_summary)
+
+
+def form_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M')
+
+
+def test_wake_windows_belong_to_the_next_sleep():
+    def epoch(*args):
+        return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+    rows = [
+        (epoch(2024, 1, 1, 20, 0), epoch(2024, 1, 2, 6, 0), 'd2'),
+        (epoch(2024, 1, 2, 9, 0), epoch(2024, 1, 2, 10, 0), 'd2'),
+        (epoch(2024, 1, 2, 9, 30), epoch(2024, 1, 2, 11, 0), 'd2'),  # nakłada się - bez okna
+    ]
+    windows = analytics.wake_windows(rows, previous_wake=epoch(2024, 1, 1, 17, 0))
+    assert windows == {'d2': {'wake_window_count': 2, 'wake_window_seconds': 3 * 3600 + 3 * 3600}}
+
+
+def test_incremental_state_matches_full_recompute(app, client, monkeypatch):
+    # Losowe zapisy, także nakładające się, w ostatnich 40 dniach
+    monkeypatch.setitem(app.config, 'OVERLAP_POLICY', 'flag')
+    rng = random.Random(18)
+    now = get_current_local_time().replace(tzinfo=None, second=0, microsecond=0)
+    today = now.date()
+
+    def random_interval():
+        start = now - timedelta(minutes=rng.randrange(60, 40 * 24 * 60))
+        return start, start + timedelta(minutes=rng.choice([30, 90, 200, 600]))
+
+    bulk_insert_records([random_interval() + ('', None) for _ in range(20)])
+    for step in range(60):
+        ids = [record_id for record_id, in db.session.query(SleepRecord.id)]
+        operation = rng.choice(['add', 'add', 'edit', 'delete', 'stop'])
+        if operation == 'add':
+            sleep_time, wake_time = random_interval()
+            client.post('/add', data={'sleep_time': form_time(sleep_time), 'wake_time': form_time(wake_time), 'notes': ''})
+        elif operation == 'edit' and ids:
+            sleep_time, wake_time = random_interval()
+            client.post(f'/edit_record/{rng.choice(ids)}', data={
+                'sleep_time': form_time(sleep_time), 'wake_time': form_time(wake_time), 'notes': ''
+            })
+        elif operation == 'delete' and ids:
+            client.post(f'/delete_record/{rng.choice(ids)}')
+        elif operation == 'stop':
+            client.post('/stop_nap', json={'start_time': (now - timedelta(minutes=rng.randrange(5, 200))).isoformat()})
+        job_queue.drain()
+        db.session.expire_all()
+        assert rolling_sleep_stats(today) == recompute_rolling_stats(today), (step, operation)
+    assert verify_daily_summary() == []
+
+    # Kolejne dni: okna przesuwane bez zapisu i z zapisem
+    for days_later in (1, 5, 29, 45):
+        later = today + timedelta(days=days_later)
+        assert rolling_sleep_stats(later) == recompute_rolling_stats(later)
+    update_rolling_stats(db.session.connection(), {}, today=today + timedelta(days=3))
+    assert db.session.get(RollingSleepStats, 7).end_day == today + timedelta(days=3)
+    assert rolling_sleep_stats(today + timedelta(days=4)) == recompute_rolling_stats(today + timedelta(days=4))
+
+
+def test_rolling_stats_json_index_and_rebuild(app, client):
+    today = get_current_local_time().date()
+    yesterday = today - timedelta(days=1)
+    bulk_insert_records([
+        (datetime.combine(yesterday, datetime.min.time()) - timedelta(hours=4),
+         datetime.combine(yesterday, datetime.min.time()) + timedelta(hours=6), '', 4),
+        (datetime.combine(yesterday, datetime.min.time()) + timedelta(hours=9),
+         datetime.combine(yesterday, datetime.min.time()) + timedelta(hours=10, minutes=30), '', None),
+    ])
+    data = client.get('/api/rolling_stats').get_json()
+    week = data['windows'][0]
+    assert (week['days'], week['tracked_days']) == (7, 2)
+    assert week['avg_total_sleep_seconds'] == (10 * 3600 + 90 * 60) // 2
+    assert (week['avg_nap_count'], week['avg_wake_window_seconds'], week['avg_sleep_rating']) == (0.5, 3 * 3600, 4)
+    assert client.get('/api/rolling_stats?mode=recompute').get_json()['windows'] == data['windows']
+    assert client.get('/api/rolling_stats?mode=x').status_code == 400
+    assert 'Okno aktywności' in client.get('/').get_data(as_text=True)
+
+    db.session.query(RollingSleepStats).delete()
+    db.session.commit()
+    rebuild_daily_summary()
+    assert rolling_sleep_stats(today) == data['windows']
@@ -0,0 +1,229 @@
+import io
+import json
+from datetime import date, datetime
+
+import app as app_module
+from app import (DailySleepSummary, SleepRecord, classify_sleep, db, job_queue,
+                 rebuild_daily_summary, verify_daily_summary)
+from conftest import add
+from page_cache import LRUCache
+
+
+def test_classify_sleep_nap_belongs_to_start_day():
+    duration, is_nap, day = classify_sleep(datetime(2024, 1, 1, 23, 0), datetime(2024, 1, 2, 1, 0))
+    assert (duration, is_nap, day) == (7200, True, date(2024, 1, 1))
+
+
+def test_classify_sleep_night_belongs_to_wake_day():
+    duration, is_nap, day = classify_sleep(datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 6, 0))
+    assert (duration, is_nap, day) == (36000, False, date(2024, 1, 2))
+
+
+def test_derived_fields_follow_edits(app):
+    record = add(datetime(2024, 1, 1, 12, 0), datetime(2024, 1, 1, 13, 0))
+    assert record.is_nap and record.day == date(2024, 1, 1)
+
+    record.sleep_time = datetime(2024, 1, 1, 19, 0)
+    record.wake_time = datetime(2024, 1, 2, 7, 0)
+    db.session.commit()
+    assert not record.is_nap
+    assert record.day == date(2024, 1, 2)
+    assert record.duration_seconds == 12 * 3600
+
+
+def test_index_shows_records_of_attribution_day(client):
+    add(datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 6, 0), 'Noc')
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 30), 'Rano')
+    add(datetime(2024, 1, 2, 23, 0), datetime(2024, 1, 3, 0, 30), 'Późna')
+    add(datetime(2024, 1, 2, 20, 0), datetime(2024, 1, 3, 6, 0), 'Następna noc')
+
+    html = client.get('/?date=2024-01-02').get_data(as_text=True)
+    assert 'Noc' in html and 'Rano' in html and 'Późna' in html
+    assert 'Następna noc' not in html
+    assert 'Liczba drzemek: 2' in html
+    assert '3h 0min' in html
+
+
+def test_nap_labels_are_numbered_at_read_time(client):
+    first = add(datetime(2024, 1, 2, 9, 0), datetime(2024, 1, 2, 10, 0))
+    add(datetime(2024, 1, 2, 13, 0), datetime(2024, 1, 2, 14, 0), 'Drzemka nr 7')
+    add(datetime(2024, 1, 2, 16, 0), datetime(2024, 1, 2, 16, 30), 'W samochodzie')
+    add(datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 6, 0))
+
+    html = client.get('/?date=2024-01-02').get_data(as_text=True)
+    assert 'Drzemka nr 1' in html and 'Drzemka nr 2' in html
+    assert 'Drzemka nr 7' not in html
+    assert 'W samochodzie' in html and 'Sen nocny' in html
+
+    client.post(f'/delete_record/{first.id}')
+    html = client.get('/?date=2024-01-02').get_data(as_text=True)
+    assert 'Drzemka nr 1' in html and 'Drzemka nr 2' not in html
+
+
+def test_stop_nap_stores_no_baked_label(client):
+    response = client.post('/stop_nap', json={'start_time': '2024-01-02T10:00:00+01:00'})
+    assert response.get_json()['status'] == 'success'
+    assert SleepRecord.query.one().notes == ''
+
+
+def summary(day):
+    row = db.session.get(DailySleepSummary, day)
+    return row and (row.nap_count, row.nap_seconds, row.night_count, row.night_seconds)
+
+
+def test_summary_follows_add_edit_and_delete(client):
+    client.post('/add', data={'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': ''})
+    client.post('/add', data={'sleep_time': '2024-01-01T20:00', 'wake_time': '2024-01-02T06:00', 'notes': ''})
+    assert summary(date(2024, 1, 2)) == (1, 3600, 1, 36000)
+
+    nap = SleepRecord.query.filter_by(is_nap=True).one()
+    client.post(f'/edit_record/{nap.id}', data={'sleep_time': '2024-01-03T10:00', 'wake_time': '2024-01-03T12:00', 'notes': ''})
+    db.session.expire_all()
+    assert summary(date(2024, 1, 2)) == (0, 0, 1, 36000)
+    assert summary(date(2024, 1, 3)) == (1, 7200, 0, 0)
+
+    client.post(f'/delete_record/{nap.id}')
+    job_queue.drain()
+    db.session.expire_all()
+    assert summary(date(2024, 1, 3)) is None
+    assert verify_daily_summary() == []
+
+
+def test_summary_tracks_night_ratings(client):
+    night = add(datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 6, 0))
+    client.post(f'/rate_sleep/{night.id}', data={'rating': '4'})
+    db.session.expire_all()
+    row = db.session.get(DailySleepSummary, date(2024, 1, 2))
+    assert (row.rating_count, row.rating_sum) == (1, 4)
+
+
+def test_rebuild_and_verify_summary(app):
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0))
+    db.session.execute(DailySleepSummary.__table__.delete())
+    db.session.commit()
+    assert verify_daily_summary() == [date(2024, 1, 2)]
+    assert rebuild_daily_summary() == 1
+    assert verify_daily_summary() == []
+
+
+def test_api_stats_weekly_buckets(client):
+    add(datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 6, 0))
+    night = add(datetime(2024, 1, 2, 20, 0), datetime(2024, 1, 3, 6, 0))
+    night.sleep_rating = 4
+    db.session.commit()
+    add(datetime(2024, 1, 2, 9, 0), datetime(2024, 1, 2, 10, 0))
+    add(datetime(2024, 1, 8, 12, 0), datetime(2024, 1, 8, 13, 30))
+
+    data = client.get('/api/stats?from=2024-01-01&to=2024-01-14&bucket=week').get_json()
+    first, second = data['buckets']
+    assert first['start'] == '2024-01-01' and second['start'] == '2024-01-08'
+    assert (first['nap_count'], first['nap_seconds']) == (1, 3600)
+    assert (first['night_count'], first['night_seconds']) == (2, 72000)
+    assert first['avg_sleep_rating'] == 4.0
+    # 6:00 -> 9:00 i 10:00 -> 20:00
+    assert first['wake_window_count'] == 2
+    assert first['avg_wake_window_seconds'] == (3 + 10) * 3600 // 2
+    assert (second['nap_count'], second['nap_seconds']) == (1, 5400)
+
+
+def test_api_stats_rejects_bad_bucket(client):
+    assert client.get('/api/stats?bucket=year').status_code == 400
+    assert client.get('/api/stats?from=2024-13-01').status_code == 400
+
+
+def test_export_csv_and_ndjson(client):
+    add(datetime(2024, 1, 1, 20, 0), datetime(2024, 1, 2, 6, 0))
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 30), 'W wózku')
+    add(datetime(2024, 1, 5, 10, 0), datetime(2024, 1, 5, 11, 0))
+
+    response = client.get('/export.csv?from=2024-01-02&to=2024-01-02')
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith('id,sleep_time,wake_time,day,sleep_duration')
+    assert len(lines) == 3
+    assert ',10.0,36000,night,' in lines[1]
+    assert ',1.5,5400,nap,W wózku,' in lines[2]
+
+    rows = [json.loads(line) for line in client.get('/export.ndjson').get_data(as_text=True).splitlines()]
+    assert [row['type'] for row in rows] == ['night', 'nap', 'nap']
+    assert rows[2]['day'] == '2024-01-05'
+
+    assert client.get('/export.xml').status_code == 404
+
+
+def test_import_csv_upload_reports_rejected_rows(client):
+    content = (
+        'sleep_time,wake_time,notes,sleep_rating\n'
+        '2024-01-01T20:00,2024-01-02T06:00,,5\n'
+        '2024-01-02T10:00,2024-01-02T11:00,Drzemka nr 4,\n'
+        '2024-01-02T12:00,2024-01-02T11:00,,\n'
+        '2024-01-02T15:00,2024-01-02T16:00,,3\n'
+        'wczoraj,2024-01-02T16:00,,\n'
+    )
+    response = client.post('/import', data={'file': (io.BytesIO(content.encode()), 'records.csv')})
+    data = response.get_json()
+    assert data['imported'] == 2
+    assert [row['line'] for row in data['rejected']] == [4, 5, 6]
+
+    night, nap = SleepRecord.query.order_by(SleepRecord.sleep_time).all()
+    assert (night.is_nap, night.day, night.sleep_rating, night.is_rated) == (False, date(2024, 1, 2), 5, True)
+    assert (nap.is_nap, nap.notes) == (True, '')
+    assert summary(date(2024, 1, 2)) == (1, 3600, 1, 36000)
+    assert verify_daily_summary() == []
+
+
+def test_import_roundtrips_ndjson_export(client):
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0), 'Spacer')
+    exported = client.get('/export.ndjson').get_data()
+    response = client.post('/import', data={'file': (io.BytesIO(exported), 'records.ndjson')})
+    assert response.get_json()['imported'] == 1
+    assert SleepRecord.query.filter_by(notes='Spacer').count() == 2
+
+
+def test_import_rejects_ndjson_fields_of_the_wrong_type(client):
+    content = '\n'.join(json.dumps(row) for row in [
+        {'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': 5},
+        {'sleep_time': '2024-01-02T12:00', 'wake_time': '2024-01-02T13:00', 'notes': ['Spacer']},
+        {'sleep_time': 1704186000, 'wake_time': '2024-01-02T13:00'},
+        {'sleep_time': '2024-01-01T20:00', 'wake_time': '2024-01-02T06:00', 'sleep_rating': [4]},
+        {'sleep_time': '2024-01-01T20:00', 'wake_time': '2024-01-02T06:00', 'sleep_rating': True},
+        {'sleep_time': '2024-01-02T15:00', 'wake_time': '2024-01-02T16:00', 'notes': None},
+    ])
+    response = client.post('/import', data={'file': (io.BytesIO(content.encode()), 'records.ndjson')})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['imported'] == 1
+    assert [(row['line'], row['message']) for row in data['rejected']] == [
+        (1, "Notatka musi być tekstem."),
+        (2, "Notatka musi być tekstem."),
+        (3, "Niepoprawny format czasu."),
+        (4, "Ocena musi być liczbą."),
+        (5, "Ocena musi być liczbą."),
+    ]
+
+
+def test_create_app_builds_a_separate_app_from_config(app, tmp_path):
+    backend = LRUCache(4)
+    other = app_module.create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'inna.db'),
+        'PAGE_CACHE_BACKEND': backend,
+        'OVERLAP_POLICY': 'flag',
+    })
+    assert other is not app
+    assert other.jinja_env.bytecode_cache is not None
+    with other.app_context():
+        app_module.init_db()
+        client = other.test_client()
+        for _ in range(2):
+            client.post('/add', data={'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': ''})
+        job_queue.drain()
+        assert SleepRecord.query.count() == 2
+        assert client.get('/?date=2024-01-02').status_code == 200
+        assert backend.get('index:2024-01-02') is not None
+        job_queue.shutdown()
+        db.engine.dispose()
+
+    # Aplikacja z conftest ma własną bazę, cache i politykę nakładania się wpisów
+    assert SleepRecord.query.count() == 0
+    assert app_module.page_cache.get('index:2024-01-02') is None
+    assert app.config['OVERLAP_POLICY'] == 'reject'
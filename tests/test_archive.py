@@ -0,0 +1,150 @@
+import json
+import os
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+import app as app_module
+import archive
+import timezones
+from app import (DailySleepSummary, SleepRecord, archive_records, bulk_insert_records, db, export_rows,
+                 import_sleep_records, rebuild_daily_summary, set_time_zone, upgrade_archive, verify_daily_summary)
+
+WARSAW = timezones.get_zone('Europe/Warsaw')
+
+HISTORY = [
+    (datetime(2023, 1, 30, 20, 0), datetime(2023, 1, 31, 6, 30), '', 4),
+    (datetime(2023, 1, 31, 13, 0), datetime(2023, 1, 31, 14, 15), 'W wózku ż', None),
+    (datetime(2023, 1, 31, 19, 45), datetime(2023, 2, 1, 6, 0), '', None),
+    (datetime(2023, 2, 1, 12, 0), datetime(2023, 2, 1, 13, 30), '', None),
+    (datetime(2023, 3, 5, 20, 0), datetime(2023, 3, 6, 5, 45), '', 3),
+]
+
+
+def export_lines(client, query=''):
+    return client.get('/export.ndjson' + query).get_data(as_text=True).splitlines()
+
+
+def test_archived_months_are_read_by_stats_and_export(app, client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_DIR', str(tmp_path))
+    bulk_insert_records(HISTORY)
+    stats_query = '/api/stats?from=2023-01-01&to=2023-03-31&bucket=week'
+    stats_before = client.get(stats_query).get_json()
+    export_before = export_lines(client)
+
+    assert archive_records(date(2023, 3, 20)) == {'2023-01': 2, '2023-02': 2}
+    assert sorted(os.listdir(tmp_path)) == ['2023-01.col', '2023-02.col']
+    assert SleepRecord.query.count() == 1
+    assert db.session.get(DailySleepSummary, date(2023, 1, 31)).nap_count == 1
+
+    assert client.get(stats_query).get_json() == stats_before
+    assert export_lines(client) == export_before
+    assert [json.loads(line)['notes'] for line in export_lines(client, '?from=2023-01-31&to=2023-01-31')] == ['', 'W wózku ż']
+    assert verify_daily_summary() == []
+    assert rebuild_daily_summary() == 3
+    assert verify_daily_summary() == []
+
+
+def test_late_records_are_merged_into_the_month_file(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_DIR', str(tmp_path))
+    bulk_insert_records(HISTORY[:2])
+    archive_records(date(2023, 2, 1))
+    bulk_insert_records([(datetime(2023, 1, 10, 10, 0), datetime(2023, 1, 10, 11, 0), '', None)])
+    assert archive_records(date(2023, 2, 1)) == {'2023-01': 1}
+
+    month = archive.MonthArchive(archive.month_path(str(tmp_path), '2023-01'))
+    assert [row['sleep_time'] for row in month.rows(WARSAW)] == [
+        datetime(2023, 1, 10, 10, 0), datetime(2023, 1, 30, 20, 0), datetime(2023, 1, 31, 13, 0)
+    ]
+    assert SleepRecord.query.count() == 0
+    assert verify_daily_summary() == []
+
+
+def test_archived_days_are_read_only_and_not_shown_in_the_day_view(app, client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_DIR', str(tmp_path))
+    bulk_insert_records(HISTORY)
+    archive_records(date(2023, 3, 20))
+
+    # Dzień z archiwum i drzemka nakładająca się na zarchiwizowaną (12:00-13:30)
+    for sleep_time, wake_time in (('2023-02-28T10:00', '2023-02-28T11:00'), ('2023-02-01T13:00', '2023-02-01T14:00')):
+        response = client.post('/add', data={'sleep_time': sleep_time, 'wake_time': wake_time, 'notes': ''})
+        assert 'Dni do 28.02.2023 są w archiwum' in response.get_data(as_text=True)
+    # Sen nocny kończący się już po archiwum
+    client.post('/add', data={'sleep_time': '2023-02-28T20:00', 'wake_time': '2023-03-01T06:00', 'notes': ''})
+    assert SleepRecord.query.count() == 2
+    result = import_sleep_records('csv', [
+        'sleep_time,wake_time,notes,sleep_rating', '2023-01-15T13:00,2023-01-15T14:00,,', '2023-03-02T13:00,2023-03-02T14:00,,',
+    ])
+    assert (result['imported'], [line for line, _ in result['rejected']]) == (1, [2])
+
+    assert 'dostępne tylko w' in client.get('/?date=2023-01-31').get_data(as_text=True)
+    response = client.get('/api/naps?date=2023-01-31')
+    assert response.status_code == 410
+    assert 'archiwum' in response.get_json()['message']
+    assert client.get('/api/naps?date=2023-03-01').get_json()['records'][0]['sleep_time'].startswith('2023-02-28T20:00')
+
+
+def epoch(local):
+    return timezones.to_epoch(local, WARSAW)
+
+
+def test_month_file_roundtrip(tmp_path):
+    rows = [
+        {'id': 7, 'sleep_time': datetime(2023, 5, 1, 20, 0, 30), 'wake_time': datetime(2023, 5, 2, 6, 0),
+         'notes': None, 'sleep_rating': 5, 'is_rated': True, 'created_at': None,
+         'duration_seconds': 35970, 'is_nap': False, 'day': date(2023, 5, 2)},
+        {'id': 9, 'sleep_time': datetime(2023, 5, 2, 13, 0), 'wake_time': datetime(2023, 5, 2, 14, 0),
+         'notes': 'Drzemka w foteliku', 'sleep_rating': None, 'is_rated': False,
+         'created_at': datetime(2023, 5, 2, 14, 1), 'duration_seconds': 3600, 'is_nap': True, 'day': date(2023, 5, 2)},
+    ]
+    stored = [dict(row, sleep_time=epoch(row['sleep_time']), wake_time=epoch(row['wake_time'])) for row in rows]
+    path = archive.month_path(str(tmp_path), '2023-05')
+    archive.write_month(path, archive.columns_from_rows(stored))
+    month = archive.MonthArchive(path)
+    assert list(month.rows(WARSAW)) == [dict(rows[0], notes=''), rows[1]]
+    sleep_times, _, durations, is_nap, days, ratings = month.stats_columns(date(2023, 5, 2), date(2023, 5, 2))
+    # 20:00:30 czasu letniego w Warszawie to 18:00:30 UTC
+    assert sleep_times[0] == datetime(2023, 5, 1, 18, 0, 30, tzinfo=timezone.utc).timestamp()
+    assert list(durations) == [35970, 3600] and list(is_nap) == [False, True]
+    assert list(days) == [np.datetime64('2023-05-02')] * 2
+    assert ratings[0] == 5 and ratings[1] != ratings[1]
+
+
+def test_archived_instants_keep_the_repeated_hour_and_survive_a_zone_change(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module, '_time_zones', {})
+    # Drzemka w powtórzonej godzinie zmiany czasu (druga 02:30)
+    nap = (datetime(2024, 10, 27, 2, 30, fold=1), datetime(2024, 10, 27, 3, 30), '', None)
+    bulk_insert_records([nap])
+    instants = [tuple(row) for row in db.session.execute(text("SELECT sleep_time, wake_time FROM sleep_records"))]
+    archive_records(date(2024, 11, 1))
+
+    sleep_time = next(export_rows())['sleep_time']
+    assert (sleep_time, sleep_time.fold) == (nap[0], 1)
+    set_time_zone('Europe/London')
+    month = archive.MonthArchive(archive.month_path(str(tmp_path), '2024-10'))
+    assert [(row[0], row[1]) for row in month.window_rows()] == instants
+    assert next(export_rows())['sleep_time'] == datetime(2024, 10, 27, 1, 30)
+
+
+def test_old_month_files_are_upgraded_to_utc_times(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_DIR', str(tmp_path))
+    nap = {'id': 1, 'sleep_time': datetime(2023, 7, 1, 13, 0), 'wake_time': datetime(2023, 7, 1, 14, 0),
+           'notes': '', 'sleep_rating': None, 'is_rated': False, 'created_at': None,
+           'duration_seconds': 3600, 'is_nap': True, 'day': date(2023, 7, 1)}
+    # Pierwszy format: nagłówek SLPARCH1 i czas lokalny w mikrosekundach
+    columns = archive.columns_from_rows([dict(nap, sleep_time=0, wake_time=0)])
+    for name in ('sleep_time', 'wake_time'):
+        columns[name] = np.array([archive._epoch_microseconds(nap[name])])
+    path = archive.month_path(str(tmp_path), '2023-07')
+    archive.write_month(path, columns)
+    with open(path, 'r+b') as f:
+        f.write(archive._LOCAL_TIME_MAGIC)
+    with pytest.raises(ValueError, match='old format'):
+        archive.MonthArchive(path)
+
+    upgrade_archive(None, WARSAW)
+    upgrade_archive(None, WARSAW)
+    assert list(archive.MonthArchive(path).rows(WARSAW)) == [nap]
@@ -0,0 +1,63 @@
+import gzip
+from datetime import datetime
+
+import assets
+from conftest import add
+
+
+def test_accepted_encoding_respects_quality_values():
+    assert assets.accepted_encoding(None) is None
+    assert assets.accepted_encoding('gzip, deflate') == 'gzip'
+    assert assets.accepted_encoding('gzip;q=0, identity') is None
+    assert assets.accepted_encoding('*') == assets.ENCODINGS[0]
+
+
+def test_manifest_names_change_with_content(tmp_path):
+    (tmp_path / 'style.css').write_text('body { color: red; }' * 50)
+    first = assets.AssetManifest(str(tmp_path)).url_name('style.css')
+    (tmp_path / 'style.css').write_text('body { color: blue; }' * 50)
+    second = assets.AssetManifest(str(tmp_path)).url_name('style.css')
+    assert first != second
+    assert first.startswith('style.') and first.endswith('.css')
+    assert assets.AssetManifest(str(tmp_path)).url_name('missing.js') == 'missing.js'
+
+
+def test_pages_link_fingerprinted_assets_served_as_immutable(client):
+    html = client.get('/?date=2024-01-02').get_data(as_text=True)
+    href = html.split('rel="stylesheet" href="')[1].split('"')[0]
+    assert href != '/static/style.css' and href.startswith('/static/style.')
+
+    response = client.get(href, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert gzip.decompress(response.get_data()) == client.get('/static/style.css').get_data()
+
+    # Stara nazwa bez hasha nadal działa, ale jest zwykłym, rewalidowanym plikiem
+    plain = client.get('/static/style.css')
+    assert plain.status_code == 200 and 'immutable' not in plain.headers.get('Cache-Control', '')
+
+
+def test_html_is_compressed_and_etag_still_gives_304(client):
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0))
+
+    plain = client.get('/?date=2024-01-02')
+    response = client.get('/?date=2024-01-02', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    assert response.headers['ETag'].startswith('W/')
+
+    cached = client.get('/?date=2024-01-02', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']
+    })
+    assert cached.status_code == 304
+
+
+def test_small_and_streamed_responses_are_not_compressed(client):
+    response = client.get('/active_nap', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0))
+    response = client.get('/export.csv', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
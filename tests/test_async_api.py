@@ -0,0 +1,64 @@
+import asyncio
+from datetime import timedelta
+
+import httpx
+
+import asgi
+from app import app as flask_app, bulk_insert_records, get_current_local_time, job_queue, verify_daily_summary
+from load_test_async import run_load_test
+
+
+def run_async_client(scenario):
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.application)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                return await scenario(client)
+        finally:
+            await asgi.dispose_databases()
+    return asyncio.run(main())
+
+
+def test_async_api_shares_the_flask_write_path(app):
+    now = get_current_local_time().replace(tzinfo=None, microsecond=0)
+    bulk_insert_records([(now - timedelta(hours=30), now - timedelta(hours=20), '', None)])
+
+    async def scenario(client):
+        assert (await client.post('/start_nap')).json()['status'] == 'success'
+        # Wiele urządzeń kończy tę samą drzemkę naraz - zapisuje się dokładnie jedna
+        stops = await asyncio.gather(*(client.post('/stop_nap', json={}) for _ in range(20)))
+        assert sorted(response.status_code for response in stops) == [200] + [400] * 19
+        listing = (await client.get('/api/naps')).json()
+        day = (await client.get(f"/api/naps?date={(now - timedelta(hours=20)).date()}")).json()['records']
+        night_id = next(record['id'] for record in day if record['type'] == 'night')
+        rated = await client.post(f"/api/naps/{night_id}/rate", json={'rating': 4})
+        rejected = await client.post(f"/api/naps/{night_id}/rate", json={'rating': 9})
+        missing = await client.post('/api/naps/999/rate', json={'rating': 3})
+        page = await client.get('/')
+        return listing, rated, rejected, missing, page
+
+    listing, rated, rejected, missing, page = run_async_client(scenario)
+    assert [record['label'] for record in listing['records'] if record['type'] == 'nap'][-1] == 'Drzemka nr 1'
+    assert listing['active_nap']['active'] is False
+    assert rated.json()['record']['sleep_rating'] == 4
+    assert (rejected.status_code, missing.status_code) == (400, 404)
+    assert page.status_code == 200 and 'Śledzenie Snu Dziecka' in page.text
+    job_queue.drain()
+    assert verify_daily_summary() == []
+
+
+def test_requests_wait_for_connections_without_threads(app):
+    asgi.IN_FLIGHT_PEAK.set(0)
+
+    async def scenario(client):
+        return await asyncio.gather(*(client.get('/api/naps') for _ in range(300)))
+
+    responses = run_async_client(scenario)
+    assert all(response.status_code == 200 for response in responses)
+    assert asgi.IN_FLIGHT_PEAK.value() > flask_app.config['ASYNC_POOL_SIZE']
+
+
+def test_load_test_keeps_requests_in_flight():
+    document = run_load_test(concurrency=200, requests=600, history=300, log=lambda message: None)
+    assert document['results']['errors'] == 0
+    assert document['results']['server_peak_in_flight'] >= 100
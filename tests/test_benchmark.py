@@ -0,0 +1,70 @@
+import time
+from datetime import date
+
+import app as app_module
+from benchmark_routes import ROUTES, compare, run_benchmark
+from benchmark_startup import run_startup_benchmark
+from load_test_caregivers import ROUTES as LOAD_ROUTES, run_load_test
+from synthetic_history import generate_history
+
+
+def test_generate_history_is_seeded_and_valid():
+    records = list(generate_history(500, seed=3))
+    assert records == list(generate_history(500, seed=3))
+    assert len(records) == 500
+    assert all(wake > sleep for sleep, wake, _, _ in records)
+    assert max(wake for _, wake, _, _ in records).date() <= date(2024, 12, 31)
+    # Każdy dzień ma sen nocny i przynajmniej jedną drzemkę
+    assert sum(1 for sleep, wake, _, _ in records if wake - sleep > app_module.NAP_MAX_DURATION) < 250
+
+
+def test_run_benchmark_reports_every_route(app):
+    document = run_benchmark(app_module, [50, 120], repeat=3, log=lambda message: None)
+    assert app_module.SleepRecord.query.count() >= 120
+    for size in ('50', '120'):
+        results = document['results'][size]
+        assert set(results) == set(ROUTES)
+        assert all(result['errors'] == 0 for result in results.values())
+        assert results['index']['queries'] > 0
+        assert results['index_cached']['queries'] < results['index']['queries']
+    app_module.job_queue.drain()
+    assert app_module.verify_daily_summary() == []
+
+
+def test_compare_flags_slower_routes_and_extra_queries():
+    baseline = {'results': {'1000': {'index': {'median_ms': 2.0, 'queries': 3}}}}
+    faster = {'results': {'1000': {'index': {'median_ms': 2.1, 'queries': 3}}}}
+    slower = {'results': {'1000': {'index': {'median_ms': 9.0, 'queries': 4}}}}
+    assert compare(baseline, faster) == []
+    assert len(compare(baseline, slower)) == 2
+
+
+def test_import_keeps_bulk_throughput(app):
+    lines = ['sleep_time,wake_time,notes,sleep_rating'] + [
+        f"{sleep.isoformat()},{wake.isoformat()},{notes},{'' if rating is None else rating}"
+        for sleep, wake, notes, rating in generate_history(20000, seed=5)
+    ]
+    started = time.perf_counter()
+    result = app_module.import_sleep_records('csv', lines, batch_size=5000)
+    elapsed = time.perf_counter() - started
+    assert (result['imported'], result['rejected']) == (20000, [])
+    # Milion wierszy to ok. 55 s na jednym rdzeniu (ok. 18 tys./s); próg z zapasem
+    # na wolne maszyny CI, ale łapie powrót do zapisu wiersz po wierszu
+    assert 20000 / elapsed > 4000, f"{20000 / elapsed:.0f} rows/s"
+    app_module.job_queue.drain()
+    assert app_module.verify_daily_summary() == []
+
+
+def test_startup_benchmark_reaches_first_200():
+    document = run_startup_benchmark(repeat=1, modes=('warm',), log=lambda message: None)
+    assert 0 < document['results']['warm']['median_ms'] < 30000
+
+
+def test_caregiver_load_test_reports_every_route():
+    document = run_load_test(users=8, duration=3, think=0.02, history=300, log=lambda message: None)
+    results = document['results']
+    assert set(results['routes']) == set(LOAD_ROUTES)
+    assert results['total']['errors'] == 0
+    assert results['total']['requests'] == sum(route['requests'] for route in results['routes'].values())
+    assert all(route['requests'] > 0 for route in results['routes'].values())
+    assert results['routes']['stop_nap']['latency_ms']['p99'] >= results['routes']['stop_nap']['latency_ms']['p50']
@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import app as app_module
+from app import SleepRecord, db, get_current_local_time, job_queue, verify_daily_summary
+
+
+def test_sqlite_profile_pragmas(app):
+    connection = db.session.connection()
+    assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+    assert connection.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+    assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+
+
+def test_concurrent_stop_nap_and_reads(app, monkeypatch):
+    # Drzemki celowo na siebie nachodzą - tu sprawdzamy współbieżność, nie politykę nakładania
+    monkeypatch.setitem(app.config, 'OVERLAP_POLICY', 'flag')
+    writers, readers, naps_per_writer = 6, 4, 10
+    errors = []
+
+    def write():
+        client = app.test_client()
+        for _ in range(naps_per_writer):
+            start = (get_current_local_time() - timedelta(minutes=30)).isoformat()
+            response = client.post('/stop_nap', json={'start_time': start})
+            if response.status_code != 200:
+                errors.append(response.get_json())
+
+    def read():
+        client = app.test_client()
+        for _ in range(naps_per_writer):
+            response = client.get('/')
+            if response.status_code != 200 or 'Nie udało się' in response.get_data(as_text=True):
+                errors.append('index')
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    db.session.expire_all()
+    assert SleepRecord.query.count() == writers * naps_per_writer
+    job_queue.drain()
+    assert verify_daily_summary() == []
+
+
+def test_read_only_connections_skip_journal_mode(app, monkeypatch, caplog):
+    # Zmiana trybu dziennika na połączeniu tylko do odczytu kończy się błędem - ostrzeżenie przy każdym połączeniu
+    monkeypatch.setitem(app.config['SQLITE_PRAGMAS'], 'journal_mode', 'DELETE')
+    connection = sqlite3.connect(f"file:{db.engine.url.database}?mode=ro", uri=True,
+                                 factory=app_module.ReadOnlyConnection)
+    app_module._apply_sqlite_pragmas(connection, None)
+    assert connection.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    assert connection.execute('PRAGMA busy_timeout').fetchone() == (5000,)
+    connection.close()
+    assert 'Cannot set PRAGMA' not in caplog.text
+
+
+def test_read_only_pool_serves_get_requests(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQLITE_READ_ONLY_POOL', True)
+    monkeypatch.setattr(app.extensions['sleep_tracker'], 'read_only_engine', None)
+    db.session.add(SleepRecord(sleep_time=datetime(2024, 1, 2, 10, 0), wake_time=datetime(2024, 1, 2, 11, 0)))
+    db.session.commit()
+
+    with app.test_request_context('/?date=2024-01-02'):
+        assert db.session.get_bind() is app_module.get_read_only_engine()
+    with app.test_request_context('/add', method='POST'):
+        assert db.session.get_bind() is db.engine
+
+    client = app.test_client()
+    assert 'Drzemka nr 1' in client.get('/?date=2024-01-02').get_data(as_text=True)
+    client.post('/add', data={'sleep_time': '2024-01-02T13:00', 'wake_time': '2024-01-02T14:00', 'notes': ''})
+    assert 'Drzemka nr 2' in client.get('/?date=2024-01-02').get_data(as_text=True)
+    app_module.get_read_only_engine().dispose()
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+import app as app_module
+from app import (JOBS_TOTAL, DailySleepSummary, DerivedJob, SleepRecord, db, job_queue, queue_job, run_due_jobs,
+                 verify_daily_summary)
+from jobs import JobQueue, retry_delay
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+    assert [retry_delay(attempts, 1, 10) for attempts in range(1, 7)] == [1, 2, 4, 8, 10, 10]
+
+
+def test_submits_during_a_run_coalesce_into_one_more_run():
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def process(channel):
+        runs.append(channel)
+        started.set()
+        release.wait(5)
+
+    queue = JobQueue(process, workers=2)
+    queue.submit('a')
+    assert started.wait(5)
+    for _ in range(10):
+        queue.submit('a')
+    release.set()
+    assert queue.drain(timeout=5)
+    assert runs == ['a', 'a']
+    queue.shutdown()
+
+
+def test_jobs_of_the_same_day_are_merged(app):
+    record = SleepRecord(sleep_time=datetime(2024, 1, 2, 10, 0), wake_time=datetime(2024, 1, 2, 11, 0), notes='')
+    db.session.add(record)
+    db.session.flush()
+    queue_job(db.session, 'wake_windows', '2024-01-02', {'low': '2024-01-02T08:00:00', 'high': '2024-01-02T09:00:00'})
+
+    jobs = DerivedJob.query.filter_by(kind='wake_windows').all()
+    assert [(job.key, json.loads(job.payload)) for job in jobs] == [
+        ('2024-01-02', {'low': '2024-01-02T08:00:00', 'high': '2024-01-02T10:00:00'})
+    ]
+    db.session.rollback()
+
+
+def test_failed_job_is_retried_with_backoff(app, client, monkeypatch):
+    client.post('/add', data={'sleep_time': '2024-01-01T20:00', 'wake_time': '2024-01-02T06:00', 'notes': ''})
+    job_queue.drain()
+    calls = []
+
+    def failing(day, payload):
+        calls.append(day)
+        raise RuntimeError("baza niedostępna")
+
+    monkeypatch.setitem(app_module.JOB_HANDLERS, 'wake_windows', failing)
+    client.post('/add', data={'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': ''})
+    job_queue.drain()
+    assert calls == ['2024-01-02']
+    db.session.expire_all()
+    job = DerivedJob.query.filter_by(kind='wake_windows').one()
+    assert (job.attempts, job.last_error) == (1, "baza niedostępna")
+    assert job.run_after > time.time()
+    assert db.session.get(DailySleepSummary, date(2024, 1, 2)).wake_window_count == 0
+
+    # Po czasie ponowienia zadanie kończy się i znika z tabeli
+    monkeypatch.undo()
+    job.run_after = time.time()
+    db.session.commit()
+    done = JOBS_TOTAL.value('wake_windows', 'done')
+    assert run_due_jobs() is None
+    assert JOBS_TOTAL.value('wake_windows', 'done') == done + 1
+    assert DerivedJob.query.count() == 0
+    assert db.session.get(DailySleepSummary, date(2024, 1, 2)).wake_window_count == 1
+    assert verify_daily_summary() == []
+
+
+def test_job_is_claimed_and_committed_before_its_handler_runs(app, client, monkeypatch):
+    client.post('/add', data={'sleep_time': '2024-01-01T20:00', 'wake_time': '2024-01-02T06:00', 'notes': ''})
+    job_queue.drain()
+    seen = []
+
+    def handler(day, payload):
+        # Inne połączenie może pisać - pobranie zadania nie trzyma blokady zapisu przez całe zadanie
+        connection = sqlite3.connect(db.engine.url.database, timeout=0)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            seen.append(connection.execute("SELECT kind, run_after > ? FROM derived_jobs", (time.time(),)).fetchall())
+            connection.rollback()
+        finally:
+            connection.close()
+
+    monkeypatch.setitem(app_module.JOB_HANDLERS, 'wake_windows', handler)
+    client.post('/add', data={'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': ''})
+    job_queue.drain()
+    # W trakcie zadanie czeka w tabeli z dzierżawą, po sukcesie znika razem z wynikami
+    assert seen == [[('wake_windows', 1)]]
+    assert DerivedJob.query.count() == 0
@@ -0,0 +1,66 @@
+import logging
+from datetime import datetime
+
+from app import REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, SQL_STATEMENTS_TOTAL, TEMPLATE_SECONDS
+from metrics import Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, 'index')
+    histogram.observe(0.5, 'index')
+    histogram.observe(3.0, 'index')
+    text = registry.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{route="index",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="index",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{route="index",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="index"} 3' in text
+
+
+def test_counter_escapes_label_values():
+    registry = Registry()
+    counter = registry.counter('events_total', 'Events', ('name',))
+    counter.inc('say "hi"', amount=2)
+    assert 'events_total{name="say \\"hi\\""} 2' in registry.render()
+
+
+def test_requests_record_latency_sql_and_templates(client):
+    requests_before = REQUEST_SECONDS.count('index', 'GET')
+    statements_before = SQL_STATEMENTS_TOTAL.value('index')
+    renders_before = TEMPLATE_SECONDS.count('index.html')
+
+    client.get('/?date=2024-01-10')
+
+    assert REQUEST_SECONDS.count('index', 'GET') == requests_before + 1
+    assert REQUEST_SQL_STATEMENTS.count('index') > 0
+    assert SQL_STATEMENTS_TOTAL.value('index') > statements_before
+    assert TEMPLATE_SECONDS.count('index.html') == renders_before + 1
+
+
+def test_metrics_endpoint_exposes_prometheus_text(client):
+    client.get('/?date=2024-01-10')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'sleep_tracker_request_duration_seconds_bucket{route="index",method="GET"' in text
+    assert 'sleep_tracker_requests_total{route="index",method="GET",status="200"}' in text
+    assert 'sleep_tracker_template_render_seconds_count{template="index.html"}' in text
+
+
+def test_slow_requests_are_logged_with_sql(app, client, caplog):
+    app.config['SLOW_REQUEST_MS'] = 0.000001
+    try:
+        with caplog.at_level(logging.WARNING, logger=app.logger.name):
+            client.post('/add', data={
+                'sleep_time': datetime(2024, 1, 10, 13, 0).strftime('%Y-%m-%dT%H:%M'),
+                'wake_time': datetime(2024, 1, 10, 14, 0).strftime('%Y-%m-%dT%H:%M'),
+                'notes': '',
+            })
+    finally:
+        app.config['SLOW_REQUEST_MS'] = 0
+    slow = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Slow request POST /add')]
+    assert slow
+    assert 'INSERT INTO sleep_records' in slow[0]
@@ -0,0 +1,182 @@
+import os
+import sqlite3
+
+import pytest
+
+import migrate_db
+
+
+def create_old_database(path, records):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE sleep_records (id INTEGER PRIMARY KEY, sleep_time DATETIME NOT NULL, "
+        "wake_time DATETIME NOT NULL, notes VARCHAR(200), created_at DATETIME)"
+    )
+    connection.executemany("INSERT INTO sleep_records (sleep_time, wake_time, notes) VALUES (?, ?, '')", records)
+    connection.commit()
+    connection.close()
+
+
+def old_records(days):
+    records = []
+    for day in range(1, days + 1):
+        records.append((f'2024-01-{day - 1:02d} 20:00:00.000000' if day > 1 else '2023-12-31 20:00:00.000000',
+                        f'2024-01-{day:02d} 06:30:00.000000'))
+        records.append((f'2024-01-{day:02d} 10:00:00.000000', f'2024-01-{day:02d} 11:30:00.000000'))
+    return records
+
+
+def test_database_path_from_url(monkeypatch):
+    assert migrate_db.database_path_from_url('sqlite:///sleep_tracker.db') == os.path.join(
+        migrate_db.INSTANCE_DIR, 'sleep_tracker.db'
+    )
+    assert migrate_db.database_path_from_url('sqlite:////data/sen.db') == '/data/sen.db'
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:////srv/rodzina.db')
+    assert migrate_db.database_path_from_url() == '/srv/rodzina.db'
+    with pytest.raises(ValueError):
+        migrate_db.database_path_from_url('postgresql://localhost/sen')
+
+
+def test_migrations_backfill_in_chunks_and_record_versions(tmp_path):
+    path = str(tmp_path / 'stara.db')
+    create_old_database(path, old_records(10))
+
+    assert migrate_db.migrate_database(path, log=lambda message: None, chunk_size=3) == migrate_db.LATEST_VERSION
+
+    connection = sqlite3.connect(path)
+    versions = [row[0] for row in connection.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [version for version, _, _ in migrate_db.MIGRATIONS]
+    assert connection.execute("SELECT COUNT(*) FROM migration_progress").fetchone()[0] == 0
+    assert connection.execute("SELECT COUNT(*) FROM sleep_records WHERE day IS NULL").fetchone()[0] == 0
+    assert connection.execute(
+        "SELECT day, nap_count, nap_seconds, night_count FROM daily_sleep_summary WHERE day = '2024-01-05'"
+    ).fetchone() == ('2024-01-05', 1, 5400, 1)
+    # Okna: od drzemki 4.01 do snu nocnego (8,5 h) i od pobudki 5.01 do drzemki (3,5 h)
+    assert connection.execute(
+        "SELECT wake_window_count, wake_window_seconds FROM daily_sleep_summary WHERE day = '2024-01-05'"
+    ).fetchone() == (2, 12 * 3600)
+    assert connection.execute("SELECT COUNT(*) FROM daily_sleep_summary").fetchone()[0] == 10
+    # Id usuniętego ostatniego wpisu nie trafia do nowego wpisu
+    connection.execute("DELETE FROM sleep_records WHERE id = 20")
+    connection.execute(
+        "INSERT INTO sleep_records (sleep_time, wake_time, duration_seconds, is_nap, day) "
+        "VALUES ('2024-01-11 10:00:00.000000', '2024-01-11 11:00:00.000000', 3600, 1, '2024-01-11')"
+    )
+    assert connection.execute("SELECT MAX(id) FROM sleep_records").fetchone()[0] == 21
+    # Indeks wyszukiwania zgodny z wpisami, także po zapisie z pominięciem aplikacji
+    connection.execute("UPDATE sleep_records SET notes = 'Katar' WHERE id = 3")
+    connection.execute("INSERT INTO sleep_records_fts (sleep_records_fts, rank) VALUES ('integrity-check', 1)")
+    assert connection.execute(
+        "SELECT rowid FROM sleep_records_fts WHERE sleep_records_fts MATCH 'katar'"
+    ).fetchall() == [(3,)]
+    connection.close()
+
+    # Kolejne uruchomienie niczego nie zmienia
+    messages = []
+    migrate_db.migrate_database(path, log=messages.append)
+    assert messages == [f"Schemat jest aktualny (wersja {migrate_db.LATEST_VERSION})."]
+
+
+def test_interrupted_backfill_resumes_from_saved_position(tmp_path):
+    path = str(tmp_path / 'stara.db')
+    create_old_database(path, old_records(10))
+    connection = migrate_db.connect(path)
+    migrate_db._ensure_version_tables(connection)
+    connection.execute("ALTER TABLE sleep_records ADD COLUMN day DATE")
+    chunks = []
+
+    def apply_chunk(conn, first_id, last_id, fail_at=None):
+        if len(chunks) == fail_at:
+            raise RuntimeError("przerwano")
+        chunks.append((first_id, last_id))
+        return conn.execute("UPDATE sleep_records SET day = date(wake_time) WHERE id BETWEEN ? AND ?",
+                            (first_id, last_id)).rowcount
+
+    def null_days():
+        return connection.execute("SELECT COUNT(*) FROM sleep_records WHERE day IS NULL").fetchone()[0]
+
+    # Dwie porcje zatwierdzone, trzecia przerwana i wycofana
+    with pytest.raises(RuntimeError):
+        migrate_db.backfill(connection, 99, migrate_db._records_chunk,
+                            lambda conn, first, last: apply_chunk(conn, first, last, fail_at=2),
+                            4, lambda message: None)
+    assert migrate_db._progress(connection, 99) == 8
+    assert null_days() == 12
+
+    chunks.clear()
+    updated = migrate_db.backfill(connection, 99, migrate_db._records_chunk, apply_chunk, 4, lambda message: None)
+    assert chunks[0] == (9, 12)
+    assert updated == 12
+    assert null_days() == 0
+    connection.close()
+
+
+def test_writes_between_chunks_reach_the_rewritten_table_and_search_index(tmp_path, monkeypatch):
+    path = str(tmp_path / 'stara.db')
+    create_old_database(path, old_records(10))
+    records_chunk = migrate_db._records_chunk
+    new_row = ("INSERT INTO sleep_records (sleep_time, wake_time, notes, duration_seconds, is_nap, day) "
+               "VALUES ('2024-01-11 10:00:00.000000', '2024-01-11 11:00:00.000000', ?, 3600, 1, '2024-01-11')")
+    # Zapisy aplikacji po pierwszej porcji - do wpisów już skopiowanych i jeszcze nie
+    writes = {
+        7: ["UPDATE sleep_records SET notes = 'Katar' WHERE id = 2", "DELETE FROM sleep_records WHERE id = 1",
+            "DELETE FROM sleep_records WHERE id = 15", (new_row, ('Kaszel',))],
+        10: ["UPDATE sleep_records SET notes = 'Katar i gorączka' WHERE id = 2",
+             "UPDATE sleep_records SET notes = 'Ząbkowanie' WHERE id = 16", (new_row, ('Gorączka',))],
+    }
+
+    def interleaved_chunk(conn, last_id, chunk_size):
+        for version, statements in writes.items():
+            if last_id and migrate_db._progress(conn, version) == last_id:
+                for statement in statements:
+                    conn.execute(*statement) if isinstance(statement, tuple) else conn.execute(statement)
+                statements.clear()
+        return records_chunk(conn, last_id, chunk_size)
+
+    monkeypatch.setattr(migrate_db, '_records_chunk', interleaved_chunk)
+    assert migrate_db.migrate_database(path, log=lambda message: None, chunk_size=3) == migrate_db.LATEST_VERSION
+    assert writes == {7: [], 10: []}
+
+    connection = sqlite3.connect(path)
+    ids = [row[0] for row in connection.execute("SELECT id FROM sleep_records ORDER BY id")]
+    assert ids == [2, *range(3, 15), *range(16, 23)]
+    assert 'AUTOINCREMENT' in connection.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'sleep_records'"
+    ).fetchone()[0].upper()
+    assert {row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'sleep_records'"
+    )} >= {'ix_sleep_records_day_sleep_time', 'ix_sleep_records_wake_time', 'sleep_records_fts_insert',
+           'sleep_records_fts_delete', 'sleep_records_fts_update'}
+    assert connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE '%new%' OR name LIKE '%copy%'"
+                              ).fetchone()[0] == 0
+    connection.execute("INSERT INTO sleep_records_fts (sleep_records_fts, rank) VALUES ('integrity-check', 1)")
+    assert connection.execute(
+        "SELECT rowid FROM sleep_records_fts WHERE sleep_records_fts MATCH 'goraczka OR katar OR kaszel OR zabkowanie' "
+        "ORDER BY rowid"
+    ).fetchall() == [(2,), (16,), (21,), (22,)]
+    connection.close()
+
+
+def test_times_are_converted_to_utc_with_real_durations_across_clock_changes(tmp_path):
+    path = str(tmp_path / 'stara.db')
+    create_old_database(path, [
+        # Zmiana czasu na letni: 11 h na zegarze to 10 h snu
+        ('2024-03-30 20:00:00.000000', '2024-03-31 07:00:00.000000'),
+        # Zmiana na zimowy: "drzemka" 3,5 h na zegarze trwała 4,5 h - to sen nocny następnego dnia
+        ('2024-10-26 23:30:00.000000', '2024-10-27 03:00:00.000000'),
+    ])
+
+    migrate_db.migrate_database(path, log=lambda message: None)
+
+    connection = sqlite3.connect(path)
+    assert connection.execute(
+        "SELECT typeof(sleep_time), typeof(wake_time), duration_seconds, is_nap, day FROM sleep_records ORDER BY id"
+    ).fetchall() == [('integer', 'integer', 10 * 3600, 0, '2024-03-31'), ('integer', 'integer', 16200, 0, '2024-10-27')]
+    # 20:00 czasu zimowego w Warszawie to 19:00 UTC
+    assert connection.execute("SELECT sleep_time FROM sleep_records WHERE id = 1").fetchone()[0] == 1711825200
+    assert connection.execute(
+        "SELECT day, nap_count, night_count, night_seconds FROM daily_sleep_summary "
+        "WHERE nap_count + night_count > 0 ORDER BY day"
+    ).fetchall() == [('2024-03-31', 0, 1, 10 * 3600), ('2024-10-27', 0, 1, 16200)]
+    assert connection.execute("SELECT value FROM app_settings WHERE key = 'time_zone'").fetchone() == ('Europe/Warsaw',)
+    connection.close()
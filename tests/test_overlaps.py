@@ -0,0 +1,109 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import ActiveNap, SleepRecord, app as flask_app, db, find_all_overlaps, job_queue, verify_daily_summary
+from conftest import add
+
+
+def post_add(client, start, end, notes=''):
+    return client.post('/add', data={
+        'sleep_time': start.strftime('%Y-%m-%dT%H:%M'),
+        'wake_time': end.strftime('%Y-%m-%dT%H:%M'),
+        'notes': notes,
+    })
+
+
+def test_overlapping_record_is_rejected(client):
+    add(datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0))
+    response = post_add(client, datetime(2024, 1, 10, 13, 30), datetime(2024, 1, 10, 15, 0))
+    assert 'nakłada się' in response.get_data(as_text=True)
+    assert SleepRecord.query.count() == 1
+
+    # Wpis zaczynający się dokładnie w chwili pobudki nie nakłada się
+    post_add(client, datetime(2024, 1, 10, 14, 0), datetime(2024, 1, 10, 15, 0))
+    assert SleepRecord.query.count() == 2
+
+
+def test_edit_into_overlap_is_rejected(client):
+    add(datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0))
+    later = add(datetime(2024, 1, 10, 16, 0), datetime(2024, 1, 10, 17, 0))
+    response = client.post(f'/edit_record/{later.id}', data={
+        'sleep_time': '2024-01-10T13:30', 'wake_time': '2024-01-10T17:00', 'notes': '',
+    })
+    assert 'nakłada się' in response.get_data(as_text=True)
+    db.session.expire_all()
+    assert db.session.get(SleepRecord, later.id).sleep_time == datetime(2024, 1, 10, 16, 0)
+
+    # Przesunięcie wpisu w jego własnym przedziale jest dozwolone
+    client.post(f'/edit_record/{later.id}', data={
+        'sleep_time': '2024-01-10T16:15', 'wake_time': '2024-01-10T17:00', 'notes': '',
+    })
+    db.session.expire_all()
+    assert db.session.get(SleepRecord, later.id).sleep_time == datetime(2024, 1, 10, 16, 15)
+
+
+def test_merge_policy_joins_overlapping_records(client, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'OVERLAP_POLICY', 'merge')
+    add(datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0), notes='W wózku')
+    add(datetime(2024, 1, 10, 15, 0), datetime(2024, 1, 10, 15, 30))
+    post_add(client, datetime(2024, 1, 10, 13, 45), datetime(2024, 1, 10, 15, 10))
+
+    record = SleepRecord.query.one()
+    assert (record.sleep_time, record.wake_time, record.notes) == (
+        datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 15, 30), 'W wózku'
+    )
+    job_queue.drain()
+    assert verify_daily_summary() == []
+
+
+def test_flag_policy_saves_and_marks_overlaps(client, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'OVERLAP_POLICY', 'flag')
+    add(datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0))
+    post_add(client, datetime(2024, 1, 10, 13, 30), datetime(2024, 1, 10, 15, 0))
+    assert SleepRecord.query.count() == 2
+    html = client.get('/?date=2024-01-10').get_data(as_text=True)
+    assert html.count('Ten wpis nakłada się na inny wpis.') == 2
+
+
+def test_stop_nap_overlapping_a_record_is_rejected(client):
+    add(datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0))
+    response = client.post('/stop_nap', json={'start_time': '2024-01-10T13:30:00'})
+    assert response.status_code == 409
+
+
+def test_audit_finds_all_overlaps(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'OVERLAP_POLICY', 'flag')
+    long_night = add(datetime(2024, 1, 9, 20, 0), datetime(2024, 1, 10, 7, 0))
+    inside = add(datetime(2024, 1, 10, 2, 0), datetime(2024, 1, 10, 3, 0))
+    add(datetime(2024, 1, 10, 9, 0), datetime(2024, 1, 10, 10, 0))
+    touching = add(datetime(2024, 1, 10, 7, 0), datetime(2024, 1, 10, 8, 0))
+
+    pairs = [(earlier.id, later.id) for earlier, later in find_all_overlaps()]
+    assert pairs == [(long_night.id, inside.id)]
+    assert touching.id not in {record_id for pair in pairs for record_id in pair}
+
+    result = app.test_cli_runner().invoke(args=['audit-overlaps'])
+    assert result.exit_code == 1
+    assert f"#{inside.id}" in result.output
+
+
+def test_overlap_check_uses_indexes(app):
+    plan = db.session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM sleep_records "
+        "WHERE sleep_time < :w AND sleep_time >= :s AND wake_time > :s2"
+    ), {'w': '2024-01-10 15:00:00', 's': '2024-01-09 13:00:00', 's2': '2024-01-10 13:00:00'}).all()
+    assert not any(row[-1].startswith('SCAN sleep_records') for row in plan)
+    plan = db.session.execute(text("EXPLAIN QUERY PLAN SELECT MAX(duration_seconds) FROM sleep_records")).all()
+    assert 'ix_sleep_records_duration_seconds' in plan[0][-1]
+
+
+def test_rejected_sync_stop_keeps_the_active_nap(client):
+    add(datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0))
+    db.session.add(ActiveNap(start_time=datetime(2024, 1, 10, 13, 30)))
+    db.session.commit()
+    result = client.post('/api/sync', json={'events': [
+        {'key': 'f-1', 'type': 'stop', 'time': '2024-01-10T15:00:00'},
+    ]}).get_json()['results'][0]
+    assert result['status'] == 'error' and 'nakłada się' in result['message']
+    assert ActiveNap.query.count() == 1
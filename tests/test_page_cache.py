@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import SleepRecord, db, get_current_local_time, job_queue, page_cache
+from conftest import add
+from page_cache import LRUCache
+
+
+def count_queries(client, url, **kwargs):
+    statements = []
+    # Zapytania zadań w tle po wcześniejszych zapisach nie należą do tego żądania
+    job_queue.drain()
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url, **kwargs)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return response, len(statements)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_past_day_is_served_from_cache_with_etag(client):
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0))
+
+    first, queries = count_queries(client, '/?date=2024-01-02')
+    assert queries > 0
+    assert first.headers['ETag'] and first.headers['Last-Modified']
+
+    # Z cache - tylko sprawdzenie wersji dnia
+    second, queries = count_queries(client, '/?date=2024-01-02')
+    assert queries == 1
+    assert second.get_data() == first.get_data()
+
+    not_modified = client.get('/?date=2024-01-02', headers={'If-None-Match': first.headers['ETag']})
+    assert not_modified.status_code == 304
+
+
+def test_writes_invalidate_only_touched_days(client):
+    nap = add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0), 'Stara notatka')
+    add(datetime(2024, 1, 3, 10, 0), datetime(2024, 1, 3, 11, 0))
+    etag = client.get('/?date=2024-01-02').headers['ETag']
+    client.get('/?date=2024-01-03')
+
+    client.post(f'/edit_record/{nap.id}', data={
+        'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': 'Nowa notatka'
+    })
+    assert page_cache.get('index:2024-01-03') is not None
+    assert page_cache.get('index:2024-01-02') is None
+
+    response = client.get('/?date=2024-01-02', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Nowa notatka' in response.get_data(as_text=True)
+
+
+def test_write_from_another_worker_is_noticed(client):
+    add(datetime(2024, 1, 2, 10, 0), datetime(2024, 1, 2, 11, 0), 'Pierwsza')
+    client.get('/?date=2024-01-02')
+    stale = page_cache.get('index:2024-01-02')
+
+    # Inny worker zapisał wpis, a nasz cache o tym nie wie
+    add(datetime(2024, 1, 2, 13, 0), datetime(2024, 1, 2, 14, 0), 'Druga')
+    page_cache.set('index:2024-01-02', stale)
+    assert 'Druga' in client.get('/?date=2024-01-02').get_data(as_text=True)
+
+    record = SleepRecord.query.filter_by(notes='Druga').one()
+    client.get('/?date=2024-01-02')
+    stale = page_cache.get('index:2024-01-02')
+    db.session.delete(record)
+    db.session.commit()
+    page_cache.set('index:2024-01-02', stale)
+    assert 'Druga' not in client.get('/?date=2024-01-02').get_data(as_text=True)
+
+
+def test_today_page_recomputes_time_since_last_nap(client):
+    wake_time = get_current_local_time().replace(tzinfo=None, second=0, microsecond=0)
+    start_of_today = wake_time.replace(hour=0, minute=0)
+    add(max(wake_time - timedelta(minutes=10), start_of_today), wake_time)
+
+    response = client.get('/')
+    assert 'Last-Modified' not in response.headers
+    assert page_cache.get('index:' + wake_time.date().isoformat())['html'] is None
+    assert 'Brak danych' not in response.get_data(as_text=True)
@@ -0,0 +1,58 @@
+from datetime import date, datetime
+
+import pytest
+
+import app as app_module
+import prediction
+import synthetic_history
+import timezones
+from app import (SleepRecord, bulk_insert_records, classify_sleep, db, fit_nap_model, get_nap_model, job_queue,
+                 nap_model_key, nap_models)
+
+NOW = datetime(2024, 3, 20, 15, 0)
+ZONE = timezones.get_zone(timezones.DEFAULT_ZONE)
+
+
+def test_backtest_beats_plain_average():
+    records = [
+        (sleep_time, wake_time, classify_sleep(sleep_time, wake_time)[1])
+        for sleep_time, wake_time, _, _ in synthetic_history.generate_history(2000, seed=7)
+    ]
+    result = prediction.backtest(records)
+    assert result == prediction.backtest(records)
+    assert result['predicted'] > 0.9 * result['naps']
+    assert result['mae_minutes'] < result['baseline_mae_minutes']
+    assert 0.4 < result['coverage'] < 0.8
+
+
+def test_cached_model_observes_new_naps_and_is_refitted_after_edits(app, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_current_local_time', lambda: NOW.replace(tzinfo=ZONE))
+    bulk_insert_records(list(synthetic_history.generate_history(60, seed=3, end=date(2024, 3, 19))) + [
+        (datetime(2024, 3, 19, 20, 0), datetime(2024, 3, 20, 6, 30), '', None),
+        (datetime(2024, 3, 20, 9, 0), datetime(2024, 3, 20, 10, 0), '', None),
+    ])
+    assert 'Następna drzemka: ok.' in client.get('/').get_data(as_text=True)
+
+    cached = get_nap_model()
+    observations = cached.observations
+    client.post('/stop_nap', json={'start_time': '2024-03-20T14:00:00'})
+    job_queue.drain()
+    # Najnowsza drzemka trafia do modelu w pamięci przez observe, bez uczenia od nowa
+    model = nap_models.get(nap_model_key())
+    assert model is cached
+    assert model.observations == observations + 1
+    refitted = fit_nap_model()
+    assert model.weights == pytest.approx(refitted.weights)
+    assert model.sums == pytest.approx(refitted.sums)
+
+    oldest = SleepRecord.query.order_by(SleepRecord.sleep_time).first()
+    client.post(f'/edit_record/{oldest.id}', data={
+        'sleep_time': oldest.sleep_time.strftime('%Y-%m-%dT%H:%M'),
+        'wake_time': oldest.wake_time.replace(minute=59).strftime('%Y-%m-%dT%H:%M'),
+        'notes': '',
+    })
+    job_queue.drain()
+    db.session.expire_all()
+    edited = nap_models.get(nap_model_key())
+    assert edited is not model
+    assert edited.sums == pytest.approx(fit_nap_model().sums)
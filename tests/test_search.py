@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import search
+from app import bulk_insert_records, db, verify_search_index
+from conftest import add as add_record
+
+
+def add(day, notes, hour=10):
+    return add_record(datetime(2024, 1, day, hour, 0), datetime(2024, 1, day, hour + 1, 0), notes)
+
+
+def found(client, query, page=1):
+    data = client.get('/api/search', query_string={'q': query, 'page': page}).get_json()
+    return [result['id'] for result in data['results']], data
+
+
+def test_query_and_snippet_helpers():
+    terms = search.query_terms('Gorączka AND "podróż*')
+    assert terms == ['goraczka', 'and', 'podroz']
+    assert search.match_query(terms) == '"goraczka" "and" "podroz"*'
+    assert search.match_query(search.query_terms('  ?!  ')) is None
+
+    snippet = search.snippet('<b>Katar</b> i podróżowanie', search.query_terms('katar podroz'))
+    assert str(snippet) == '&lt;b&gt;<mark>Katar</mark>&lt;/b&gt; i <mark>podróżowanie</mark>'
+    long_note = ' '.join(f'słowo{number}' for number in range(40)) + ' gorączka na koniec'
+    cut = str(search.snippet(long_note, ['goraczka'], size=6))
+    assert cut == '… słowo39 <mark>gorączka</mark> na koniec'
+
+
+def test_index_follows_inserts_edits_and_deletes(client):
+    sick = add(2, 'Gorączka, źle spał')
+    travel = add(3, 'Podróż do babci, spał w aucie')
+    add(4, 'Drzemka nr 1')
+    bulk_insert_records([(datetime(2024, 1, 5, 10, 0), datetime(2024, 1, 5, 11, 0), 'Znowu gorączka', None)])
+
+    assert len(found(client, 'goraczka')[0]) == 2
+    assert found(client, 'podr')[0] == [travel.id]
+    # Automatyczne etykiety nie trafiają do indeksu
+    assert found(client, 'drzemka')[0] == []
+
+    client.post(f'/edit_record/{sick.id}', data={
+        'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': 'Katar'
+    })
+    client.post(f'/delete_record/{travel.id}')
+    assert found(client, 'katar')[0] == [sick.id]
+    assert len(found(client, 'goraczka')[0]) == 1
+    assert found(client, 'podroz')[0] == []
+    assert verify_search_index()
+
+
+def test_results_are_ranked_paginated_and_highlighted(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'SEARCH_PAGE_SIZE', 2)
+    weak = add(2, 'Katar, ale spał dobrze i długo po spacerze w parku')
+    strong = add(3, 'Katar katar')
+    middle = add(4, 'Katar <i>wieczorem</i>')
+
+    ids, data = found(client, 'katar')
+    assert ids == [strong.id, middle.id] and data['has_more']
+    assert data['results'][1]['snippet'] == '<mark>Katar</mark> &lt;i&gt;wieczorem&lt;/i&gt;'
+    ids, data = found(client, 'katar', page=2)
+    assert ids == [weak.id] and not data['has_more']
+
+    # Poza oknem trafności starsze trafienia idą od najnowszych
+    monkeypatch.setattr(search, 'RANK_WINDOW', 1)
+    assert found(client, 'katar')[0] == [middle.id, strong.id]
+    assert found(client, 'katar', page=2)[0] == [weak.id]
+
+    assert client.get('/api/search?q=katar&page=0').status_code == 400
+    assert client.get('/api/search?q=%20').status_code == 400
+    html = client.get('/search?q=katar').get_data(as_text=True)
+    assert '<mark>Katar</mark> &lt;i&gt;wieczorem&lt;/i&gt;' in html
+    assert 'page=2' in html
+
+
+def test_rebuild_command_restores_a_broken_index(app, client):
+    record = add(2, 'Ząbki')
+    # Zapis z pominięciem wyzwalaczy rozsynchronizowuje indeks
+    db.session.execute(db.text("DROP TRIGGER sleep_records_fts_update"))
+    record.notes = 'Szczepienie'
+    db.session.commit()
+    assert not verify_search_index()
+
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['rebuild-search', '--verify']).exit_code == 1
+    result = runner.invoke(args=['rebuild-search'])
+    assert result.exit_code == 0 and 'Zaindeksowano notatki 1 wpisów.' in result.output
+    assert found(client, 'szczepienie')[0] == [record.id]
+    assert found(client, 'zabki')[0] == []
+    assert runner.invoke(args=['rebuild-search', '--verify']).exit_code == 0
@@ -4,9 +4,9 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.microsoft import EdgeChromiumDriverManager
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import pytest
-import pytz
 import time
 import os
 
@@ -62,7 +62,7 @@ def test_timezone_consistency(driver):
         try:
             # Parse the timestamp and check timezone
             dt = datetime.strptime(timestamp_text, "%Y-%m-%d %H:%M:%S")
-            dt = pytz.UTC.localize(dt).astimezone(local_tz)
+            dt = dt.replace(tzinfo=timezone.utc).astimezone(local_tz)
             
             # Verify the displayed time matches the expected local time
             expected_display = dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -167,7 +167,7 @@ def test_timezone_handling(driver):
     driver.get("http://localhost:5000/add")
     
     # Add a sleep record
-    local_tz = pytz.timezone('Europe/Warsaw')
+    local_tz = ZoneInfo('Europe/Warsaw')
     current_time = datetime.now(local_tz)
     sleep_time = current_time - timedelta(hours=1)
     wake_time = current_time
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from app import ActiveNap, DailySleepSummary, SleepRecord, bulk_insert_records, db
+
+
+def sync(client, events=(), cursor=None):
+    payload = {'events': list(events)}
+    if cursor is not None:
+        payload['cursor'] = cursor
+    response = client.post('/api/sync', json=payload)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+OFFLINE_NAP = [
+    {'key': 'a-1', 'type': 'start', 'time': '2024-01-10T13:00:00+01:00'},
+    {'key': 'a-2', 'type': 'stop', 'time': '2024-01-10T12:30:00Z'},
+    {'key': 'a-3', 'type': 'edit', 'record_key': 'a-2', 'sleep_time': '2024-01-10T13:05:00',
+     'wake_time': '2024-01-10T13:30:00', 'notes': 'W wózku'},
+]
+
+
+def test_offline_events_are_applied_in_one_batch(client):
+    data = sync(client, OFFLINE_NAP)
+    assert [result['status'] for result in data['results']] == ['applied'] * 3
+    record = SleepRecord.query.one()
+    assert (record.sleep_time, record.wake_time, record.notes) == (
+        datetime(2024, 1, 10, 13, 5), datetime(2024, 1, 10, 13, 30), 'W wózku'
+    )
+    assert ActiveNap.query.count() == 0
+    assert data['active_nap']['active'] is False
+    assert [r['id'] for r in data['records']] == [record.id]
+    assert data['records'][0]['label'] == 'W wózku'
+    assert db.session.get(DailySleepSummary, record.day).nap_seconds == 25 * 60
+
+
+def test_retried_batch_is_deduplicated(client):
+    first = sync(client, OFFLINE_NAP)
+    retry = sync(client, OFFLINE_NAP)
+    assert [result['status'] for result in retry['results']] == ['duplicate'] * 3
+    assert retry['results'][1]['record_id'] == first['results'][1]['record_id']
+    assert SleepRecord.query.count() == 1
+
+
+def test_invalid_events_are_reported_and_can_be_resent(client):
+    data = sync(client, [
+        {'key': 'b-1', 'type': 'stop', 'time': '2024-01-10T14:00:00'},
+        {'key': 'b-2', 'type': 'rate', 'record_id': 12345, 'rating': 4},
+        {'type': 'start'},
+    ])
+    assert [result['status'] for result in data['results']] == ['error'] * 3
+    assert data['results'][0]['message'] == 'Brak aktywnej drzemki.'
+    assert SleepRecord.query.count() == 0
+
+    fixed = sync(client, [{'key': 'b-1', 'type': 'stop', 'start_time': '2024-01-10T13:00:00',
+                           'time': '2024-01-10T14:00:00'}])
+    assert fixed['results'][0]['status'] == 'applied'
+
+
+def test_rating_a_night_from_sync(client):
+    data = sync(client, [
+        {'key': 'c-1', 'type': 'stop', 'start_time': '2024-01-09T20:00:00', 'time': '2024-01-10T06:00:00'},
+        {'key': 'c-2', 'type': 'rate', 'record_key': 'c-1', 'rating': 5},
+    ])
+    assert data['results'][0]['is_night_sleep'] is True
+    assert SleepRecord.query.one().sleep_rating == 5
+
+
+def test_cursor_returns_only_newer_changes_and_deletions(client):
+    first = sync(client, [{'key': 'd-1', 'type': 'stop', 'start_time': '2024-01-10T13:00:00',
+                           'time': '2024-01-10T14:00:00'}])
+    assert len(first['records']) == 1
+    assert sync(client, cursor=first['cursor'])['records'] == []
+
+    record_id = first['records'][0]['id']
+    client.post(f'/delete_record/{record_id}')
+    after_delete = sync(client, cursor=first['cursor'])
+    assert after_delete['deleted'] == [record_id]
+    assert after_delete['cursor'] > first['cursor']
+
+
+def test_changes_are_paginated(app, client):
+    app.config['SYNC_PAGE_SIZE'] = 2
+    try:
+        sync(client, [
+            {'key': f'e-{hour}', 'type': 'stop', 'start_time': f'2024-01-10T{hour:02d}:00:00',
+             'time': f'2024-01-10T{hour:02d}:30:00'}
+            for hour in range(10, 15)
+        ])
+        page = sync(client)
+        seen = [record['id'] for record in page['records']]
+        while page['has_more']:
+            page = sync(client, cursor=page['cursor'])
+            seen += [record['id'] for record in page['records']]
+    finally:
+        app.config['SYNC_PAGE_SIZE'] = 500
+    assert sorted(seen) == [record.id for record in SleepRecord.query.order_by(SleepRecord.id)]
+
+
+def test_rejects_malformed_requests(client):
+    assert client.post('/api/sync', data='nie json').status_code == 400
+    assert client.post('/api/sync', json={'events': {}}).status_code == 400
+    assert client.post('/api/sync', json={'cursor': 'x'}).status_code == 400
+
+
+def test_bulk_imported_records_reach_the_change_feed(client):
+    bulk_insert_records([
+        (datetime(2024, 1, 10, 13, 0), datetime(2024, 1, 10, 14, 0), '', None),
+        (datetime(2024, 1, 10, 20, 0), datetime(2024, 1, 11, 6, 0), '', 4),
+    ])
+    assert len(sync(client)['records']) == 2
@@ -0,0 +1,171 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import app as app_module
+import asgi
+from tenants import TenantEngines, is_valid_tenant_id
+
+
+class FakeEngine:
+    def __init__(self, tenant_id):
+        self.tenant_id = tenant_id
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+def test_tenant_id_validation():
+    assert is_valid_tenant_id('kowalscy-1')
+    assert not is_valid_tenant_id('../etc/passwd')
+    assert not is_valid_tenant_id('')
+
+
+def test_engine_lru_evicts_and_disposes_least_recently_used():
+    engines = TenantEngines(FakeEngine, maxsize=2)
+    a = engines.get('a')
+    engines.get('b')
+    assert engines.get('a') is a
+    engines.get('c')
+    assert 'b' not in engines and 'a' in engines and 'c' in engines
+    assert len(engines) == 2
+
+
+def test_idle_engines_are_disposed():
+    engines = TenantEngines(FakeEngine, maxsize=10, idle_seconds=0)
+    a = engines.get('a')
+    assert engines.evict_idle() == 1
+    assert a.disposed and len(engines) == 0
+
+
+def test_slow_open_blocks_neither_other_tenants_nor_opens_twice():
+    opened = []
+    started, release = threading.Event(), threading.Event()
+
+    def factory(tenant_id):
+        opened.append(tenant_id)
+        if tenant_id == 'wolna':
+            # Np. migracja dużej bazy
+            started.set()
+            release.wait(5)
+        return FakeEngine(tenant_id)
+
+    engines = TenantEngines(factory)
+    threads = [threading.Thread(target=engines.get, args=('wolna',)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    engines.get('szybka')
+    assert 'szybka' in engines and 'wolna' not in engines
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert sorted(opened) == ['szybka', 'wolna']
+
+
+@pytest.fixture
+def tenant_app(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'TENANT_MODE', True)
+    monkeypatch.setitem(app.config, 'TENANT_DB_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'TENANTS', ['nowak', 'kowalski'])
+    engines = TenantEngines(app_module._open_tenant_engine, maxsize=2)
+    monkeypatch.setattr(app_module, 'tenant_engines', engines)
+    yield app
+    engines.dispose_all()
+
+
+def test_requests_are_routed_to_tenant_databases(tenant_app, tmp_path):
+    client = tenant_app.test_client()
+    form = {'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': 'Nowakowie'}
+    client.post('/add', data=form, headers={'X-Tenant-ID': 'nowak'})
+
+    assert 'Nowakowie' in client.get('/?date=2024-01-02', headers={'X-Tenant-ID': 'nowak'}).get_data(as_text=True)
+    assert 'Nowakowie' not in client.get('/?date=2024-01-02', headers={'X-Tenant-ID': 'kowalski'}).get_data(as_text=True)
+    assert (tmp_path / 'nowak.db').exists() and (tmp_path / 'kowalski.db').exists()
+
+    assert client.get('/').status_code == 400
+
+    # ?tenant= zapamiętuje rodzinę w ciasteczku
+    client.get('/?date=2024-01-02&tenant=nowak')
+    assert 'Nowakowie' in client.get('/?date=2024-01-02').get_data(as_text=True)
+
+
+def test_existing_tenant_database_is_migrated_on_first_use(tenant_app, tmp_path):
+    connection = sqlite3.connect(tmp_path / 'stara.db')
+    connection.execute(
+        "CREATE TABLE sleep_records (id INTEGER PRIMARY KEY, sleep_time DATETIME NOT NULL, "
+        "wake_time DATETIME NOT NULL, notes VARCHAR(200), created_at DATETIME)"
+    )
+    connection.execute(
+        "INSERT INTO sleep_records (sleep_time, wake_time, notes) "
+        "VALUES ('2024-01-02 10:00:00.000000', '2024-01-02 11:30:00.000000', 'Drzemka nr 1')"
+    )
+    connection.commit()
+    connection.close()
+
+    html = tenant_app.test_client().get('/?date=2024-01-02', headers={'X-Tenant-ID': 'stara'}).get_data(as_text=True)
+    assert 'Drzemka nr 1' in html
+    assert 'Liczba drzemek: 1' in html
+
+
+def test_unknown_tenant_gets_404_without_a_database_file(tenant_app, tmp_path):
+    client = tenant_app.test_client()
+    assert client.get('/', headers={'X-Tenant-ID': 'obcy'}).status_code == 404
+    assert client.get('/?tenant=obcy').status_code == 404
+    assert not (tmp_path / 'obcy.db').exists()
+
+
+def test_cli_commands_take_the_tenant_option(tenant_app, tmp_path):
+    runner = tenant_app.test_cli_runner()
+    result = runner.invoke(args=['rebuild-summary', '--tenant', 'obcy'])
+    assert result.exit_code != 0 and 'init-db --tenant obcy' in result.output
+    assert not (tmp_path / 'obcy.db').exists()
+
+    # init-db dodaje nową rodzinę, potem widzą ją pozostałe komendy i żądania
+    assert runner.invoke(args=['init-db', '--tenant', 'obcy']).exit_code == 0
+    assert (tmp_path / 'obcy.db').exists()
+    tenant_app.test_client().post('/add', headers={'X-Tenant-ID': 'obcy'}, data={
+        'sleep_time': '2024-01-02T10:00', 'wake_time': '2024-01-02T11:00', 'notes': 'Obcy'
+    })
+
+    result = runner.invoke(args=['rebuild-summary', '--verify'])
+    assert result.exit_code == 0
+    assert [line.split(':')[0] for line in result.output.splitlines()] == ['kowalski', 'nowak', 'obcy']
+    result = runner.invoke(args=['export-records', '--tenant', 'obcy'])
+    assert result.exit_code == 0 and 'Obcy' in result.output
+    assert runner.invoke(args=['export-records']).exit_code != 0
+    assert runner.invoke(args=['audit-overlaps', '--tenant', 'obcy']).exit_code == 0
+    for command in ('rolling-stats', 'prune-sync-keys'):
+        result = runner.invoke(args=[command, '--tenant', 'obcy'])
+        assert result.exit_code == 0 and result.output.startswith('obcy: '), (command, result.output)
+
+
+def test_async_write_lock_survives_database_eviction(tenant_app, monkeypatch):
+    monkeypatch.setitem(tenant_app.config, 'TENANT_ENGINE_CACHE_SIZE', 1)
+
+    async def scenario():
+        try:
+            first = await asgi.get_database('nowak')
+            await asgi.get_database('kowalski')
+            # Żądanie w toku może wciąż pisać przez usuniętą bazę - nowa musi czekać na tę samą blokadę
+            reopened = await asgi.get_database('nowak')
+            return first, reopened
+        finally:
+            await asgi.dispose_databases()
+
+    first, reopened = asyncio.run(scenario())
+    assert reopened is not first and reopened.write_lock is first.write_lock
+
+
+def test_import_script_rejects_the_tenant_option_outside_tenant_mode(app, tmp_path, monkeypatch):
+    import import_records
+    path = tmp_path / 'wpisy.csv'
+    path.write_text('sleep_time,wake_time,notes,sleep_rating\n2024-01-02T10:00,2024-01-02T11:00,,\n')
+    monkeypatch.setattr('sys.argv', ['import_records.py', str(path), '--tenant', 'nowak'])
+    with pytest.raises(SystemExit) as exit_info:
+        import_records.main()
+    assert exit_info.value.code != 0
+    assert app_module.SleepRecord.query.count() == 0
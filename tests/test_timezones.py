@@ -0,0 +1,96 @@
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+import app as app_module
+import timezones
+from app import DailySleepSummary, SleepRecord, db, job_queue, set_time_zone, verify_daily_summary
+
+WARSAW = timezones.get_zone('Europe/Warsaw')
+
+
+def test_round_trip_keeps_the_repeated_hour_apart():
+    first = datetime(2024, 10, 27, 2, 30)
+    second = first.replace(fold=1)
+    assert timezones.to_epoch(second, WARSAW) - timezones.to_epoch(first, WARSAW) == 3600
+    for local in (first, second, datetime(2024, 7, 1, 12, 0), datetime(2024, 1, 1, 0, 0)):
+        restored = timezones.from_epoch(timezones.to_epoch(local, WARSAW), WARSAW)
+        assert (restored, restored.fold) == (local, local.fold)
+
+
+def test_seconds_between_counts_elapsed_time_across_clock_changes():
+    assert timezones.seconds_between(datetime(2024, 3, 30, 20, 0), datetime(2024, 3, 31, 7, 0), WARSAW) == 10 * 3600
+    assert timezones.seconds_between(datetime(2024, 10, 26, 20, 0), datetime(2024, 10, 27, 7, 0), WARSAW) == 12 * 3600
+    assert timezones.shift(datetime(2024, 3, 31, 1, 30), 3600, WARSAW) == datetime(2024, 3, 31, 3, 30)
+
+
+def test_parse_local_converts_offsets_to_the_family_zone():
+    assert timezones.parse_local('2024-07-01T10:00:00Z', WARSAW) == datetime(2024, 7, 1, 12, 0)
+    assert timezones.parse_local('2024-07-01T10:00:00-04:00', WARSAW) == datetime(2024, 7, 1, 16, 0)
+    assert timezones.parse_local('2024-07-01T10:00', WARSAW) == datetime(2024, 7, 1, 10, 0)
+    assert timezones.isoformat(datetime(2024, 1, 1, 8, 0), WARSAW) == '2024-01-01T08:00:00+01:00'
+
+
+def test_night_of_the_clock_change_is_stored_as_utc_seconds(client):
+    client.post('/add', data={'sleep_time': '2024-03-30T20:00', 'wake_time': '2024-03-31T07:00', 'notes': ''})
+
+    record = SleepRecord.query.one()
+    assert (record.duration_seconds, record.is_nap, record.day) == (10 * 3600, False, date(2024, 3, 31))
+    assert record.sleep_time == datetime(2024, 3, 30, 20, 0)
+    stored = db.session.execute(text("SELECT typeof(sleep_time), sleep_time FROM sleep_records")).one()
+    assert tuple(stored) == ('integer', int(datetime(2024, 3, 30, 19, 0, tzinfo=timezone.utc).timestamp()))
+    assert db.session.get(DailySleepSummary, date(2024, 3, 31)).night_seconds == 10 * 3600
+    payload = client.get('/api/naps?date=2024-03-31').get_json()['records'][0]
+    assert (payload['sleep_time'], payload['wake_time']) == ('2024-03-30T20:00:00+01:00', '2024-03-31T07:00:00+02:00')
+
+
+def test_stop_nap_converts_a_client_time_with_an_offset(client, monkeypatch):
+    now = datetime(2024, 7, 1, 14, 0, tzinfo=WARSAW)
+    monkeypatch.setattr(app_module, 'get_current_local_time', lambda: now)
+
+    response = client.post('/stop_nap', json={'start_time': '2024-07-01T10:30:00Z'})
+    assert response.status_code == 200
+    record = SleepRecord.query.one()
+    assert (record.sleep_time, record.wake_time, record.duration_seconds) == (
+        datetime(2024, 7, 1, 12, 30), datetime(2024, 7, 1, 14, 0), 5400
+    )
+    assert client.post('/stop_nap', json={'start_time': 'wczoraj'}).status_code == 400
+
+
+def test_changing_the_time_zone_moves_records_to_their_local_days(app, monkeypatch):
+    monkeypatch.setattr(app_module, '_time_zones', {})
+    db.session.add(SleepRecord(sleep_time=datetime(2024, 1, 1, 23, 30), wake_time=datetime(2024, 1, 2, 0, 30), notes=''))
+    db.session.commit()
+    instant = db.session.execute(text("SELECT sleep_time FROM sleep_records")).scalar()
+
+    # 22:30 UTC to w Londynie jeszcze 1 stycznia, a w Tokio już 2 stycznia rano
+    assert set_time_zone('Europe/London') == 0
+    assert set_time_zone('Asia/Tokyo') == 1
+    db.session.expire_all()
+    record = SleepRecord.query.one()
+    assert record.day == date(2024, 1, 2)
+    assert record.sleep_time == datetime(2024, 1, 2, 7, 30)
+    assert db.session.execute(text("SELECT sleep_time FROM sleep_records")).scalar() == instant
+    assert verify_daily_summary() == []
+    assert record.wake_time - record.sleep_time == timedelta(hours=1)
+
+
+def test_stats_count_a_clock_change_night_like_the_daily_summary(client):
+    # 3 h 45 min na zegarze, ale 4 h 45 min snu - sen nocny, jak w podsumowaniu dnia
+    client.post('/add', data={'sleep_time': '2024-10-27T01:30', 'wake_time': '2024-10-27T05:15', 'notes': ''})
+    client.post('/add', data={'sleep_time': '2024-10-27T09:15', 'wake_time': '2024-10-27T10:00', 'notes': ''})
+    # Okno aktywności przez zmianę czasu na letni: 3 h na zegarze, 2 h naprawdę
+    client.post('/add', data={'sleep_time': '2024-03-31T00:30', 'wake_time': '2024-03-31T01:30', 'notes': ''})
+    client.post('/add', data={'sleep_time': '2024-03-31T04:30', 'wake_time': '2024-03-31T05:00', 'notes': ''})
+    job_queue.drain()
+    db.session.expire_all()
+
+    summary = db.session.get(DailySleepSummary, date(2024, 10, 27))
+    bucket = client.get('/api/stats?from=2024-10-27&to=2024-10-27').get_json()['buckets'][0]
+    assert (bucket['night_count'], bucket['night_seconds'], bucket['nap_count']) == (1, 17100, 1)
+    assert (summary.night_count, summary.night_seconds, summary.nap_count) == (1, 17100, 1)
+
+    summary = db.session.get(DailySleepSummary, date(2024, 3, 31))
+    bucket = client.get('/api/stats?from=2024-03-31&to=2024-03-31').get_json()['buckets'][0]
+    assert (bucket['wake_window_count'], bucket['avg_wake_window_seconds']) == (1, 2 * 3600)
+    assert (summary.wake_window_count, summary.wake_window_seconds) == (1, 2 * 3600)
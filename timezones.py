@@ -0,0 +1,113 @@
+"""Conversions between stored UTC epoch seconds and a family's local time (zoneinfo).
+
+Sleep times are stored as integer seconds since the Unix epoch (UTC), so
+ranges and durations are plain integer arithmetic and do not depend on
+the time zone. The app works with naive local datetimes: `fold`
+tells the two occurrences of an hour apart when clocks go back, and all
+conversions here honour it. Wall-clock differences of naive datetimes
+are off by an hour across a DST change - durations are taken between
+epoch seconds instead (seconds_between).
+"""
+import functools
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Strefa nowych baz; wcześniejsze wersje zapisywały zawsze lokalny czas warszawski
+DEFAULT_ZONE = 'Europe/Warsaw'
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def is_valid_zone(name):
+    """Check that name is an IANA time zone available on this system"""
+    try:
+        get_zone(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    """ZoneInfo for an IANA name, raises ZoneInfoNotFoundError for unknown names"""
+    return ZoneInfo(name)
+
+
+@functools.lru_cache(maxsize=65536)
+def _steady_offset(zone, day_number):
+    """UTC offset in seconds when it stays the same from a day before to a day after day_number, else None.
+
+    Such a day has no skipped or repeated hours, whether counted in UTC or
+    in local time, so conversions need only this one number.
+    """
+    offsets = {
+        zone.fromutc((_EPOCH + timedelta(days=day_number + days)).replace(tzinfo=zone)).utcoffset()
+        for days in (-1, 0, 1, 2)
+    }
+    return offsets.pop() // _SECOND if len(offsets) == 1 else None
+
+
+def to_epoch(local, zone):
+    """UTC epoch seconds of a naive local time (or an aware datetime), fractions of a second dropped"""
+    if local.tzinfo is not None:
+        return (local.astimezone(timezone.utc).replace(tzinfo=None) - _EPOCH) // _SECOND
+    elapsed = local - _EPOCH
+    offset = _steady_offset(zone, elapsed.days)
+    if offset is None:
+        # Dzień zmiany czasu - utcoffset uwzględnia fold
+        offset = local.replace(tzinfo=zone).utcoffset() // _SECOND
+    # Arytmetyka na liczbach całkowitych - bez zaokrągleń float z timestamp(); days i seconds
+    # timedelty są już zaokrąglone w dół, a to szybsze niż dzielenie przez _SECOND przy imporcie
+    return elapsed.days * 86400 + elapsed.seconds - offset
+
+
+def from_epoch(seconds, zone):
+    """Naive local time of UTC epoch seconds, with fold set for the repeated hour"""
+    offset = _steady_offset(zone, seconds // 86400)
+    if offset is not None:
+        return _EPOCH + timedelta(seconds=seconds + offset)
+    utc = _EPOCH + timedelta(seconds=seconds)
+    return zone.fromutc(utc.replace(tzinfo=zone)).replace(tzinfo=None)
+
+
+def local_day(seconds, zone):
+    """Local calendar day of UTC epoch seconds"""
+    return from_epoch(seconds, zone).date()
+
+
+def seconds_between(start, end, zone):
+    """Elapsed seconds between two naive local times, correct across DST changes"""
+    return to_epoch(end, zone) - to_epoch(start, zone)
+
+
+def shift(local, seconds, zone):
+    """Naive local time `seconds` of elapsed time after (or before) local"""
+    return from_epoch(to_epoch(local, zone) + seconds, zone)
+
+
+def to_local(value, zone):
+    """Naive local time in zone; aware datetimes are converted, naive ones are already local"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(zone).replace(tzinfo=None)
+
+
+def parse_local(text, zone):
+    """Parse ISO 8601 from a client into naive local time; times without an offset are local.
+
+    Raises ValueError for anything that is not an ISO time.
+    """
+    if not isinstance(text, str):
+        raise ValueError(f"Invalid ISO time: {text!r}")
+    return to_local(datetime.fromisoformat(text.strip().replace('Z', '+00:00')), zone)
+
+
+def isoformat(local, zone):
+    """ISO 8601 with the UTC offset in effect at that local time (e.g. +02:00 in summer)"""
+    return local.replace(tzinfo=zone).isoformat()
+
+
+def now(zone):
+    """Current time in zone, as an aware datetime"""
+    return datetime.now(timezone.utc).astimezone(zone)